@@ -0,0 +1,83 @@
+# activity_tracker.py - ОТЛОЖЕННАЯ ЗАПИСЬ last_active ПАЧКАМИ
+import asyncio
+import os
+from datetime import datetime
+from sqlalchemy import update, case
+import database
+
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "5"))
+ACTIVITY_FLUSH_BATCH = 500
+
+class ActivityTracker:
+    """Копит время активности пользователей в памяти и пишет его одним UPDATE раз в interval секунд"""
+
+    def __init__(self, interval=ACTIVITY_FLUSH_INTERVAL, session_factory=None):
+        self.interval = interval
+        self.session_factory = session_factory or database.AsyncSessionLocal
+        self._pending = {}  # user_id -> datetime
+        self._stopping = asyncio.Event()
+        self._task = None
+        self.flushes = 0
+        self.rows_written = 0
+
+    def touch(self, user_id: int, when: datetime = None) -> datetime:
+        """Отметить активность пользователя; запись в базу — при следующем сбросе"""
+        when = when or datetime.utcnow()
+        previous = self._pending.get(user_id)
+        if previous is None or previous < when:
+            self._pending[user_id] = when
+        return when
+
+    async def flush(self):
+        """Записать накопленные отметки; возвращает число обновленных пользователей"""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        items = list(pending.items())
+        try:
+            async with self.session_factory() as db:
+                for start in range(0, len(items), ACTIVITY_FLUSH_BATCH):
+                    chunk = dict(items[start:start + ACTIVITY_FLUSH_BATCH])
+                    await db.execute(
+                        update(database.User)
+                        .where(database.User.id.in_(list(chunk)))
+                        .values(last_active=case(chunk, value=database.User.id))
+                        .execution_options(synchronize_session=False)
+                    )
+                await db.commit()
+        except BaseException:
+            # Возвращаем отметки обратно, чтобы не потерять их до следующей попытки —
+            # в том числе когда сброс отменили посреди записи
+            for user_id, when in items:
+                self.touch(user_id, when)
+            raise
+        self.flushes += 1
+        self.rows_written += len(items)
+        return len(items)
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️  Не удалось записать last_active: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновый сброс и записать остаток"""
+        if self._task is not None:
+            # Не отменяем задачу: идущий сброс дописывает пачку, цикл завершается сам
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+activity_tracker = ActivityTracker()
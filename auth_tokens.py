@@ -0,0 +1,96 @@
+# auth_tokens.py - ПРОВЕРКА initData TELEGRAM И ПОДПИСАННЫЕ ТОКЕНЫ СЕССИИ
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import time
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qsl
+
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+INIT_DATA_MAX_AGE = int(os.getenv("INIT_DATA_MAX_AGE", str(24 * 3600)))
+
+# user_id, telegram_id, истекает (unix-время); подпись — первые 16 байт HMAC-SHA256
+_PAYLOAD = struct.Struct(">QQI")
+_SIGNATURE_SIZE = 16
+
+class SessionClaims(NamedTuple):
+    user_id: Optional[int]
+    telegram_id: int
+    expires_at: Optional[int]
+
+def _session_secret() -> bytes:
+    """Ключ подписи токенов: SESSION_SECRET, иначе производный от токена бота"""
+    secret = os.getenv("SESSION_SECRET")
+    if secret:
+        return secret.encode()
+    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if bot_token:
+        return hmac.new(b"SessionToken", bot_token.encode(), hashlib.sha256).digest()
+    print("⚠️  SESSION_SECRET не задан: токены сессии действуют только до перезапуска процесса")
+    return os.urandom(32)
+
+SESSION_SECRET = _session_secret()
+
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(SESSION_SECRET, payload, hashlib.sha256).digest()[:_SIGNATURE_SIZE]
+
+def issue_session_token(user_id: int, telegram_id: int, ttl: int = SESSION_TTL) -> str:
+    """Выпустить токен сессии с id пользователя и сроком действия"""
+    payload = _PAYLOAD.pack(user_id, telegram_id, int(time.time()) + ttl)
+    return base64.urlsafe_b64encode(payload + _sign(payload)).rstrip(b"=").decode()
+
+def verify_session_token(token: str) -> Optional[SessionClaims]:
+    """Проверить подпись и срок токена без обращения к базе"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (ValueError, TypeError):
+        return None
+    if len(raw) != _PAYLOAD.size + _SIGNATURE_SIZE:
+        return None
+    payload, signature = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+    if not hmac.compare_digest(_sign(payload), signature):
+        return None
+    claims = SessionClaims(*_PAYLOAD.unpack(payload))
+    if claims.expires_at < time.time():
+        return None
+    return claims
+
+class InitDataVerifier:
+    """Проверка initData Telegram Web App с заранее вычисленным секретом"""
+
+    def __init__(self, bot_token: str, max_age: int = INIT_DATA_MAX_AGE):
+        self.secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+        self.max_age = max_age
+        # Клиент повторяет одну и ту же строку initData при каждом входе
+        self._check = lru_cache(maxsize=1024)(self._check_signature)
+
+    def _check_signature(self, init_data: str) -> Optional[dict]:
+        try:
+            fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+        except ValueError:
+            return None
+        received_hash = fields.pop("hash", None)
+        if not received_hash:
+            return None
+        check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+        calculated_hash = hmac.new(self.secret_key, check_string.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(calculated_hash, received_hash):
+            return None
+        return fields
+
+    def verify(self, init_data: str) -> Optional[dict]:
+        """Поля initData (значения уже раскодированы) или None, если подпись неверна или устарела"""
+        fields = self._check(init_data)
+        if fields is None:
+            return None
+        if self.max_age:
+            try:
+                auth_date = int(fields.get("auth_date", 0))
+            except ValueError:
+                return None
+            if auth_date + self.max_age < time.time():
+                return None
+        return dict(fields)
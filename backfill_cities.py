@@ -0,0 +1,31 @@
+# backfill_cities.py - ПЕРЕСЧЕТ ГОРОДОВ В СУЩЕСТВУЮЩИХ ПОЕЗДКАХ
+import argparse
+import time
+import database
+
+def main():
+    parser = argparse.ArgumentParser(description="Заполнить start_city/finish_city и ключи городов пачками")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Строк в одной транзакции")
+    parser.add_argument("--missing-only", action="store_true", help="Только строки без ключей городов")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("🏙️  ПЕРЕСЧЕТ ГОРОДОВ В ПОЕЗДКАХ")
+    print("=" * 60)
+
+    # На новой базе таблиц еще нет, а в старой могут отсутствовать колонки ключей:
+    # create_tables создает недостающие таблицы и затем вызывает upgrade_schema
+    database.create_tables()
+
+    started = time.perf_counter()
+    total = database.backfill_cities(
+        chunk_size=args.chunk_size,
+        missing_only=args.missing_only,
+        progress=lambda table, done: print(f"   {table}: обработано {done}")
+    )
+    elapsed = time.perf_counter() - started
+
+    print(f"✅ Готово: {total} строк за {elapsed:.1f} с")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# bench_bot.py - ПРОПУСКНАЯ СПОСОБНОСТЬ БОТА: ПОСЛЕДОВАТЕЛЬНО И С ПУЛОМ ОБРАБОТЧИКОВ
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict
+
+# Тексты обновлений и по какому началу ответа узнать, какой обработчик ответил
+MESSAGES = (("/start", "start", "\n👋 Привет"), ("/help", "help", "\n🆘"), ("попутчик нужен", "text", "Чтобы найти"))
+BOT_TOKEN = "123456:bench"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Прогнать синтетические обновления через обработчики бота на заглушке Bot API")
+    parser.add_argument("--updates", type=int, default=2000, help="Обновлений на режим")
+    parser.add_argument("--chats", type=int, default=200, help="Разных чатов")
+    parser.add_argument("--workers", type=int, default=32, help="Обработчиков одновременно в параллельном режиме")
+    parser.add_argument("--reply-delay-ms", type=float, default=10, help="Задержка заглушки на sendMessage")
+    parser.add_argument("--seed", type=int, default=42, help="Зерно: одинаковая последовательность обновлений")
+    parser.add_argument("--skip-sequential", action="store_true", help="Не мерить последовательный режим")
+    return parser.parse_args()
+
+def make_updates(count, chats, seed):
+    from fake_bot_api import fake_update
+
+    rng = random.Random(seed)
+    updates, expected = [], defaultdict(list)
+    for update_id in range(1, count + 1):
+        chat_id = 1000 + rng.randrange(chats)
+        text, kind, _ = rng.choice(MESSAGES)
+        updates.append(fake_update(update_id, chat_id, text))
+        expected[chat_id].append(kind)
+    return updates, expected
+
+def reply_kind(text):
+    for _, kind, prefix in MESSAGES:
+        if text.startswith(prefix):
+            return kind
+    return "?"
+
+async def run_mode(workers, updates):
+    """Положить все обновления в очередь Application и дождаться их обработки"""
+    from telegram import Update
+    from minimal_bot import build_application
+
+    application = build_application(BOT_TOKEN, updater=False, concurrent_updates=workers)
+    async with application:
+        await application.start()
+        parsed = [Update.de_json(data, application.bot) for data in updates]
+        started = time.perf_counter()
+        for update in parsed:
+            application.update_queue.put_nowait(update)
+        await application.update_queue.join()
+        elapsed = time.perf_counter() - started
+        await application.stop()
+    return elapsed
+
+def check_order(calls, expected):
+    """Ответы каждого чата пришли в том же порядке, что и его обновления"""
+    replies = defaultdict(list)
+    for call in calls:
+        if call["method"].lower() == "sendmessage":
+            replies[int(call["params"]["chat_id"])].append(reply_kind(call["params"]["text"]))
+    return sum(1 for chat_id, kinds in expected.items() if replies.get(chat_id) != kinds)
+
+def main():
+    from fake_bot_api import free_port, spawn
+
+    args = parse_args()
+    port = free_port()
+    # Адрес Bot API читается при импорте minimal_bot
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{port}"
+
+    import httpx
+    import logging
+    updates, expected = make_updates(args.updates, args.chats, args.seed)
+    modes = ([] if args.skip_sequential else [("sequential", 1)]) + [("concurrent", args.workers)]
+
+    results = {}
+    for name, workers in modes:
+        # Своя заглушка на режим: журнал вызовов начинается с нуля
+        stub = spawn(port, "--reply-delay-ms", str(args.reply_delay_ms), token=BOT_TOKEN)
+        try:
+            logging.getLogger("httpx").setLevel(logging.WARNING)
+            elapsed = asyncio.run(run_mode(workers, updates))
+            calls = httpx.get(f"http://127.0.0.1:{port}/calls", timeout=30).json()
+        finally:
+            stub.terminate()
+            stub.wait()
+        results[name] = {
+            "workers": workers,
+            "elapsed_sec": round(elapsed, 3),
+            "updates_per_sec": round(len(updates) / elapsed, 1),
+            "replies": sum(1 for call in calls if call["method"].lower() == "sendmessage"),
+            "chats_out_of_order": check_order(calls, expected),
+        }
+        print(f"⏱️  {name}: {results[name]['updates_per_sec']} обновлений/с "
+              f"(нарушений порядка: {results[name]['chats_out_of_order']})")
+
+    report = {"updates": len(updates), "chats": len(expected), "reply_delay_ms": args.reply_delay_ms, "modes": results}
+    if "sequential" in results:
+        report["speedup"] = round(results["concurrent"]["updates_per_sec"] / results["sequential"]["updates_per_sec"], 1)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if any(result["chats_out_of_order"] or result["replies"] != len(updates) for result in results.values()):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# bench_corridor.py - ПОИСК ПО КОРИДОРУ МАРШРУТА: СЕТКА ПРОТИВ ПОЛНОГО ПЕРЕБОРА НА СИНТЕТИЧЕСКИХ МАРШРУТАХ
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Синтетические маршруты в базе: пересборка индекса, скорость поиска и сверка с перебором")
+    parser.add_argument("--trips", type=int, default=5000)
+    parser.add_argument("--cities", type=int, default=40)
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--check", type=int, default=20, help="Из них сверить с полным перебором отрезков")
+    parser.add_argument("--radius-km", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+def encode_polyline(points, precision=5):
+    """Обратное к corridor.decode_polyline — так маршрут хранят навигаторы"""
+    factor, result, previous = 10 ** precision, [], (0, 0)
+    for lat, lng in points:
+        current = (round(lat * factor), round(lng * factor))
+        for value in (current[0] - previous[0], current[1] - previous[1]):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        previous = current
+    return "".join(result)
+
+def wiggly_route(rng, start, finish, step_km=1.0):
+    """Дорога между городами: точка каждый step_km с плавными изгибами до нескольких км"""
+    from corridor import KM_PER_DEGREE
+    (lat1, lng1), (lat2, lng2) = start, finish
+    kx = KM_PER_DEGREE * math.cos(math.radians((lat1 + lat2) / 2))
+    length = math.hypot((lng2 - lng1) * kx, (lat2 - lat1) * KM_PER_DEGREE)
+    count = max(2, int(length / step_km))
+    # Смещение поперек направления: сумма нескольких синусоид, на концах — ноль
+    waves = [(rng.uniform(-4, 4), rng.randint(1, 6)) for _ in range(3)]
+    normal = (-(lat2 - lat1) * KM_PER_DEGREE / length, (lng2 - lng1) * kx / length)  # (x, y) в км
+    points = []
+    for k in range(count + 1):
+        t = k / count
+        offset = sum(amplitude * math.sin(math.pi * t * frequency) for amplitude, frequency in waves)
+        points.append((lat1 + (lat2 - lat1) * t + normal[1] * offset / KM_PER_DEGREE,
+                       lng1 + (lng2 - lng1) * t + normal[0] * offset / kx))
+    return points
+
+def main():
+    args = parse_args()
+    # Окружение задается до импорта database
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'corridor.db')}"
+
+    from sqlalchemy import insert, select
+    import database
+    from benchmark.synthetic import generate
+    from corridor import CORRIDOR_SIMPLIFY_KM, CorridorIndex, segment_length
+    from reminders import local_now
+
+    database.create_tables()
+    rng = random.Random(args.seed)
+    cities = [(rng.uniform(51, 59), rng.uniform(30, 48)) for _ in range(args.cities)]
+    first_day = local_now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    db = database.SessionLocal()
+    try:
+        generate(db, users=200, trips=0, bookings=0, seed=args.seed)
+        drivers = db.execute(select(database.User.id).where(database.User.has_car.is_(True))).scalars().all()
+        rows, points_total = [], 0
+        for i in range(args.trips):
+            a, b = rng.sample(range(len(cities)), 2)
+            route = wiggly_route(rng, cities[a], cities[b])
+            points_total += len(route)
+            departure = first_day + timedelta(days=rng.randrange(args.days), hours=rng.randint(5, 22))
+            rows.append({
+                "driver_id": rng.choice(drivers),
+                "departure_date": departure,
+                "departure_time": departure.strftime("%H:%M"),
+                "start_address": f"Город {a}",
+                "finish_address": f"Город {b}",
+                "start_lat": route[0][0], "start_lng": route[0][1],
+                "finish_lat": route[-1][0], "finish_lng": route[-1][1],
+                # Половина маршрутов — точками, половина — encoded polyline
+                "route_points": [list(point) for point in route] if i % 2 else None,
+                "polyline": None if i % 2 else encode_polyline(route),
+                "available_seats": rng.randint(1, 4),
+                "price_per_seat": float(rng.randrange(300, 3000, 50)),
+                "status": database.TripStatus.ACTIVE,
+            })
+        for start in range(0, len(rows), 1000):
+            db.execute(insert(database.DriverTrip), rows[start:start + 1000])
+        db.commit()
+    finally:
+        db.close()
+
+    index = CorridorIndex()
+    rebuild = asyncio.run(index.rebuild())
+    # Эталоны: исходные маршруты без упрощения (допуск) и одна ячейка на всю карту (полный перебор)
+    exact = CorridorIndex(tolerance_km=0, session_factory=index.session_factory)
+    asyncio.run(exact.rebuild())
+    full_scan = CorridorIndex(cell_km=1e6, session_factory=index.session_factory)
+    asyncio.run(full_scan.rebuild())
+
+    # Запросы: отрезок пути вдоль случайной поездки со сдвигом до радиуса и совсем случайные точки
+    trips = list(index._trips.values())
+    queries = []
+    for _ in range(args.queries):
+        if rng.random() < 0.8:
+            trip = rng.choice(trips)
+            route = [(s[0], s[1]) for s in trip.segments] + [(trip.segments[-1][2], trip.segments[-1][3])]
+            i, j = sorted(rng.sample(range(len(route)), 2))
+            jitter = lambda point: (point[0] + rng.uniform(-0.04, 0.04), point[1] + rng.uniform(-0.06, 0.06))
+            # Точки далеко друг от друга по маршруту: в обратную сторону эта поездка не подходит
+            along = trip.offsets + [trip.offsets[-1] + segment_length(trip.segments[-1])]
+            opposite = trip.id if along[j] - along[i] > 4 * args.radius_km else None
+            queries.append((jitter(route[i]), jitter(route[j]), trip.departure.date(), opposite))
+        else:
+            a, b = rng.sample(cities, 2)
+            queries.append((a, b, first_day.date(), None))
+
+    timings, full_scan_timings, found = [], [], 0
+    violations = {"simplification": 0, "grid": 0, "direction": 0}
+    tolerance = CORRIDOR_SIMPLIFY_KM + 0.05  # плюс погрешность плоской проекции
+    for number, (start, finish, day, opposite) in enumerate(queries):
+        started = time.perf_counter()
+        hits = index.search(start, finish, day, args.radius_km)
+        timings.append(time.perf_counter() - started)
+        found += len(hits)
+        # Упрощение сдвигает маршрут не больше чем на допуск
+        ids = {hit.trip_id for hit in hits}
+        inner = {hit.trip_id for hit in exact.search(start, finish, day, args.radius_km - tolerance)}
+        outer = {hit.trip_id for hit in exact.search(start, finish, day, args.radius_km + tolerance)}
+        if not inner <= ids <= outer:
+            violations["simplification"] += 1
+        if opposite is not None and any(hit.trip_id == opposite for hit in index.search(finish, start, day, args.radius_km)):
+            violations["direction"] += 1
+        # Сетка не теряет и не добавляет кандидатов
+        if number < args.check:
+            started = time.perf_counter()
+            if full_scan.search(start, finish, day, args.radius_km) != hits:
+                violations["grid"] += 1
+            full_scan_timings.append(time.perf_counter() - started)
+
+    # Точечные изменения: поездку заполнили и снова открыли
+    db = database.SessionLocal()
+    try:
+        sample = db.execute(select(database.DriverTrip).limit(200)).scalars().all()
+    finally:
+        db.close()
+    started = time.perf_counter()
+    for trip in sample:
+        index.seats_changed(trip, 0)
+    removed = (time.perf_counter() - started) / len(sample)
+    async def add_all():
+        for trip in sample:
+            await index.add_trip(trip)
+    started = time.perf_counter()
+    asyncio.run(add_all())
+    added = (time.perf_counter() - started) / len(sample)
+
+    stats = index.stats()
+    report = {
+        "trips": args.trips,
+        "route_points": points_total,
+        "index": stats,
+        "segments_per_trip": round(stats["segments"] / max(1, stats["trips"]), 1),
+        "rebuild_sec": rebuild["seconds"],
+        "queries": len(queries),
+        "hits_per_query": round(found / len(queries), 2),
+        "query_ms": {"avg": round(sum(timings) / len(timings) * 1000, 3), "max": round(max(timings) * 1000, 3)},
+        "full_scan_query_ms": round(sum(full_scan_timings) / max(1, len(full_scan_timings)) * 1000, 3),
+        "add_trip_ms": round(added * 1000, 3),
+        "remove_trip_ms": round(removed * 1000, 3),
+        "violations": violations,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if any(violations.values()):
+        raise SystemExit("❌ Результаты сетки расходятся с полным перебором больше допуска упрощения")
+    print(f"✅ {len(queries)} запросов, в среднем {report['query_ms']['avg']} мс против {report['full_scan_query_ms']} мс перебором")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# bench_matching.py - ПОДБОР ПОЕЗДОК: ПАКЕТНЫЙ ПРОХОД ПО ВСЕМ ЗАПРОСАМ И ТОЧЕЧНЫЕ ИЗМЕНЕНИЯ
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Синтетические поездки и запросы пассажиров: время подбора и сверка с полным перебором")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--trips", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=30000, help="Открытых запросов пассажиров")
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--updates", type=int, default=2000, help="Точечных изменений (поездки, места, запросы)")
+    parser.add_argument("--sample", type=int, default=500, help="Запросов для сверки с полным перебором")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+def brute_force(index, request):
+    """Эталон: перебор всех поездок без корзин"""
+    from matching import Match, rank
+    candidates = [
+        Match(trip.id, abs(trip.minute - request.desired), trip.price)
+        for trip in index._trips.values()
+        if trip.route == request.route and request.start <= trip.minute <= request.end
+        and index._qualifies(request, trip)
+    ]
+    return sorted(candidates, key=rank)[:index.top_k]
+
+def main():
+    args = parse_args()
+    # Окружение задается до импорта database
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'matching.db')}"
+
+    import database
+    from benchmark.synthetic import generate
+    from matching import MatchIndex, RideRequest
+
+    database.create_tables()
+    db = database.SessionLocal()
+    try:
+        dataset = generate(db, users=args.users, trips=args.trips, bookings=args.trips // 2,
+                           seed=args.seed, days=args.days, requests=args.requests)
+    finally:
+        db.close()
+
+    index = MatchIndex()
+    rebuild = asyncio.run(index.rebuild())
+    started = time.perf_counter()
+    index.match_all()
+    batch_seconds = time.perf_counter() - started
+
+    rng = random.Random(args.seed)
+    requests = list(index._requests.values())
+    sample = rng.sample(requests, min(args.sample, len(requests)))
+    brute_mismatches = sum(1 for request in sample if index.matches[request.id] != brute_force(index, request))
+
+    # Точечные изменения: новые поездки, брони/отмены (места), новые запросы
+    trips = list(index._trips.values())
+    routes = [trip.route for trip in trips]
+    next_trip_id = max(index._trips, default=0) + 1
+    next_request_id = max(index._requests, default=0) + 1
+    timings = {"trip_created": [], "seats_changed": [], "request_created": []}
+    for _ in range(args.updates):
+        kind = rng.choice(list(timings))
+        if kind == "trip_created":
+            base = rng.choice(trips)
+            change = base._replace(id=next_trip_id, route=rng.choice(routes),
+                                   minute=base.minute + rng.randint(-180, 180), price=float(rng.randrange(300, 3000, 50)))
+            next_trip_id += 1
+            started = time.perf_counter()
+            index.upsert_trip(change)
+        elif kind == "seats_changed":
+            trip = index._trips.get(rng.choice(trips).id)
+            if trip is None:
+                continue
+            started = time.perf_counter()
+            index.upsert_trip(trip._replace(seats=max(0, trip.seats + rng.choice((-2, -1, 1)))))
+        else:
+            base = rng.choice(requests)
+            desired = base.desired + rng.randint(-120, 120)
+            flexibility = rng.choice((15, 30, 60, 120))
+            change = RideRequest(next_request_id, base.passenger_id, rng.choice(routes), desired - flexibility,
+                                 desired + flexibility, desired, rng.choice((1, 1, 2)), base.max_price)
+            next_request_id += 1
+            started = time.perf_counter()
+            index.add_request(change)
+        timings[kind].append(time.perf_counter() - started)
+
+    # После точечных изменений списки должны совпасть с пакетным проходом по тому же состоянию
+    fresh = MatchIndex()
+    fresh.load(list(index._trips.values()), list(index._requests.values()))
+    incremental_mismatches = sum(1 for request_id, matches in fresh.matches.items() if index.matches[request_id] != matches)
+
+    report = {
+        "dataset": dataset.summary(),
+        "index": index.stats(),
+        "rebuild_with_db_sec": rebuild["seconds"],
+        "batch_match_sec": round(batch_seconds, 3),
+        "requests_per_sec": round(len(requests) / batch_seconds) if batch_seconds else None,
+        "incremental_ms": {
+            kind: {"count": len(values), "avg": round(sum(values) / len(values) * 1000, 3) if values else None,
+                   "max": round(max(values) * 1000, 3) if values else None}
+            for kind, values in timings.items()
+        },
+        "buckets_per_day": round(len(index._trip_buckets) / max(1, len({day for _, day in index._trip_buckets})), 1),
+        "brute_force_mismatches": brute_mismatches,
+        "incremental_mismatches": incremental_mismatches,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if brute_mismatches or incremental_mismatches:
+        raise SystemExit("❌ Списки подбора не совпадают с эталоном")
+    print(f"✅ {len(requests)} запросов за {batch_seconds:.2f} с, точечные изменения совпадают с пакетным проходом")
+
+if __name__ == "__main__":
+    main()
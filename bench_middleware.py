@@ -0,0 +1,90 @@
+# bench_middleware.py - НАКЛАДНЫЕ РАСХОДЫ MIDDLEWARE НА ОДИН ЗАПРОС
+import argparse
+import asyncio
+import json
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from main import TelegramUserMiddleware
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сравнить BaseHTTPMiddleware и чистый ASGI middleware на пустом эндпоинте")
+    parser.add_argument("--requests", type=int, default=20000, help="Запросов на каждый вариант")
+    parser.add_argument("--rounds", type=int, default=3, help="Повторов, берется лучший")
+    return parser.parse_args()
+
+def make_app(variant):
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping(request: Request):
+        return PlainTextResponse(str(request.state.telegram_id) if variant != "none" else "")
+
+    if variant == "base_http":
+        # Прежняя реализация через @app.middleware("http")
+        @app.middleware("http")
+        async def add_telegram_user(request: Request, call_next):
+            try:
+                telegram_id = request.headers.get("X-Telegram-User-Id")
+                request.state.telegram_id = int(telegram_id) if telegram_id else None
+            except ValueError:
+                request.state.telegram_id = None
+            return await call_next(request)
+    elif variant == "asgi":
+        app.add_middleware(TelegramUserMiddleware)
+    return app
+
+async def run(app, requests):
+    """Вызвать приложение напрямую по ASGI, без сети и HTTP-клиента"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": "/ping", "raw_path": b"/ping",
+        "root_path": "", "query_string": b"", "server": ("bench", 80), "client": ("bench", 1),
+        "headers": [(b"host", b"bench"), (b"x-telegram-user-id", b"123456")],
+    }
+
+    never = asyncio.Event()
+
+    def make_receive():
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # Тело уже отдано: как настоящий сервер, ждем до разрыва соединения
+            await never.wait()
+
+        return receive
+
+    async def send(message):
+        pass
+
+    # Прогрев: сборка стека middleware при первом запросе
+    await app(dict(scope), make_receive(), send)
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), make_receive(), send)
+    return time.perf_counter() - started
+
+def main():
+    args = parse_args()
+    results = {}
+    for variant in ("none", "base_http", "asgi"):
+        app = make_app(variant)
+        best = min(asyncio.run(run(app, args.requests)) for _ in range(args.rounds))
+        results[variant] = round(best / args.requests * 1e6, 1)
+
+    report = {
+        "requests": args.requests,
+        "us_per_request": results,
+        "overhead_us": {
+            "base_http": round(results["base_http"] - results["none"], 1),
+            "asgi": round(results["asgi"] - results["none"], 1),
+        },
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# benchmark - СИНТЕТИЧЕСКИЕ ДАННЫЕ И НАГРУЗОЧНЫЙ ПРОГОН API
+# Запуск: python -m benchmark --help
@@ -0,0 +1,218 @@
+# benchmark/__main__.py - НАГРУЗОЧНЫЙ ПРОГОН API ВНУТРИ ПРОЦЕССА (python -m benchmark)
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import urlencode
+
+SCENARIOS = ("search", "my", "booking", "auth")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Синтетические данные + нагрузка на эндпоинты через ASGI, отчет в JSON")
+    parser.add_argument("--users", type=int, default=2000, help="Пользователей")
+    parser.add_argument("--trips", type=int, default=10000, help="Поездок водителей")
+    parser.add_argument("--bookings", type=int, default=20000, help="Попыток бронирования при генерации")
+    parser.add_argument("--days", type=int, default=14, help="На сколько дней вперед поездки")
+    parser.add_argument("--seed", type=int, default=42, help="Зерно генератора: одинаковые данные и запросы")
+    parser.add_argument("--requests", type=int, default=1000, help="Запросов на сценарий")
+    parser.add_argument("--warmup", type=int, default=50, help="Запросов прогрева на сценарий (не входят в отчет)")
+    parser.add_argument("--concurrency", type=int, default=32, help="Одновременных запросов")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Через запятую из: {', '.join(SCENARIOS)}")
+    parser.add_argument("--no-search-cache", action="store_true", help="Отключить кэш поиска (мерить SQL, а не кэш)")
+    parser.add_argument("--database-url", default=None, help="Пустая база для прогона (по умолчанию временная SQLite)")
+    parser.add_argument("--output", default=None, help="Куда записать JSON-отчет")
+    parser.add_argument("--compare", default=None, help="Прошлый отчет: добавить изменение в процентах")
+    return parser.parse_args()
+
+def percentile(sorted_values, p):
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def signed_init_data(bot_token, user):
+    """initData, подписанный как в Telegram, — если API проверяет подпись"""
+    fields = {"auth_date": str(int(time.time())), "user": json.dumps(user, ensure_ascii=False)}
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+    fields["hash"] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+def make_request_factory(name, dataset, rng):
+    """Функция, возвращающая очередной запрос сценария: (метод, путь, параметры, тело)"""
+    from benchmark.synthetic import city_title, zipf_weights
+
+    user_weights = zipf_weights(len(dataset.telegram_ids), 0.7)
+    pair_weights = zipf_weights(len(dataset.city_pairs))
+    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
+
+    def search():
+        start, finish = rng.choices(dataset.city_pairs, cum_weights=pair_weights)[0]
+        date = dataset.first_day + timedelta(days=rng.randrange(dataset.days))
+        return "POST", "/api/trips/search", None, {
+            "from_city": city_title(start),
+            "to_city": city_title(finish),
+            "date": date.strftime("%Y-%m-%d"),
+        }
+
+    def my():
+        telegram_id = rng.choices(dataset.telegram_ids, cum_weights=user_weights)[0]
+        return "GET", "/api/trips/my", {"telegram_id": telegram_id}, None
+
+    def booking():
+        telegram_id = rng.choice(dataset.passenger_telegram_ids or dataset.telegram_ids)
+        trip_id = rng.choice(dataset.trip_ids)
+        return "POST", "/api/bookings/create", {"telegram_id": telegram_id}, {"driver_trip_id": trip_id, "booked_seats": 1}
+
+    def auth():
+        telegram_id = rng.choices(dataset.telegram_ids, cum_weights=user_weights)[0]
+        user = {"id": telegram_id, "first_name": "Бенч", "username": f"user{telegram_id}"}
+        if bot_token:
+            return "POST", "/api/auth/telegram", None, {"initData": signed_init_data(bot_token, user)}
+        return "POST", "/api/auth/telegram", None, {"user": user}
+
+    return {"search": search, "my": my, "booking": booking, "auth": auth}[name]
+
+async def run_scenario(client, next_request, requests, concurrency):
+    """Прогнать requests запросов с concurrency одновременными; вернуть задержки и коды"""
+    latencies = []
+    statuses = Counter()
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            method, path, params, body = next_request()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, params=params, json=body)
+                statuses[response.status_code] += 1
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - started
+
+def summarize(latencies, statuses, elapsed):
+    values = sorted(latency * 1000 for latency in latencies)
+    errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 500)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "status_codes": {str(status): count for status, count in sorted(statuses.items(), key=lambda item: str(item[0]))},
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentile(values, 50), 2),
+            "p95": round(percentile(values, 95), 2),
+            "p99": round(percentile(values, 99), 2),
+            "mean": round(sum(values) / len(values), 2),
+            "max": round(values[-1], 2),
+        },
+    }
+
+async def drive(app, dataset, args, scenarios):
+    import httpx
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    # Lifespan приложения: пул, фоновые задачи — как при обычном запуске
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for name in scenarios:
+                # Свой генератор на сценарий: набор запросов не зависит от списка сценариев
+                rng = random.Random(f"{args.seed}:{name}")
+                next_request = make_request_factory(name, dataset, rng)
+                if args.warmup:
+                    await run_scenario(client, next_request, args.warmup, args.concurrency)
+                latencies, statuses, elapsed = await run_scenario(client, next_request, args.requests, args.concurrency)
+                results[name] = summarize(latencies, statuses, elapsed)
+                print(f"⏱️  {name}: p50 {results[name]['latency_ms']['p50']} мс, "
+                      f"p99 {results[name]['latency_ms']['p99']} мс, {results[name]['throughput_rps']} rps")
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report, baseline):
+    """Изменение метрик относительно прошлого отчета в процентах (минус по задержке — лучше)"""
+    delta = {}
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        changes = {}
+        for key in ("p50", "p95", "p99"):
+            before, after = previous["latency_ms"][key], current["latency_ms"][key]
+            changes[key] = round((after - before) / before * 100, 1) if before else None
+        before, after = previous["throughput_rps"], current["throughput_rps"]
+        changes["throughput_rps"] = round((after - before) / before * 100, 1) if before else None
+        delta[name] = changes
+    return {"baseline_commit": baseline.get("commit"), "percent": delta}
+
+def main():
+    args = parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    # Окружение задается до импорта database/main: движок и кэши читают его при импорте
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    if args.no_search_cache:
+        os.environ["SEARCH_CACHE_TTL"] = "0"
+
+    import database
+    import main as api
+    from benchmark.synthetic import generate
+
+    database.create_tables()
+    db = database.SessionLocal()
+    try:
+        started = time.perf_counter()
+        dataset = generate(db, users=args.users, trips=args.trips, bookings=args.bookings, seed=args.seed, days=args.days)
+        generated_in = time.perf_counter() - started
+    finally:
+        db.close()
+    print(f"✅ Данные: {dataset.summary()} за {generated_in:.1f} с")
+
+    results = asyncio.run(drive(api.app, dataset, args, scenarios))
+
+    report = {
+        "commit": git_revision(),
+        "python": platform.python_version(),
+        "database": database.async_engine.dialect.name,
+        "dataset": dataset.summary(),
+        "concurrency": args.concurrency,
+        "search_cache": not args.no_search_cache,
+        "scenarios": results,
+    }
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report["delta"] = compare(report, json.load(f))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+# benchmark/synthetic.py - ГЕНЕРАТОР СИНТЕТИЧЕСКИХ ПОЛЬЗОВАТЕЛЕЙ, ПОЕЗДОК И БРОНИРОВАНИЙ
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import List, NamedTuple, Tuple
+from sqlalchemy import bindparam, insert, select
+import database
+from extract_city import CITY_KEYWORDS, extract_city, city_key
+
+TELEGRAM_ID_BASE = 10_000_000
+STREETS = ["Ленина", "Мира", "Советская", "Гагарина", "Пушкина", "Вокзальная", "Садовая", "Молодежная"]
+FIRST_NAMES = ["Иван", "Анна", "Сергей", "Мария", "Дмитрий", "Елена", "Алексей", "Ольга"]
+LAST_NAMES = ["Иванов", "Смирнова", "Кузнецов", "Попова", "Соколов", "Лебедева", None]
+
+class Dataset(NamedTuple):
+    """Что сгенерировано — нужно нагрузочному прогону для выбора запросов"""
+    seed: int
+    telegram_ids: List[int]
+    passenger_telegram_ids: List[int]
+    city_pairs: List[Tuple[str, str]]
+    first_day: datetime
+    days: int
+    trip_ids: List[int]
+    bookings: int
+    requests: int = 0
+
+    def summary(self):
+        return {
+            "seed": self.seed,
+            "users": len(self.telegram_ids),
+            "trips": len(self.trip_ids),
+            "bookings": self.bookings,
+            "requests": self.requests,
+            "city_pairs": len(self.city_pairs),
+            "days": self.days,
+        }
+
+def zipf_weights(n, s=1.1):
+    """Накопленные веса Zipf: первые элементы выбираются намного чаще хвоста"""
+    return list(accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+def city_title(city):
+    return "-".join(part[:1].upper() + part[1:] for part in city.split("-"))
+
+def address(rng, city):
+    return f"{city_title(city)}, ул. {rng.choice(STREETS)}, {rng.randint(1, 120)}"
+
+def generate(db, users=1000, trips=5000, bookings=10000, seed=42, days=14, chunk_size=5000, requests=0):
+    """Заполнить пустую базу: пользователи, поездки по городам из extract_city, брони с перекосом
+    и (если requests) открытые запросы пассажиров.
+
+    Популярность направлений, водителей и поездок распределена по Zipf,
+    поэтому горячие маршруты и перегретые поездки — как в жизни.
+    """
+    rng = random.Random(seed)
+    first_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    # Пользователи: примерно каждый третий — водитель
+    user_rows = []
+    for i in range(users):
+        has_car = rng.random() < 0.3
+        user_rows.append({
+            "telegram_id": TELEGRAM_ID_BASE + i,
+            "username": f"user{i}",
+            "first_name": rng.choice(FIRST_NAMES),
+            "last_name": rng.choice(LAST_NAMES),
+            "has_car": has_car,
+            "car_model": "Lada Vesta" if has_car else None,
+            "car_type": database.CarType.SEDAN if has_car else None,
+            "role": database.UserRole.DRIVER if has_car else database.UserRole.PASSENGER,
+            "total_driver_trips": 0,
+            "total_passenger_trips": 0,
+        })
+    if not any(row["has_car"] for row in user_rows):
+        user_rows[0].update(has_car=True, role=database.UserRole.DRIVER)
+    _insert_chunks(db, database.User, user_rows, chunk_size)
+
+    ids = dict(db.execute(select(database.User.telegram_id, database.User.id)).all())
+    drivers = [ids[row["telegram_id"]] for row in user_rows if row["has_car"]]
+    passengers = [ids[row["telegram_id"]] for row in user_rows if not row["has_car"]] or drivers
+    user_by_id = {ids[row["telegram_id"]]: row for row in user_rows}
+
+    # Направления: все упорядоченные пары городов, популярность по Zipf
+    cities = list(CITY_KEYWORDS)
+    city_pairs = [(a, b) for a in cities for b in cities if a != b]
+    rng.shuffle(city_pairs)
+    pair_weights = zipf_weights(len(city_pairs))
+    driver_weights = zipf_weights(len(drivers), 0.8)
+
+    trip_rows = []
+    for _ in range(trips):
+        start, finish = rng.choices(city_pairs, cum_weights=pair_weights)[0]
+        driver_id = rng.choices(drivers, cum_weights=driver_weights)[0]
+        departure = first_day + timedelta(days=rng.randrange(days), hours=rng.randint(5, 22), minutes=rng.choice((0, 15, 30, 45)))
+        seats = rng.randint(1, 4)
+        price = float(rng.randrange(300, 3000, 50))
+        start_address, finish_address = address(rng, start), address(rng, finish)
+        start_city, finish_city = extract_city(start_address), extract_city(finish_address)
+        trip_rows.append({
+            "driver_id": driver_id,
+            "departure_date": departure,
+            "departure_time": departure.strftime("%H:%M"),
+            "start_address": start_address,
+            "finish_address": finish_address,
+            "start_city": start_city,
+            "finish_city": finish_city,
+            "start_city_key": city_key(start_city),
+            "finish_city_key": city_key(finish_city),
+            "available_seats": seats,
+            "price_per_seat": price,
+            "total_price": seats * price,
+            "status": database.TripStatus.ACTIVE,
+        })
+        user_by_id[driver_id]["total_driver_trips"] += 1
+
+    # Брони: горячие поездки получают основную часть, пассажиры тоже неравномерны
+    trip_weights = zipf_weights(trips, 0.9)
+    passenger_weights = zipf_weights(len(passengers), 0.7)
+    booking_rows = []
+    booked = set()
+    for _ in range(bookings if trips else 0):
+        index = rng.choices(range(trips), cum_weights=trip_weights)[0]
+        trip = trip_rows[index]
+        passenger_id = rng.choices(passengers, cum_weights=passenger_weights)[0]
+        seats = 1 if rng.random() < 0.85 else 2
+        if (index, passenger_id) in booked or passenger_id == trip["driver_id"]:
+            continue
+        cancelled = rng.random() < 0.1
+        if not cancelled:
+            if trip["available_seats"] < seats:
+                continue
+            trip["available_seats"] -= seats
+            if trip["available_seats"] == 0:
+                trip["status"] = database.TripStatus.COMPLETED
+            user_by_id[passenger_id]["total_passenger_trips"] += 1
+        booked.add((index, passenger_id))
+        booking_rows.append((index, {
+            "passenger_id": passenger_id,
+            "booked_seats": seats,
+            "price_agreed": trip["price_per_seat"],
+            "status": database.TripStatus.CANCELLED if cancelled else database.TripStatus.ACTIVE,
+            "cancelled_at": datetime.utcnow() if cancelled else None,
+        }))
+
+    _insert_chunks(db, database.DriverTrip, trip_rows, chunk_size)
+    trip_ids = db.execute(select(database.DriverTrip.id).order_by(database.DriverTrip.id)).scalars().all()
+    for index, row in booking_rows:
+        row["driver_trip_id"] = trip_ids[index]
+    _insert_chunks(db, database.Booking, [row for _, row in booking_rows], chunk_size)
+
+    # Запросы пассажиров: те же популярные направления, время задано не всегда
+    request_rows = []
+    for _ in range(requests):
+        start, finish = rng.choices(city_pairs, cum_weights=pair_weights)[0]
+        start_address, finish_address = address(rng, start), address(rng, finish)
+        start_city, finish_city = extract_city(start_address), extract_city(finish_address)
+        desired_time = None
+        if rng.random() < 0.8:
+            desired_time = f"{rng.randint(5, 22):02d}:{rng.choice((0, 15, 30, 45)):02d}"
+        request_rows.append({
+            "passenger_id": rng.choices(passengers, cum_weights=passenger_weights)[0],
+            "desired_date": first_day + timedelta(days=rng.randrange(days)),
+            "desired_time": desired_time,
+            "time_flexibility": rng.choice((15, 30, 60, 120)),
+            "start_address": start_address,
+            "finish_address": finish_address,
+            "start_city": start_city,
+            "finish_city": finish_city,
+            "start_city_key": city_key(start_city),
+            "finish_city_key": city_key(finish_city),
+            "required_seats": 1 if rng.random() < 0.8 else 2,
+            "max_price": float(rng.randrange(500, 3000, 100)) if rng.random() < 0.5 else None,
+            "status": database.TripStatus.ACTIVE,
+        })
+    _insert_chunks(db, database.PassengerTrip, request_rows, chunk_size)
+
+    # Счетчики поездок пользователей и таблица /stats
+    users_table = database.User.__table__
+    totals = [
+        {"uid": user_id, "driver_trips": row["total_driver_trips"], "passenger_trips": row["total_passenger_trips"]}
+        for user_id, row in user_by_id.items()
+        if row["total_driver_trips"] or row["total_passenger_trips"]
+    ]
+    if totals:
+        db.execute(
+            users_table.update()
+            .where(users_table.c.id == bindparam("uid"))
+            .values(total_driver_trips=bindparam("driver_trips"), total_passenger_trips=bindparam("passenger_trips")),
+            totals
+        )
+    row = db.execute(database.counters_drift_query()).mappings().one()
+    for statement in database.correct_counters_statements(row):
+        db.execute(statement)
+    db.commit()
+
+    return Dataset(
+        seed=seed,
+        telegram_ids=[row["telegram_id"] for row in user_rows],
+        passenger_telegram_ids=[row["telegram_id"] for row in user_rows if not row["has_car"]],
+        city_pairs=city_pairs,
+        first_day=first_day,
+        days=days,
+        trip_ids=list(trip_ids),
+        bookings=len(booking_rows),
+        requests=len(request_rows),
+    )
+
+def _insert_chunks(db, model, rows, chunk_size):
+    # Пакетная вставка без ORM-объектов; ключи городов уже посчитаны выше
+    for start in range(0, len(rows), chunk_size):
+        db.execute(insert(model), rows[start:start + chunk_size])
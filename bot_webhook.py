@@ -0,0 +1,65 @@
+# bot_webhook.py - TELEGRAM БОТ В РЕЖИМЕ WEBHOOK ВНУТРИ ПРОЦЕССА API
+import hashlib
+import hmac
+import os
+from typing import Optional
+
+WEBHOOK_PATH = "/telegram/webhook"
+
+# Публичный адрес API (https://...): если задан вместе с токеном, бот работает через webhook
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "").rstrip("/")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+
+class BotWebhook:
+    """Application python-telegram-bot на общем event loop: обновления приходят POST-запросом в API"""
+
+    def __init__(self, token: str, public_url: str, secret: str = ""):
+        self.token = token
+        self.url = public_url + WEBHOOK_PATH
+        # Telegram присылает секрет в заголовке X-Telegram-Bot-Api-Secret-Token
+        self.secret = secret or hmac.new(b"TelegramWebhook", token.encode(), hashlib.sha256).hexdigest()[:32]
+        self.application = None
+
+    @classmethod
+    def from_env(cls, token: str) -> Optional["BotWebhook"]:
+        if not token or not TELEGRAM_WEBHOOK_URL:
+            return None
+        return cls(token, TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_SECRET)
+
+    async def start(self):
+        """Инициализировать бота, запустить обработку очереди и зарегистрировать webhook"""
+        from minimal_bot import ALLOWED_UPDATES, build_application
+
+        self.application = build_application(self.token, updater=False)
+        await self.application.initialize()
+        await self.application.start()
+        await self.application.bot.set_webhook(
+            url=self.url,
+            allowed_updates=ALLOWED_UPDATES,
+            secret_token=self.secret
+        )
+        print(f"🤖 Бот в режиме webhook: {self.url} (обновления: {', '.join(ALLOWED_UPDATES)})")
+
+    async def stop(self):
+        # Webhook не снимаем: при перезапуске Telegram подождет и доставит накопленное
+        if self.application is not None:
+            await self.application.stop()
+            await self.application.shutdown()
+            self.application = None
+
+    def check_secret(self, header_value: Optional[str]) -> bool:
+        return bool(header_value) and hmac.compare_digest(header_value, self.secret)
+
+    @property
+    def running(self) -> bool:
+        return self.application is not None and self.application.running
+
+    async def enqueue(self, data: dict) -> bool:
+        """Положить обновление в очередь Application — ответ Telegram не ждет обработчиков.
+        False — бот еще не запущен или уже остановлен: очередь никто не разбирает"""
+        from telegram import Update
+
+        if not self.running:
+            return False
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+        return True
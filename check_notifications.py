@@ -0,0 +1,139 @@
+# check_notifications.py - ПРОВЕРКА ОЧЕРЕДИ УВЕДОМЛЕНИЙ НА ЗАГЛУШКЕ BOT API
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+BOT_TOKEN = "123456:notify"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Брони через API, доставка уведомлений через медленную заглушку с лимитами и сбоями")
+    parser.add_argument("--bookings", type=int, default=150, help="Бронирований через API")
+    parser.add_argument("--cancels", type=int, default=30, help="Из них отменить")
+    parser.add_argument("--reply-delay-ms", type=float, default=300, help="Задержка заглушки на sendMessage")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="Доля ответов 502")
+    parser.add_argument("--timeout", type=float, default=180, help="Сколько ждать доставки, секунд")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+def max_per_window(times, window=1.0):
+    """Наибольшее число событий в любом окне длиной window"""
+    times = sorted(times)
+    best, left = 0, 0
+    for right, at in enumerate(times):
+        while at - times[left] >= window:
+            left += 1
+        best = max(best, right - left + 1)
+    return best
+
+def main():
+    args = parse_args()
+    from fake_bot_api import free_port, spawn
+
+    port = free_port()
+    # Окружение задается до импорта database/main
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'notifications.db')}"
+    os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("NOTIFY_POLL_INTERVAL", "0.5")
+    os.environ.setdefault("NOTIFY_BACKOFF_BASE", "0.5")
+    os.environ.pop("TELEGRAM_WEBHOOK_URL", None)
+
+    import httpx
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func, select
+    import database
+    import main as api
+    from benchmark.synthetic import generate
+
+    stub = spawn(port, "--reply-delay-ms", str(args.reply_delay_ms), "--flood-limits",
+                 "--error-rate", str(args.error_rate), token=BOT_TOKEN)
+    try:
+        rng = random.Random(args.seed)
+        latencies = []
+        with TestClient(api.app) as client:
+            db = database.SessionLocal()
+            try:
+                dataset = generate(db, users=300, trips=400, bookings=0, seed=args.seed)
+            finally:
+                db.close()
+
+            booking_ids = []
+            # Небольшой набор поездок: у водителей копятся уведомления — проверяется склейка
+            trip_ids = dataset.trip_ids[:max(1, args.bookings // 2)]
+            for _ in range(args.bookings * 5):
+                if len(booking_ids) >= args.bookings:
+                    break
+                telegram_id = rng.choice(dataset.passenger_telegram_ids)
+                trip_id = rng.choice(trip_ids)
+                request_started = time.perf_counter()
+                response = client.post("/api/bookings/create", params={"telegram_id": telegram_id},
+                                       json={"driver_trip_id": trip_id, "booked_seats": 1})
+                latencies.append(time.perf_counter() - request_started)
+                if response.status_code == 200:
+                    booking_ids.append((response.json()["booking_id"], telegram_id))
+            for booking_id, telegram_id in booking_ids[:args.cancels]:
+                request_started = time.perf_counter()
+                client.post(f"/api/bookings/{booking_id}/cancel", params={"telegram_id": telegram_id})
+                latencies.append(time.perf_counter() - request_started)
+
+            # Ждем, пока outbox опустеет
+            N = database.Notification
+            deadline = time.monotonic() + args.timeout
+            while True:
+                db = database.SessionLocal()
+                try:
+                    by_status = dict(db.execute(select(N.status, func.count()).group_by(N.status)).all())
+                finally:
+                    db.close()
+                pending = by_status.get(database.NotificationStatus.PENDING, 0)
+                if not pending or time.monotonic() > deadline:
+                    break
+                time.sleep(0.5)
+            dispatcher_stats = api.notification_dispatcher.stats()
+        calls = httpx.get(f"http://127.0.0.1:{port}/calls", timeout=30).json()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    sends = [call for call in calls if call["method"].lower() == "sendmessage"]
+    delivered = [call for call in sends if call["status"] == 200]
+    by_chat = defaultdict(list)
+    for call in delivered:
+        by_chat[int(call["params"]["chat_id"])].append(call["at"])
+    min_chat_gap = min(
+        (b - a for times in by_chat.values() for a, b in zip(sorted(times), sorted(times)[1:])), default=None
+    )
+    values = sorted(latency * 1000 for latency in latencies)
+    total = sum(by_status.values())
+    report = {
+        "api_requests": len(values),
+        "api_latency_ms": {"p50": round(values[len(values) // 2], 1), "max": round(values[-1], 1)},
+        "reply_delay_ms": args.reply_delay_ms,
+        "notifications": {status.value: count for status, count in by_status.items()},
+        "delivered_notifications": sum(len(call["params"]["text"].split("\n\n")) for call in delivered),
+        "telegram_messages": len(delivered),
+        "http_429": sum(1 for call in sends if call["status"] == 429),
+        "http_502": sum(1 for call in sends if call["status"] == 502),
+        "max_messages_per_second": max_per_window([call["at"] for call in delivered]),
+        "min_seconds_between_messages_in_chat": round(min_chat_gap, 3) if min_chat_gap is not None else None,
+        "dispatcher": dispatcher_stats,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    failures = []
+    if by_status.get(database.NotificationStatus.SENT, 0) != total:
+        failures.append("не все уведомления отправлены")
+    if report["delivered_notifications"] != total:
+        failures.append(f"доставлено {report['delivered_notifications']} из {total} (потери или дубли)")
+    if report["api_latency_ms"]["max"] >= args.reply_delay_ms:
+        failures.append("задержка API зависит от задержки Telegram")
+    if failures:
+        raise SystemExit("❌ " + "; ".join(failures))
+    print(f"✅ {total} уведомлений доставлено {len(delivered)} сообщениями, API не ждет Telegram")
+
+if __name__ == "__main__":
+    main()
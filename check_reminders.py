@@ -0,0 +1,157 @@
+# check_reminders.py - ПРОВЕРКА НАПОМИНАНИЙ ОБ ОТПРАВЛЕНИИ НА ЗАГЛУШКЕ BOT API
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+
+BOT_TOKEN = "123456:remind"
+OFFSET_SECONDS = 6
+
+def main():
+    from fake_bot_api import free_port, spawn
+
+    port = free_port()
+    # Окружение задается до импорта database/main
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'reminders.db')}"
+    os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{port}"
+    os.environ["REMINDER_OFFSETS_MIN"] = str(OFFSET_SECONDS / 60)
+    os.environ.setdefault("NOTIFY_POLL_INTERVAL", "0.5")
+    os.environ.pop("TELEGRAM_WEBHOOK_URL", None)
+
+    import httpx
+    from fastapi.testclient import TestClient
+    from sqlalchemy import select
+    import database
+    import main as api
+    from query_plans import full_scans, normalize_plan
+    from reminders import local_now
+
+    database.create_tables()
+    # Пользователи нужны и после commit — для ожидаемых получателей
+    db = database.SessionLocal(expire_on_commit=False)
+    drivers = [database.User(telegram_id=5000 + i, first_name=f"Водитель{i}", has_car=True,
+                             role=database.UserRole.DRIVER) for i in range(8)]
+    passengers = [database.User(telegram_id=7000 + i, first_name=f"Пассажир{i}") for i in range(12)]
+    db.add_all(drivers + passengers)
+    db.flush()
+
+    now = local_now()
+    def trip(i, driver, seconds, **extra):
+        departure = (now + timedelta(seconds=seconds)).replace(microsecond=0)
+        return database.DriverTrip(
+            driver_id=driver.id, departure_date=departure, departure_time=departure.strftime("%H:%M"),
+            start_address=f"Москва, ул. Проверочная {i}", finish_address="Тула",
+            available_seats=4, price_per_seat=500, **extra
+        )
+    # Поездки, которые должен подобрать rebuild при старте
+    existing = {
+        "soon": trip(1, drivers[0], 20),
+        "missed": trip(2, drivers[1], OFFSET_SECONDS - 3),  # срабатывание уже прошло, отправление — нет
+        "later": trip(3, drivers[2], 30),
+        "reminded": trip(4, drivers[3], 20, reminded_before=OFFSET_SECONDS),
+        "cancelled": trip(5, drivers[4], 20, status=database.TripStatus.CANCELLED),
+        "departed": trip(6, drivers[5], -60),
+    }
+    db.add_all(existing.values())
+    db.flush()
+    db.add_all([
+        database.Booking(driver_trip_id=existing["soon"].id, passenger_id=passengers[0].id),
+        database.Booking(driver_trip_id=existing["soon"].id, passenger_id=passengers[1].id),
+        database.Booking(driver_trip_id=existing["soon"].id, passenger_id=passengers[2].id,
+                         status=database.TripStatus.CANCELLED),
+        database.Booking(driver_trip_id=existing["missed"].id, passenger_id=passengers[3].id),
+    ])
+    db.commit()
+    db.close()
+
+    expected = Counter({
+        drivers[0].telegram_id: 1, passengers[0].telegram_id: 1, passengers[1].telegram_id: 1,
+        drivers[1].telegram_id: 1, passengers[3].telegram_id: 1,
+        drivers[2].telegram_id: 1,
+    })
+
+    stub = spawn(port, token=BOT_TOKEN)
+    try:
+        with TestClient(api.app) as client:
+            # Поездки после старта: попадают в кучу точечно
+            def create(driver, seconds, i):
+                departure = (local_now() + timedelta(seconds=seconds)).replace(microsecond=0)
+                response = client.post("/api/trips/create", params={"telegram_id": driver.telegram_id}, json={
+                    "departure_date": departure.isoformat(), "departure_time": departure.strftime("%H:%M"),
+                    "start_address": f"Москва, ул. Новая {i}", "finish_address": "Тула",
+                    "available_seats": 3, "price_per_seat": 400
+                })
+                assert response.status_code == 200, response.text
+                return response.json()["trip_id"]
+
+            new_trip = create(drivers[6], 25, 1)
+            cancelled_trip = create(drivers[7], 25, 2)
+            response = client.post("/api/bookings/create", params={"telegram_id": passengers[4].telegram_id},
+                                   json={"driver_trip_id": new_trip, "booked_seats": 1})
+            assert response.status_code == 200, response.text
+            expected.update({drivers[6].telegram_id: 1, passengers[4].telegram_id: 1})
+
+            # Отмена поездки: в API такого эндпоинта пока нет, поэтому — напрямую
+            db = database.SessionLocal()
+            db.get(database.DriverTrip, cancelled_trip).status = database.TripStatus.CANCELLED
+            db.commit()
+            db.close()
+            api.reminder_scheduler.trip_cancelled(cancelled_trip)
+
+            # Ждем последнего отправления и доставки
+            deadline = time.monotonic() + 60
+            while time.monotonic() < deadline:
+                time.sleep(1)
+                db = database.SessionLocal()
+                try:
+                    pending = db.execute(
+                        select(database.Notification.id)
+                        .where(database.Notification.status == database.NotificationStatus.PENDING)
+                    ).first()
+                finally:
+                    db.close()
+                stats = api.reminder_scheduler.stats()
+                if not pending and stats["fired"] >= 4 and local_now() > now + timedelta(seconds=35):
+                    break
+
+            # План запроса пересборки: диапазон по индексу, без полного прохода
+            with database.engine.connect() as conn:
+                compiled = api.reminder_scheduler._range_query(local_now(), local_now() + timedelta(hours=6)).compile(
+                    conn, compile_kwargs={"literal_binds": True})
+                plan = normalize_plan(conn.dialect.name, conn.exec_driver_sql(
+                    ("EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN ") + str(compiled)).all())
+        calls = httpx.get(f"http://127.0.0.1:{port}/calls", timeout=30).json()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    received = Counter()
+    for call in calls:
+        if call["method"].lower() == "sendmessage":
+            for text in call["params"]["text"].split("\n\n"):
+                if text.startswith("⏰"):
+                    received[int(call["params"]["chat_id"])] += 1
+
+    report = {
+        "scheduler": stats,
+        "rebuild_plan": plan,
+        "reminders_expected": sum(expected.values()),
+        "reminders_received": sum(received.values()),
+        "missing": {chat: count for chat, count in (expected - received).items()},
+        "unexpected": {chat: count for chat, count in (received - expected).items()},
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    failures = []
+    if received != expected:
+        failures.append("получатели напоминаний не совпадают с ожидаемыми")
+    if full_scans(database.engine.dialect.name, plan) or not any("ix_driver_trips_departure" in line for line in plan):
+        failures.append("запрос пересборки не использует индекс по departure_date")
+    if failures:
+        raise SystemExit("❌ " + "; ".join(failures))
+    print(f"✅ {sum(received.values())} напоминаний доставлено ровно нужным получателям")
+
+if __name__ == "__main__":
+    main()
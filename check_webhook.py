@@ -0,0 +1,94 @@
+# check_webhook.py - ПРОВЕРКА WEBHOOK БОТА НА ЗАГЛУШКЕ BOT API
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+
+BOT_TOKEN = "123456:webhook"
+WEBHOOK_URL = "https://api.example.test"
+WEBHOOK_SECRET = "check-webhook-secret"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Обновления бота через webhook API: регистрация, секрет, ответы и 503 вне работы бота")
+    parser.add_argument("--updates", type=int, default=200, help="Обновлений через webhook")
+    parser.add_argument("--chats", type=int, default=20, help="Разных чатов")
+    parser.add_argument("--timeout", type=float, default=30, help="Сколько ждать ответов бота, секунд")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    from fake_bot_api import fake_update, free_port, spawn
+
+    port = free_port()
+    # Окружение задается до импорта database/main
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'webhook.db')}"
+    os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{port}"
+    os.environ["TELEGRAM_WEBHOOK_URL"] = WEBHOOK_URL
+    os.environ["TELEGRAM_WEBHOOK_SECRET"] = WEBHOOK_SECRET
+
+    import httpx
+    from fastapi.testclient import TestClient
+    import main as api
+    from bot_webhook import WEBHOOK_PATH
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}
+    updates = [fake_update(update_id, 1000 + update_id % args.chats, ("/start", "/help", "попутчик нужен")[update_id % 3])
+               for update_id in range(1, args.updates + 1)]
+    statuses = {}
+    stub = spawn(port, token=BOT_TOKEN)
+    try:
+        # Без lifespan приложение бота не запущено
+        statuses["before_start"] = TestClient(api.app).post(WEBHOOK_PATH, headers=headers, json=updates[0]).status_code
+        with TestClient(api.app) as client:
+            statuses["wrong_secret"] = client.post(
+                WEBHOOK_PATH, headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}, json=updates[0]
+            ).status_code
+            started = time.perf_counter()
+            accepted = Counter(client.post(WEBHOOK_PATH, headers=headers, json=update).status_code for update in updates)
+            accept_seconds = time.perf_counter() - started
+            # Ответы бота уходят в заглушку асинхронно — ждем, пока придут все
+            deadline = time.monotonic() + args.timeout
+            while True:
+                calls = httpx.get(f"http://127.0.0.1:{port}/calls", timeout=30).json()
+                sends = [call for call in calls if call["method"].lower() == "sendmessage"]
+                if len(sends) >= args.updates or time.monotonic() > deadline:
+                    break
+                time.sleep(0.2)
+        statuses["after_stop"] = TestClient(api.app).post(WEBHOOK_PATH, headers=headers, json=updates[0]).status_code
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    webhook = next((call["params"] for call in calls if call["method"].lower() == "setwebhook"), {})
+    expected = Counter(update["message"]["chat"]["id"] for update in updates)
+    replied = Counter(int(call["params"]["chat_id"]) for call in sends)
+    report = {
+        "updates": args.updates,
+        "accepted": dict(accepted),
+        "accept_ms_per_update": round(accept_seconds / args.updates * 1000, 3),
+        "replies": len(sends),
+        "set_webhook": {"url": webhook.get("url"), "secret_token": webhook.get("secret_token") == WEBHOOK_SECRET},
+        "status_codes": statuses,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    failures = []
+    if webhook.get("url") != WEBHOOK_URL + WEBHOOK_PATH or webhook.get("secret_token") != WEBHOOK_SECRET:
+        failures.append("webhook не зарегистрирован с нужным адресом и секретом")
+    if statuses["wrong_secret"] != 403:
+        failures.append("обновление с неверным секретом принято")
+    if statuses["before_start"] != 503 or statuses["after_stop"] != 503:
+        failures.append("вне работы бота webhook отвечает не 503")
+    if accepted != Counter({200: args.updates}):
+        failures.append("не все обновления приняты")
+    if replied != expected:
+        failures.append(f"ответов {len(sends)} из {args.updates} или не в те чаты")
+    if failures:
+        raise SystemExit("❌ " + "; ".join(failures))
+    print(f"✅ {args.updates} обновлений приняты и отвечены, вне работы бота — 503")
+
+if __name__ == "__main__":
+    main()
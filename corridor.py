@@ -0,0 +1,360 @@
+# corridor.py - ПОИСК ПО КОРИДОРУ МАРШРУТА: ПОПУТЧИКИ ПО ПУТИ, А НЕ ТОЛЬКО ОТ ГОРОДА ДО ГОРОДА
+import asyncio
+import math
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+from sqlalchemy import select
+import database
+from reminders import departure_moment, local_now
+
+# Насколько далеко от маршрута водителя может быть точка посадки/высадки
+CORRIDOR_RADIUS_KM = float(os.getenv("CORRIDOR_RADIUS_KM", "5"))
+CORRIDOR_MAX_RADIUS_KM = float(os.getenv("CORRIDOR_MAX_RADIUS_KM", "25"))
+# Сторона ячейки сетки; маршрут упрощается с допуском CORRIDOR_SIMPLIFY_KM
+CORRIDOR_CELL_KM = float(os.getenv("CORRIDOR_CELL_KM", "10"))
+CORRIDOR_SIMPLIFY_KM = float(os.getenv("CORRIDOR_SIMPLIFY_KM", "0.2"))
+CORRIDOR_REBUILD_INTERVAL = float(os.getenv("CORRIDOR_REBUILD_INTERVAL", "900"))
+# Пределы маршрута от клиента: точек в route_points и символов в polyline
+CORRIDOR_MAX_ROUTE_POINTS = int(os.getenv("CORRIDOR_MAX_ROUTE_POINTS", "5000"))
+CORRIDOR_MAX_POLYLINE_CHARS = int(os.getenv("CORRIDOR_MAX_POLYLINE_CHARS", "50000"))
+KM_PER_DEGREE = 111.32
+
+def decode_polyline(encoded: str, precision: int = 5) -> List[tuple]:
+    """Encoded Polyline (формат Google/OSRM) в список (lat, lng)"""
+    points, index, lat, lng = [], 0, 0, 0
+    factor = 10 ** precision
+    while index < len(encoded):
+        for axis in (0, 1):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            delta = ~(result >> 1) if result & 1 else result >> 1
+            if axis == 0:
+                lat += delta
+            else:
+                lng += delta
+        points.append((lat / factor, lng / factor))
+    return points
+
+def valid_point(lat, lng) -> bool:
+    return -90 <= lat <= 90 and -180 <= lng <= 180
+
+def route_of(trip) -> List[tuple]:
+    """Точки маршрута поездки: route_points ([lat, lng] или {"lat", "lng"}), иначе polyline,
+    иначе отрезок между координатами начала и конца. Точки вне диапазона координат отбрасываются"""
+    points = []
+    for point in trip.route_points or ():
+        if isinstance(point, dict):
+            lat, lng = point.get("lat"), point.get("lng", point.get("lon"))
+        elif isinstance(point, (list, tuple)) and len(point) >= 2:
+            lat, lng = point[0], point[1]
+        else:
+            continue
+        if lat is not None and lng is not None:
+            points.append((float(lat), float(lng)))
+    if len(points) < 2 and trip.polyline:
+        try:
+            points = decode_polyline(trip.polyline)
+        except (IndexError, TypeError):
+            points = []
+    if len(points) < 2 and None not in (trip.start_lat, trip.start_lng, trip.finish_lat, trip.finish_lng):
+        points = [(trip.start_lat, trip.start_lng), (trip.finish_lat, trip.finish_lng)]
+    points = [point for point in points if valid_point(*point)]
+    return points if len(points) >= 2 else []
+
+def _xy(lat, lng, lat0, lng0, kx):
+    """Плоские координаты в км вокруг (lat0, lng0): на десятках км погрешность несущественна"""
+    return (lng - lng0) * kx, (lat - lat0) * KM_PER_DEGREE
+
+def simplify(points: List[tuple], tolerance_km: float) -> List[tuple]:
+    """Дуглас — Пекер: выбросить точки, без которых линия смещается меньше чем на tolerance_km"""
+    if len(points) < 3 or tolerance_km <= 0:
+        return list(points)
+    lat0, lng0 = points[0]
+    kx = KM_PER_DEGREE * math.cos(math.radians(sum(lat for lat, _ in points) / len(points)))
+    xy = [_xy(lat, lng, lat0, lng0, kx) for lat, lng in points]
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (ax, ay), (bx, by) = xy[first], xy[last]
+        dx, dy = bx - ax, by - ay
+        length = math.hypot(dx, dy)
+        farthest, distance = None, tolerance_km
+        for i in range(first + 1, last):
+            px, py = xy[i]
+            if length:
+                d = abs(dy * (px - ax) - dx * (py - ay)) / length
+            else:
+                d = math.hypot(px - ax, py - ay)
+            if d > distance:
+                farthest, distance = i, d
+        if farthest is not None:
+            keep[farthest] = True
+            stack += [(first, farthest), (farthest, last)]
+    return [point for point, kept in zip(points, keep) if kept]
+
+def segment_distance(lat, lng, segment):
+    """Расстояние в км от точки до отрезка и доля отрезка до ближайшей точки (0..1)"""
+    lat1, lng1, lat2, lng2 = segment
+    kx = KM_PER_DEGREE * math.cos(math.radians(lat))
+    ax, ay = _xy(lat1, lng1, lat, lng, kx)
+    bx, by = _xy(lat2, lng2, lat, lng, kx)
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    t = 0.0 if not length2 else max(0.0, min(1.0, -(ax * dx + ay * dy) / length2))
+    return math.hypot(ax + t * dx, ay + t * dy), t
+
+def segment_length(segment):
+    lat1, lng1, lat2, lng2 = segment
+    kx = KM_PER_DEGREE * math.cos(math.radians((lat1 + lat2) / 2))
+    return math.hypot((lng2 - lng1) * kx, (lat2 - lat1) * KM_PER_DEGREE)
+
+class CorridorTrip(NamedTuple):
+    id: int
+    departure: datetime
+    seats: int
+    price: float
+    segments: list  # (lat1, lng1, lat2, lng2) упрощенного маршрута
+    offsets: list   # км от начала маршрута до начала каждого отрезка
+
+class CorridorHit(NamedTuple):
+    trip_id: int
+    pickup_km: float    # от точки посадки до маршрута
+    dropoff_km: float   # от точки высадки до маршрута
+    departure: datetime
+
+class CorridorIndex:
+    """Отрезки упрощенных маршрутов активных поездок в равномерной сетке по широте/долготе"""
+
+    def __init__(self, cell_km: float = CORRIDOR_CELL_KM, tolerance_km: float = CORRIDOR_SIMPLIFY_KM, session_factory=None):
+        self.cell = cell_km / KM_PER_DEGREE  # градусов; по долготе ячейка уже в cos(lat) раз
+        self.tolerance_km = tolerance_km
+        self.session_factory = session_factory or database.AsyncSessionLocal
+        self._trips: Dict[int, CorridorTrip] = {}
+        self._cells: Dict[tuple, set] = {}  # (i, j) -> {(trip_id, номер отрезка)}
+        self._replay = None  # изменения, пришедшие пока rebuild читает базу
+        self._adding = {}    # trip_id -> метка add_trip, чей маршрут еще разбирается в потоке
+        self._task = None
+        self.last_rebuild = None
+
+    def _segment_cells(self, segment):
+        """Ячейки, через которые проходит отрезок: режем его на куски не длиннее ячейки
+        и берем рамку каждого куска (не больше 2×2 ячеек), а не рамку всего отрезка —
+        у длинного диагонального отрезка она покрыла бы сотни тысяч ячеек"""
+        lat1, lng1, lat2, lng2 = segment
+        pieces = max(1, math.ceil(max(abs(lat2 - lat1), abs(lng2 - lng1)) / self.cell))
+        cells = set()
+        previous = (lat1, lng1)
+        for k in range(1, pieces + 1):
+            current = (lat1 + (lat2 - lat1) * k / pieces, lng1 + (lng2 - lng1) * k / pieces)
+            for i in range(math.floor(min(previous[0], current[0]) / self.cell), math.floor(max(previous[0], current[0]) / self.cell) + 1):
+                for j in range(math.floor(min(previous[1], current[1]) / self.cell), math.floor(max(previous[1], current[1]) / self.cell) + 1):
+                    cells.add((i, j))
+            previous = current
+        return cells
+
+    # --- Содержимое индекса ---
+
+    async def add_trip(self, trip, seats: int = None) -> bool:
+        """Поездка (строка или объект DriverTrip) в индекс; без маршрута и координат — пропускается.
+        Разбор и упрощение маршрута — в потоке, в индекс поездка попадает уже на event loop"""
+        token = self._adding[trip.id] = object()
+        prepared = await asyncio.to_thread(self._prepare, trip, seats)
+        # Пока маршрут разбирался, поездку успели заполнить или убрать — это изменение новее
+        if self._adding.get(trip.id) is not token:
+            return False
+        del self._adding[trip.id]
+        if self._replay is not None:
+            self._replay.append((self._insert, trip.id, prepared))
+        return self._insert(trip.id, prepared)
+
+    def _prepare(self, trip, seats: int = None):
+        """Поездка в виде для индекса вместе с ячейками отрезков; None — если ее нельзя индексировать"""
+        seats = trip.available_seats if seats is None else seats
+        points = route_of(trip)
+        if seats <= 0 or not points:
+            return None
+        points = simplify(points, self.tolerance_km)
+        segments = [(a[0], a[1], b[0], b[1]) for a, b in zip(points, points[1:])]
+        offsets, total = [], 0.0
+        for segment in segments:
+            offsets.append(total)
+            total += segment_length(segment)
+        entry = CorridorTrip(
+            trip.id, departure_moment(trip.departure_date, trip.departure_time),
+            seats, trip.price_per_seat or 0.0, segments, offsets
+        )
+        return entry, [self._segment_cells(segment) for segment in segments]
+
+    def _insert(self, trip_id, prepared) -> bool:
+        self._remove(trip_id)
+        if prepared is None:
+            return False
+        entry, cells = prepared
+        for number, segment_cells in enumerate(cells):
+            for cell in segment_cells:
+                self._cells.setdefault(cell, set()).add((trip_id, number))
+        self._trips[trip_id] = entry
+        return True
+
+    def _add(self, trip, seats: int = None) -> bool:
+        return self._insert(trip.id, self._prepare(trip, seats))
+
+    def remove_trip(self, trip_id):
+        self._adding.pop(trip_id, None)
+        if self._replay is not None:
+            self._replay.append((self._remove, trip_id))
+        self._remove(trip_id)
+
+    def _remove(self, trip_id):
+        trip = self._trips.pop(trip_id, None)
+        if trip is None:
+            return
+        for number, segment in enumerate(trip.segments):
+            for cell in self._segment_cells(segment):
+                entries = self._cells.get(cell)
+                if entries is not None:
+                    entries.discard((trip_id, number))
+                    if not entries:
+                        del self._cells[cell]
+
+    def seats_changed(self, trip, seats: int = None):
+        """Бронь или отмена: поменять места, а заполненную/снова открытую поездку убрать/вернуть"""
+        self._adding.pop(trip.id, None)
+        if self._replay is not None:
+            self._replay.append((self.seats_changed, trip, seats))
+        current = self._trips.get(trip.id)
+        seats = trip.available_seats if seats is None else seats
+        if seats <= 0:
+            self._remove(trip.id)
+        elif current is not None:
+            self._trips[trip.id] = current._replace(seats=seats)
+        else:
+            self._add(trip, seats)
+
+    # --- Поиск ---
+
+    def near(self, lat, lng, radius_km):
+        """Поездки, маршрут которых проходит ближе radius_km от точки:
+        trip_id -> (расстояние, км от начала маршрута до ближайшей к точке позиции)"""
+        found = {}
+        radius_lng = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        radius_lat = radius_km / KM_PER_DEGREE
+        seen = set()
+        for i in range(math.floor((lat - radius_lat) / self.cell), math.floor((lat + radius_lat) / self.cell) + 1):
+            for j in range(math.floor((lng - radius_lng) / self.cell), math.floor((lng + radius_lng) / self.cell) + 1):
+                for entry in self._cells.get((i, j), ()):
+                    if entry in seen:
+                        continue
+                    seen.add(entry)
+                    trip_id, number = entry
+                    trip = self._trips[trip_id]
+                    segment = trip.segments[number]
+                    distance, t = segment_distance(lat, lng, segment)
+                    if distance > radius_km:
+                        continue
+                    best = found.get(trip_id)
+                    if best is None or distance < best[0]:
+                        found[trip_id] = (distance, trip.offsets[number] + t * segment_length(segment))
+        return found
+
+    def search(self, start, finish, day: date, radius_km: float = CORRIDOR_RADIUS_KM,
+               passengers: int = 1, max_price: float = None) -> List[CorridorHit]:
+        """Поездки дня, проходящие рядом с началом и концом пути пассажира — именно в этом порядке.
+        Ближе к маршруту — выше"""
+        pickups = self.near(start[0], start[1], radius_km)
+        if not pickups:
+            return []
+        dropoffs = self.near(finish[0], finish[1], radius_km)
+        hits = []
+        for trip_id, (pickup_km, pickup_at) in pickups.items():
+            dropoff = dropoffs.get(trip_id)
+            # Направление — по ближайшим к пассажиру точкам маршрута: при пересекающихся кругах
+            # встречная поездка тоже проходит через оба, но ближайшие точки идут в обратном порядке
+            if dropoff is None or dropoff[1] <= pickup_at:
+                continue
+            trip = self._trips[trip_id]
+            if trip.departure.date() != day or trip.seats < passengers:
+                continue
+            if max_price is not None and trip.price > max_price:
+                continue
+            hits.append(CorridorHit(trip_id, round(pickup_km, 2), round(dropoff[0], 2), trip.departure))
+        hits.sort(key=lambda hit: (hit.pickup_km + hit.dropoff_km, hit.departure, hit.trip_id))
+        return hits
+
+    # --- Загрузка из базы ---
+
+    async def rebuild(self):
+        """Активные поездки со свободными местами — одним запросом по индексу departure_date"""
+        started = time.perf_counter()
+        now = local_now()
+        since = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        T = database.DriverTrip
+        fresh = CorridorIndex(tolerance_km=self.tolerance_km, session_factory=self.session_factory)
+        fresh.cell = self.cell
+        self._replay = []
+        try:
+            async with self.session_factory() as db:
+                rows = (await db.execute(
+                    select(T.id, T.departure_date, T.departure_time, T.available_seats, T.price_per_seat,
+                           T.route_points, T.polyline, T.start_lat, T.start_lng, T.finish_lat, T.finish_lng)
+                    .where(T.status == database.TripStatus.ACTIVE, T.available_seats > 0, T.departure_date >= since)
+                )).all()
+            # Разбор и упрощение тысяч маршрутов — секунды CPU: в потоке, пока запросы идут по старой сетке
+            indexed = await asyncio.to_thread(lambda: sum(
+                1 for row in rows
+                if departure_moment(row.departure_date, row.departure_time) >= now and fresh._add(row)
+            ))
+        finally:
+            replay, self._replay = self._replay, None
+        self._trips, self._cells = fresh._trips, fresh._cells
+        # Снимок мог быть прочитан раньше, чем закоммичены эти изменения — применяем их поверх
+        for change, *arguments in replay:
+            change(*arguments)
+        self.last_rebuild = {
+            "at": now.isoformat(timespec="seconds"),
+            "trips": indexed,
+            "without_route": len(rows) - indexed,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        return self.last_rebuild
+
+    async def _run(self):
+        while True:
+            try:
+                await self.rebuild()
+            except Exception as e:
+                print(f"⚠️  Не удалось пересобрать индекс маршрутов: {e}")
+            await asyncio.sleep(CORRIDOR_REBUILD_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "trips": len(self._trips),
+            "segments": sum(len(trip.segments) for trip in self._trips.values()),
+            "cells": len(self._cells),
+            "last_rebuild": self.last_rebuild,
+        }
+
+corridor_index = CorridorIndex()
@@ -1,18 +1,123 @@
 # database.py - ОПТИМИЗИРОВАННАЯ ВЕРСИЯ ДЛЯ TELEGRAM WEB APP
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Float, ForeignKey, Text, Enum, JSON
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Float, ForeignKey, Text, Enum, JSON, Index, event, inspect, text, select, update, insert, or_, func, case, true
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from datetime import datetime
 import enum
 import json
+import sqlite3
+from extract_city import city_key, extract_cities
 
 # SQLite база
 import os
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./travel_companion.db")
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-engine = create_engine(DATABASE_URL)
+
+def to_async_url(url: str) -> str:
+    """Тот же DATABASE_URL, но с асинхронным драйвером (aiosqlite / asyncpg)"""
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    if url.startswith("postgresql://"):
+        url = url.replace("postgresql://", "postgresql+asyncpg://", 1)
+        # asyncpg не понимает sslmode из строки подключения libpq
+        return url.replace("sslmode=", "ssl=")
+    return url
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+# Синхронный и асинхронный движки открыли бы две разные базы в памяти: схема, созданная
+# create_tables, не видна эндпоинтам. Для временной базы — файл во временном каталоге
+if IS_SQLITE and (":memory:" in DATABASE_URL or "mode=memory" in DATABASE_URL or DATABASE_URL.rstrip("/") == "sqlite:"):
+    raise RuntimeError(
+        f"DATABASE_URL={DATABASE_URL}: SQLite в памяти не поддерживается — "
+        "укажите файл, например sqlite:////tmp/travel_companion.db"
+    )
+
+# --- Профили пула соединений ---
+# local  — ноутбук / SQLite: мало соединений, без pre-ping
+# render — Postgres на Render: проверка соединений и переоткрытие раз в 30 минут,
+#          потому что провайдер рвет простаивающие соединения
+POOL_PROFILES = {
+    "local": {"pool_size": 5, "max_overflow": 5, "pool_timeout": 30, "pool_recycle": -1, "pool_pre_ping": False},
+    "render": {"pool_size": 10, "max_overflow": 10, "pool_timeout": 10, "pool_recycle": 1800, "pool_pre_ping": True},
+}
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def pool_settings():
+    """Настройки пула: профиль DB_POOL_PROFILE + точечные переопределения DB_POOL_*"""
+    profile = os.environ.get("DB_POOL_PROFILE", "local" if IS_SQLITE else "render")
+    settings = dict(POOL_PROFILES.get(profile, POOL_PROFILES["local"]))
+    for key, env in (("pool_size", "DB_POOL_SIZE"), ("max_overflow", "DB_MAX_OVERFLOW"),
+                     ("pool_timeout", "DB_POOL_TIMEOUT"), ("pool_recycle", "DB_POOL_RECYCLE")):
+        if env in os.environ:
+            settings[key] = int(os.environ[env])
+    settings["pool_pre_ping"] = _env_bool("DB_POOL_PRE_PING", settings["pool_pre_ping"])
+    return profile, settings
+
+POOL_PROFILE, POOL_SETTINGS = pool_settings()
+
+# --- Прагмы SQLite: WAL, чтобы запись не блокировала чтение ---
+SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+    "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", -64000)),  # отрицательное значение — в КиБ
+}
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def _engine_kwargs(asynchronous):
+    kwargs = dict(POOL_SETTINGS)
+    if asynchronous and IS_SQLITE:
+        # По умолчанию aiosqlite работает без пула и открывает соединение на каждый запрос
+        kwargs["poolclass"] = AsyncAdaptedQueuePool
+    return kwargs
+
+# Синхронный движок: создание схемы, скрипты обслуживания, бот
+engine = create_engine(DATABASE_URL, **_engine_kwargs(asynchronous=False))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Асинхронный движок: эндпоинты FastAPI
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_kwargs(asynchronous=True))
+
+if IS_SQLITE:
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+def describe_engine():
+    """Строка с фактическими настройками подключения для лога при старте"""
+    parts = [
+        f"драйвер {async_engine.dialect.name}+{async_engine.dialect.driver}",
+        f"профиль {POOL_PROFILE}",
+    ]
+    parts.append(
+        f"пул {POOL_SETTINGS['pool_size']}+{POOL_SETTINGS['max_overflow']}, "
+        f"timeout {POOL_SETTINGS['pool_timeout']}s, recycle {POOL_SETTINGS['pool_recycle']}s, "
+        f"pre_ping {'on' if POOL_SETTINGS['pool_pre_ping'] else 'off'}"
+    )
+    if IS_SQLITE:
+        with engine.connect() as conn:
+            effective = {
+                name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+                for name in SQLITE_PRAGMAS
+            }
+        parts.append(", ".join(f"{name}={value}" for name, value in effective.items()))
+    return "; ".join(parts)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # --- Enums ---
@@ -27,6 +132,11 @@ class TripStatus(str, enum.Enum):
     CANCELLED = "cancelled"
     IN_PROGRESS = "in_progress"
 
+class NotificationStatus(str, enum.Enum):
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+
 class CarType(str, enum.Enum):
     SEDAN = "sedan"
     HATCHBACK = "hatchback"
@@ -80,7 +190,7 @@ class DriverTrip(Base):
     __tablename__ = "driver_trips"
     
     id = Column(Integer, primary_key=True, index=True)
-    driver_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    driver_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     
     # Дата и время
     departure_date = Column(DateTime, nullable=False)
@@ -97,6 +207,10 @@ class DriverTrip(Base):
     finish_lng = Column(Float)
     finish_city = Column(String(100))
     
+    # Нормализованные ключи городов (см. extract_city.city_key)
+    start_city_key = Column(String(100))
+    finish_city_key = Column(String(100))
+    
     # Маршрут
     route_points = Column(JSON)
     route_distance = Column(Float)  # км
@@ -122,9 +236,17 @@ class DriverTrip(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Напоминание об отправлении: за сколько секунд до него уже отправлено (reminders.py)
+    reminded_before = Column(Integer)
+    
     # Связи
     driver = relationship("User", back_populates="driver_trips")
     bookings = relationship("Booking", back_populates="driver_trip", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index("ix_driver_trips_search", "status", "start_city_key", "finish_city_key", "departure_date", "price_per_seat"),
+        Index("ix_driver_trips_departure", "departure_date"),
+    )
 
 # --- Таблица запросов пассажиров ---
 class PassengerTrip(Base):
@@ -149,6 +271,10 @@ class PassengerTrip(Base):
     finish_lng = Column(Float)
     finish_city = Column(String(100))
     
+    # Нормализованные ключи городов (см. extract_city.city_key)
+    start_city_key = Column(String(100))
+    finish_city_key = Column(String(100))
+    
     # Детали запроса
     required_seats = Column(Integer, default=1)
     max_price = Column(Float)
@@ -163,15 +289,19 @@ class PassengerTrip(Base):
     # Связи
     passenger = relationship("User", back_populates="passenger_trips")
     bookings = relationship("Booking", back_populates="passenger_trip", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index("ix_passenger_trips_search", "status", "start_city_key", "finish_city_key", "desired_date"),
+    )
 
 # --- Таблица бронирований ---
 class Booking(Base):
     __tablename__ = "bookings"
     
     id = Column(Integer, primary_key=True, index=True)
-    driver_trip_id = Column(Integer, ForeignKey("driver_trips.id", ondelete="CASCADE"), nullable=False)
+    driver_trip_id = Column(Integer, ForeignKey("driver_trips.id", ondelete="CASCADE"), nullable=False, index=True)
     passenger_trip_id = Column(Integer, ForeignKey("passenger_trips.id", ondelete="CASCADE"))
-    passenger_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    passenger_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     
     # Детали бронирования
     booked_seats = Column(Integer, default=1)
@@ -191,6 +321,12 @@ class Booking(Base):
     passenger_trip = relationship("PassengerTrip", back_populates="bookings")
     passenger = relationship("User", foreign_keys=[passenger_id], back_populates="bookings_as_passenger")
     review = relationship("Review", uselist=False, back_populates="booking", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Проверка повторной брони: без составного индекса SQLite выбирает один из одиночных
+        # в зависимости от порядка их создания — и план запроса плавает
+        Index("ix_bookings_trip_passenger", "driver_trip_id", "passenger_id", "status"),
+    )
 
 # --- Таблица отзывов ---
 class Review(Base):
@@ -236,9 +372,252 @@ class Message(Base):
     sender = relationship("User", foreign_keys=[sender_id])
     receiver = relationship("User", foreign_keys=[receiver_id])
 
+# --- Исходящие уведомления в Telegram (outbox) ---
+# Строка пишется в той же транзакции, что и изменение брони; отправляет notifications.py
+class Notification(Base):
+    __tablename__ = "notifications"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(Integer, nullable=False)  # telegram_id получателя
+    booking_id = Column(Integer, ForeignKey("bookings.id", ondelete="SET NULL"))
+    event = Column(String(50), nullable=False)
+    text = Column(Text, nullable=False)
+    
+    status = Column(Enum(NotificationStatus), default=NotificationStatus.PENDING, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+    
+    __table_args__ = (
+        Index("ix_notifications_due", "status", "next_attempt_at"),
+    )
+
+# --- Таблица счетчиков для /stats ---
+class SystemCounter(Base):
+    __tablename__ = "system_counters"
+    
+    name = Column(String(50), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+COUNTER_NAMES = (
+    "users", "drivers", "passengers",
+    "driver_trips", "active_trips",
+    "bookings", "active_bookings",
+)
+
+def bump_counters_statement(**deltas):
+    """Один UPDATE, сдвигающий несколько счетчиков; None, если сдвигать нечего"""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return None
+    return (
+        update(SystemCounter)
+        .where(SystemCounter.name.in_(list(deltas)))
+        .values(value=SystemCounter.value + case(deltas, value=SystemCounter.name, else_=0))
+        .execution_options(synchronize_session=False)
+    )
+
+def exact_counters_query():
+    """Точные значения всех счетчиков одним запросом"""
+    def count_if(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+    
+    users = select(
+        func.count().label("users"),
+        count_if(User.has_car == True).label("drivers"),
+        count_if(User.has_car == False).label("passengers")
+    ).subquery()
+    trips = select(
+        func.count().label("driver_trips"),
+        count_if(DriverTrip.status == TripStatus.ACTIVE).label("active_trips")
+    ).subquery()
+    bookings = select(
+        func.count().label("bookings"),
+        count_if(Booking.status == TripStatus.ACTIVE).label("active_bookings")
+    ).subquery()
+    # Каждый подзапрос возвращает ровно одну строку, соединяем их без условий
+    return select(users, trips, bookings).select_from(
+        users.join(trips, true()).join(bookings, true())
+    )
+
+def counters_drift_query():
+    """Точные значения счетчиков (name) и сохраненные (stored_name, NULL — строки нет) одним запросом:
+    оба читаются из одного снимка базы, поэтому их разница — ровно расхождение на этот момент"""
+    exact = exact_counters_query().subquery()
+    stored = select(*[
+        func.max(case((SystemCounter.name == name, SystemCounter.value))).label(f"stored_{name}")
+        for name in COUNTER_NAMES
+    ]).subquery()
+    return select(exact, stored).select_from(exact.join(stored, true()))
+
+def correct_counters_statements(row):
+    """Исправить счетчики по строке counters_drift_query: недостающие — вставить, остальные сдвинуть
+    на расхождение тем же UPDATE value = value + delta, что и bump_counters. Сдвиг, а не перезапись:
+    счетчики, закоммиченные после снимка, не теряются"""
+    missing = [name for name in COUNTER_NAMES if row[f"stored_{name}"] is None]
+    statements = []
+    if missing:
+        statements.append(insert(SystemCounter).values([{"name": name, "value": row[name]} for name in missing]))
+    bump = bump_counters_statement(**{
+        name: row[name] - row[f"stored_{name}"] for name in COUNTER_NAMES if name not in missing
+    })
+    if bump is not None:
+        statements.append(bump)
+    return statements
+
+def counters_drift(row):
+    return {name: row[name] - (row[f"stored_{name}"] or 0) for name in COUNTER_NAMES}
+
+# --- Ключи городов заполняются при любой записи поездки ---
+def _fill_city_keys(mapper, connection, target):
+    if target.start_city_key is None:
+        target.start_city_key = city_key(target.start_city or target.start_address)
+    if target.finish_city_key is None:
+        target.finish_city_key = city_key(target.finish_city or target.finish_address)
+
+def _refresh_city_keys(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.start_city.history.has_changes() or state.attrs.start_address.history.has_changes():
+        target.start_city_key = None
+    if state.attrs.finish_city.history.has_changes() or state.attrs.finish_address.history.has_changes():
+        target.finish_city_key = None
+    _fill_city_keys(mapper, connection, target)
+
+for _model in (DriverTrip, PassengerTrip):
+    event.listen(_model, "before_insert", _fill_city_keys)
+    event.listen(_model, "before_update", _refresh_city_keys)
+
+# --- Полнотекстовый индекс адресов (запасной путь поиска) ---
+SQLITE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS driver_trips_fts USING fts5(
+        start_address, finish_address,
+        content='driver_trips', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS driver_trips_fts_ai AFTER INSERT ON driver_trips BEGIN
+        INSERT INTO driver_trips_fts(rowid, start_address, finish_address)
+        VALUES (new.id, new.start_address, new.finish_address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS driver_trips_fts_ad AFTER DELETE ON driver_trips BEGIN
+        INSERT INTO driver_trips_fts(driver_trips_fts, rowid, start_address, finish_address)
+        VALUES ('delete', old.id, old.start_address, old.finish_address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS driver_trips_fts_au AFTER UPDATE OF start_address, finish_address ON driver_trips BEGIN
+        INSERT INTO driver_trips_fts(driver_trips_fts, rowid, start_address, finish_address)
+        VALUES ('delete', old.id, old.start_address, old.finish_address);
+        INSERT INTO driver_trips_fts(rowid, start_address, finish_address)
+        VALUES (new.id, new.start_address, new.finish_address);
+    END""",
+]
+
+POSTGRES_TRGM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_driver_trips_start_address_trgm ON driver_trips USING gin (start_address gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_driver_trips_finish_address_trgm ON driver_trips USING gin (finish_address gin_trgm_ops)",
+]
+
+# Выставляется в upgrade_schema, когда FTS5-таблица адресов готова
+ADDRESS_FTS_ENABLED = False
+
+def has_address_fts():
+    """Есть ли FTS5-таблица адресов (только SQLite)"""
+    return ADDRESS_FTS_ENABLED
+
+def upgrade_schema():
+    """Добавить недостающие колонки и индексы в уже существующую базу"""
+    global ADDRESS_FTS_ENABLED
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in ("driver_trips", "passenger_trips"):
+            columns = {c["name"] for c in inspector.get_columns(table)}
+            for column in ("start_city_key", "finish_city_key"):
+                if column not in columns:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} VARCHAR(100)"))
+        if "reminded_before" not in {c["name"] for c in inspector.get_columns("driver_trips")}:
+            conn.execute(text("ALTER TABLE driver_trips ADD COLUMN reminded_before INTEGER"))
+    
+    # Индексы, появившиеся после создания таблиц
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    
+    # Заполняем ключи для старых строк
+    backfill_cities(missing_only=True)
+    
+    # Начальные значения счетчиков считаем один раз по таблицам
+    with engine.begin() as conn:
+        stored = {name for (name,) in conn.execute(select(SystemCounter.name))}
+        if stored != set(COUNTER_NAMES):
+            row = conn.execute(counters_drift_query()).mappings().one()
+            for statement in correct_counters_statements(row):
+                conn.execute(statement)
+    
+    if engine.dialect.name == "sqlite":
+        # Токенизатор trigram есть только с SQLite 3.34 (и FTS5 может быть не собран):
+        # без него поиск адресов остается на LIKE
+        try:
+            with engine.begin() as conn:
+                fts_exists = inspect(conn).has_table("driver_trips_fts")
+                for ddl in SQLITE_FTS_DDL:
+                    conn.execute(text(ddl))
+                if not fts_exists:
+                    conn.execute(text("INSERT INTO driver_trips_fts(driver_trips_fts) VALUES ('rebuild')"))
+            ADDRESS_FTS_ENABLED = True
+        except Exception as e:
+            print(f"⚠️  FTS5-индекс адресов не создан (SQLite {sqlite3.sqlite_version}), поиск через LIKE: {e}")
+    elif engine.dialect.name == "postgresql":
+        try:
+            with engine.begin() as conn:
+                for ddl in POSTGRES_TRGM_DDL:
+                    conn.execute(text(ddl))
+        except Exception as e:
+            print(f"⚠️  Триграммные индексы не созданы: {e}")
+
+def backfill_cities(chunk_size=1000, missing_only=False, progress=None):
+    """Пересчитать города и их ключи в поездках пачками по chunk_size строк"""
+    total = 0
+    for model in (DriverTrip, PassengerTrip):
+        last_id = 0
+        done = 0
+        while True:
+            query = select(model.id, model.start_address, model.finish_address).where(model.id > last_id)
+            if missing_only:
+                query = query.where(or_(model.start_city_key.is_(None), model.finish_city_key.is_(None)))
+            
+            db = SessionLocal()
+            try:
+                rows = db.execute(query.order_by(model.id).limit(chunk_size)).all()
+                if not rows:
+                    break
+                
+                start_cities = extract_cities(row.start_address for row in rows)
+                finish_cities = extract_cities(row.finish_address for row in rows)
+                db.execute(update(model), [
+                    {
+                        "id": row.id,
+                        "start_city": start_city,
+                        "finish_city": finish_city,
+                        "start_city_key": city_key(start_city),
+                        "finish_city_key": city_key(finish_city)
+                    }
+                    for row, start_city, finish_city in zip(rows, start_cities, finish_cities)
+                ])
+                db.commit()
+            finally:
+                db.close()
+            
+            last_id = rows[-1].id
+            done += len(rows)
+            if progress:
+                progress(model.__tablename__, done)
+        total += done
+    return total
+
 # Создаем таблицы
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    upgrade_schema()
     print("✅ Таблицы созданы:")
     print("   - users (пользователи)")
     print("   - driver_trips (поездки водителей)")
@@ -246,6 +625,7 @@ def create_tables():
     print("   - bookings (бронирования)")
     print("   - reviews (отзывы)")
     print("   - messages (сообщения)")
+    print("   - notifications (очередь уведомлений)")
 
 def get_db():
     db = SessionLocal()
@@ -254,6 +634,10 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # Функция для создания тестовых данных (оставляем на случай ручного тестирования)
 def create_test_data():
     db = SessionLocal()
@@ -1,73 +1,98 @@
 # extract_city.py - Функция для извлечения города из адреса
+import re
+from functools import lru_cache
 
+# Список городов России для определения
+CITY_KEYWORDS = {
+    "москва": ["москв", "moscow"],
+    "санкт-петербург": ["санкт-петербург", "спб", "питер", "st petersburg", "saint petersburg"],
+    "казань": ["казан"],
+    "екатеринбург": ["екатеринбург", "екб"],
+    "новосибирск": ["новосибирск"],
+    "нижний новгород": ["нижний новгород", "нижний"],
+    "самара": ["самар"],
+    "омск": ["омск"],
+    "челябинск": ["челябинск"],
+    "ростов-на-дону": ["ростов-на-дону", "ростов"],
+    "уфа": ["уфа"],
+    "красноярск": ["красноярск"],
+    "пермь": ["перм"],
+    "воронеж": ["воронеж"],
+    "волгоград": ["волгоград"],
+    "краснодар": ["краснодар"],
+    "саратов": ["саратов"],
+    "тюмень": ["тюмен"],
+    "тольятти": ["тольятти"],
+    "ижевск": ["ижевск"],
+    "барнаул": ["барнаул"],
+    "ульяновск": ["ульяновск"],
+    "иркутск": ["иркутск"],
+    "хабаровск": ["хабаровск"],
+    "ярославль": ["ярослав"],
+    "владивосток": ["владивосток"],
+    "махачкала": ["махачкала"],
+    "томск": ["томск"],
+    "оренбург": ["оренбург"],
+    "кемерово": ["кемерово"],
+    "новокузнецк": ["новокузнецк"],
+    "рязань": ["рязан"],
+    "астрахань": ["астрахан"],
+    "пенза": ["пенз"],
+    "липецк": ["липецк"],
+    "киров": ["киров"],
+    "чебоксары": ["чебоксар"],
+    "калининград": ["калининград"],
+    "тула": ["тул"],
+    "курск": ["курск"],
+    "сочи": ["сочи"],
+    "ставрополь": ["ставропол"],
+    "магнитогорск": ["магнитогорск"],
+    "брянск": ["брянск"],
+    "севастополь": ["севастопол"],
+    "нижний тагил": ["нижний тагил"],
+    "дзержинск": ["дзержинск"],
+    "орск": ["орск"],
+    "сургут": ["сургут"]
+}
+
+# Один регулярный шаблон на все ключевые слова, собирается при импорте.
+# Длинные ключевые слова идут первыми: "нижний тагил" важнее "нижний".
+_KEYWORD_TO_CITY = {
+    keyword: city
+    for city, keywords in reversed(list(CITY_KEYWORDS.items()))
+    for keyword in keywords
+}
+_CITY_PATTERN = re.compile("|".join(
+    re.escape(keyword) for keyword in sorted(_KEYWORD_TO_CITY, key=len, reverse=True)
+))
+
+@lru_cache(maxsize=4096)
 def extract_city(address: str) -> str:
-    """Извлечь город из адреса"""
+    """Извлечь город из адреса (первое упоминание города в строке)"""
     if not address:
         return "Не указано"
     
-    address_lower = address.lower()
-    
-    # Список городов России для определения
-    city_keywords = {
-        "москва": ["москв", "moscow"],
-        "санкт-петербург": ["санкт-петербург", "спб", "питер", "st petersburg", "saint petersburg"],
-        "казань": ["казан"],
-        "екатеринбург": ["екатеринбург", "екб"],
-        "новосибирск": ["новосибирск"],
-        "нижний новгород": ["нижний новгород", "нижний"],
-        "самара": ["самар"],
-        "омск": ["омск"],
-        "челябинск": ["челябинск"],
-        "ростов-на-дону": ["ростов-на-дону", "ростов"],
-        "уфа": ["уфа"],
-        "красноярск": ["красноярск"],
-        "пермь": ["перм"],
-        "воронеж": ["воронеж"],
-        "волгоград": ["волгоград"],
-        "краснодар": ["краснодар"],
-        "саратов": ["саратов"],
-        "тюмень": ["тюмен"],
-        "тольятти": ["тольятти"],
-        "ижевск": ["ижевск"],
-        "барнаул": ["барнаул"],
-        "ульяновск": ["ульяновск"],
-        "иркутск": ["иркутск"],
-        "хабаровск": ["хабаровск"],
-        "ярославль": ["ярослав"],
-        "владивосток": ["владивосток"],
-        "махачкала": ["махачкала"],
-        "томск": ["томск"],
-        "оренбург": ["оренбург"],
-        "кемерово": ["кемерово"],
-        "новокузнецк": ["новокузнецк"],
-        "рязань": ["рязан"],
-        "астрахань": ["астрахан"],
-        "пенза": ["пенз"],
-        "липецк": ["липецк"],
-        "киров": ["киров"],
-        "чебоксары": ["чебоксар"],
-        "калининград": ["калининград"],
-        "тула": ["тул"],
-        "курск": ["курск"],
-        "сочи": ["сочи"],
-        "ставрополь": ["ставропол"],
-        "магнитогорск": ["магнитогорск"],
-        "брянск": ["брянск"],
-        "севастополь": ["севастопол"],
-        "нижний тагил": ["нижний тагил"],
-        "дзержинск": ["дзержинск"],
-        "орск": ["орск"],
-        "сургут": ["сургут"]
-    }
-    
-    for city, keywords in city_keywords.items():
-        for keyword in keywords:
-            if keyword in address_lower:
-                return city
+    match = _CITY_PATTERN.search(address.lower())
+    if match:
+        return _KEYWORD_TO_CITY[match.group(0)]
     
     # Если город не найден, берем первую часть до запятой
     if ',' in address:
         return address.split(',')[0].strip()
     
     # Или ограничиваем длину
-    return address[:30] if len(address) > 30 else address
\ No newline at end of file
+    return address[:30] if len(address) > 30 else address
+
+def extract_cities(addresses) -> list:
+    """Пакетное извлечение городов для списка адресов"""
+    return [extract_city(address) for address in addresses]
+
+def city_key(value: str):
+    """Нормализованный ключ города для индексированного поиска"""
+    if not value or not value.strip():
+        return None
+    return extract_city(value.strip()).lower().replace("ё", "е").strip()
+
+def is_known_city(key: str) -> bool:
+    """Ключ соответствует городу из справочника"""
+    return key in CITY_KEYWORDS
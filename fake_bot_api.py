@@ -0,0 +1,156 @@
+# fake_bot_api.py - ЛОКАЛЬНАЯ ЗАГЛУШКА TELEGRAM BOT API ДЛЯ ПРОВЕРКИ БОТА
+import argparse
+import asyncio
+import json
+import random
+import socket
+import time
+from collections import deque
+from itertools import count
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Travel Companion", "username": "travel_companion_test_bot"}
+
+# Лимиты настоящего Telegram: не чаще раза в секунду в чат и ~30 сообщений в секунду на бота
+CHAT_INTERVAL = 1.0
+GLOBAL_PER_SECOND = 30
+
+def make_app(reply_delay: float = 0.0, flood_limits: bool = False, error_rate: float = 0.0):
+    """Bot API, который отвечает как настоящий и запоминает вызовы в app.state.calls.
+    flood_limits — отвечать 429 при превышении лимитов, error_rate — доля ответов 502"""
+    app = FastAPI(title="Fake Telegram Bot API")
+    app.state.calls = []
+    app.state.webhook = None
+    message_ids = count(1)
+    last_by_chat = {}
+    recent = deque()  # время последних успешных sendMessage
+
+    def flood_wait(chat_id, now):
+        """Сколько секунд ждать до следующего сообщения (0 — можно отправлять)"""
+        while recent and now - recent[0] >= 1:
+            recent.popleft()
+        if len(recent) >= GLOBAL_PER_SECOND:
+            return 1
+        previous = last_by_chat.get(chat_id)
+        if previous is not None and now - previous < CHAT_INTERVAL:
+            return max(1, round(CHAT_INTERVAL - (now - previous)))
+        return 0
+
+    async def read_params(request: Request):
+        # python-telegram-bot шлет форму, где значения — JSON; curl обычно шлет JSON целиком
+        if request.headers.get("content-type", "").startswith("application/json"):
+            return await request.json()
+        params = {}
+        for key, value in (await request.form()).items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    @app.post("/bot{token}/{method}")
+    async def bot_method(token: str, method: str, request: Request):
+        params = await read_params(request)
+        call = {"method": method, "params": params, "at": time.time(), "status": 200}
+        app.state.calls.append(call)
+        name = method.lower()
+        if name == "sendmessage":
+            if error_rate and random.random() < error_rate:
+                call["status"] = 502
+                return JSONResponse({"ok": False, "error_code": 502, "description": "Bad Gateway"}, status_code=502)
+            chat_id = int(params["chat_id"])
+            wait = flood_wait(chat_id, call["at"]) if flood_limits else 0
+            if wait:
+                call["status"] = 429
+                return JSONResponse({
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {wait}",
+                    "parameters": {"retry_after": wait}
+                }, status_code=429)
+            last_by_chat[chat_id] = call["at"]
+            recent.append(call["at"])
+        if name == "getme":
+            result = BOT_USER
+        elif name == "setwebhook":
+            app.state.webhook = params
+            result = True
+        elif name == "getwebhookinfo":
+            webhook = app.state.webhook or {}
+            result = {"url": webhook.get("url", ""), "has_custom_certificate": False, "pending_update_count": 0,
+                      "allowed_updates": webhook.get("allowed_updates", [])}
+        elif name == "sendmessage":
+            if reply_delay:
+                await asyncio.sleep(reply_delay)
+            result = {
+                "message_id": next(message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return {"ok": True, "result": result}
+
+    @app.get("/calls")
+    async def calls():
+        return app.state.calls
+
+    return app
+
+def fake_update(update_id: int, chat_id: int, text: str, first_name: str = "Тест"):
+    """Обновление с текстовым сообщением, как его присылает Telegram"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private", "first_name": first_name},
+        "from": {"id": chat_id, "is_bot": False, "first_name": first_name},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def spawn(port: int, *options: str, token: str = "123456:test"):
+    """Запустить заглушку отдельным процессом и дождаться, пока она начнет отвечать"""
+    import os
+    import subprocess
+    import sys
+    import httpx
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--port", str(port), *options],
+        stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            httpx.post(f"http://127.0.0.1:{port}/bot{token}/getMe")
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit("❌ Заглушка Bot API не запустилась")
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Bot API: TELEGRAM_API_URL=http://127.0.0.1:<порт>")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--reply-delay-ms", type=float, default=0, help="Задержка ответа на sendMessage")
+    parser.add_argument("--flood-limits", action="store_true", help="Отвечать 429, как Telegram при превышении лимитов")
+    parser.add_argument("--error-rate", type=float, default=0, help="Доля sendMessage, на которые ответить 502")
+    args = parser.parse_args()
+
+    import uvicorn
+    print(f"🧪 Заглушка Bot API: http://{args.host}:{args.port} (вызовы: /calls)")
+    app = make_app(args.reply_delay_ms / 1000, flood_limits=args.flood_limits, error_rate=args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# identity_cache.py - КЭШ telegram_id → ПОЛЬЗОВАТЕЛЬ ДЛЯ АВТОРИЗАЦИИ ЗАПРОСОВ
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from sqlalchemy import event, inspect, select
+import database
+
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "300"))
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    """Неизменяемый слепок пользователя: то, что нужно эндпоинтам без полной строки"""
+    id: int
+    telegram_id: int
+    has_car: Optional[bool]
+    role: Optional[database.UserRole]
+    first_name: str
+    last_name: Optional[str]
+    driver_rating: Optional[float]
+    passenger_rating: Optional[float]
+
+SNAPSHOT_FIELDS = UserSnapshot.__slots__
+SNAPSHOT_COLUMNS = [getattr(database.User, name) for name in SNAPSHOT_FIELDS]
+
+def snapshot_of(user) -> UserSnapshot:
+    return UserSnapshot(*(getattr(user, name) for name in SNAPSHOT_FIELDS))
+
+class IdentityCache:
+    """LRU-кэш слепков пользователей с TTL (страховка от изменений из других процессов)"""
+
+    def __init__(self, max_size=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # telegram_id -> (истекает, слепок)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id: int) -> Optional[UserSnapshot]:
+        entry = self._entries.get(telegram_id)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, snapshot: UserSnapshot):
+        if self.max_size <= 0:
+            return
+        self._entries[snapshot.telegram_id] = (time.monotonic() + self.ttl, snapshot)
+        self._entries.move_to_end(snapshot.telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def refresh(self, user):
+        """Положить актуальный слепок после записи пользователя"""
+        self.put(snapshot_of(user))
+
+    def invalidate(self, telegram_id: int):
+        self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+    async def resolve(self, db, telegram_id: int) -> Optional[UserSnapshot]:
+        """Слепок пользователя из кэша, а при промахе — один SELECT нужных колонок"""
+        snapshot = self.get(telegram_id)
+        if snapshot is not None:
+            return snapshot
+        row = (await db.execute(
+            select(*SNAPSHOT_COLUMNS).where(database.User.telegram_id == telegram_id)
+        )).first()
+        if row is None:
+            return None
+        snapshot = UserSnapshot(*row)
+        self.put(snapshot)
+        return snapshot
+
+identity_cache = IdentityCache()
+
+# Любое изменение полей слепка через ORM (профиль, рейтинги, роль) сбрасывает запись
+def _invalidate_on_change(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in SNAPSHOT_FIELDS):
+        identity_cache.invalidate(target.telegram_id)
+        old_telegram_id = state.attrs.telegram_id.history.deleted
+        if old_telegram_id:
+            identity_cache.invalidate(old_telegram_id[0])
+
+def _invalidate_on_delete(mapper, connection, target):
+    identity_cache.invalidate(target.telegram_id)
+
+event.listen(database.User, "after_update", _invalidate_on_change)
+event.listen(database.User, "after_delete", _invalidate_on_delete)
@@ -1,21 +1,52 @@
 # main.py - ОПТИМИЗИРОВАННЫЙ API ДЛЯ TELEGRAM WEB APP
-from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, or_, and_, func
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response
+from sqlalchemy.orm import joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import desc, or_, and_, func, text, tuple_, update, case, literal, select
 from datetime import datetime, timedelta
 import database
 from contextlib import asynccontextmanager
-from typing import List, Optional
+from typing import Annotated, List, Optional, Tuple
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field, ValidationError
+import asyncio
 import json
-import hashlib
-import hmac
+import base64
 import os
+import secrets
+from extract_city import extract_city, city_key, is_known_city
+from search_cache import search_cache
+from activity_tracker import activity_tracker
+from identity_cache import identity_cache
+from auth_tokens import InitDataVerifier, SessionClaims, issue_session_token, verify_session_token
+import metrics
+from slow_queries import slow_query_log
+import sampling_profiler
+from bot_webhook import WEBHOOK_PATH, BotWebhook
+import notifications
+from reminders import ReminderScheduler
+from matching import match_index, minute_to_datetime, trip_slot
+from corridor import (CORRIDOR_MAX_POLYLINE_CHARS, CORRIDOR_MAX_RADIUS_KM, CORRIDOR_MAX_ROUTE_POINTS,
+                      CORRIDOR_RADIUS_KM, corridor_index)
 
 # Telegram Bot Token для верификации данных (если нужно)
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+init_data_verifier = InitDataVerifier(TELEGRAM_BOT_TOKEN) if TELEGRAM_BOT_TOKEN else None
+
+# Бот в том же процессе через webhook (если задан TELEGRAM_WEBHOOK_URL)
+telegram_bot = BotWebhook.from_env(TELEGRAM_BOT_TOKEN)
+
+# Уведомления о бронированиях: пишутся в outbox вместе с бронью, отправляются фоновой задачей
+notification_dispatcher = notifications.NotificationDispatcher.from_env(TELEGRAM_BOT_TOKEN)
+# Напоминания об отправлении поездок — через ту же очередь уведомлений
+reminder_scheduler = ReminderScheduler.from_env(notification_dispatcher)
+
+# Запретить старый способ авторизации через ?telegram_id= без токена сессии
+SESSION_TOKEN_REQUIRED = os.getenv("SESSION_TOKEN_REQUIRED", "").lower() in ("1", "true", "yes")
+
+# Токен для служебных эндпоинтов /admin и /debug (заголовок X-Admin-Token)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
 # Pydantic схемы
 class TelegramUser(BaseModel):
@@ -31,15 +62,21 @@ class LoginRequest(BaseModel):
     initData: Optional[str] = None
     user: Optional[TelegramUser] = None
 
+Latitude = Annotated[float, Field(ge=-90, le=90)]
+Longitude = Annotated[float, Field(ge=-180, le=180)]
+
 class DriverTripCreate(BaseModel):
     departure_date: datetime
-    departure_time: str = Field(..., regex=r'^([0-1][0-9]|2[0-3]):[0-5][0-9]$')
+    departure_time: str = Field(..., pattern=r'^([0-1][0-9]|2[0-3]):[0-5][0-9]$')
     start_address: str
-    start_lat: Optional[float] = None
-    start_lng: Optional[float] = None
+    start_lat: Optional[Latitude] = None
+    start_lng: Optional[Longitude] = None
     finish_address: str
-    finish_lat: Optional[float] = None
-    finish_lng: Optional[float] = None
+    finish_lat: Optional[Latitude] = None
+    finish_lng: Optional[Longitude] = None
+    # Маршрут: точки [lat, lng] или encoded polyline — для поиска попутчиков по пути
+    route_points: Optional[List[Tuple[Latitude, Longitude]]] = Field(None, max_length=CORRIDOR_MAX_ROUTE_POINTS)
+    polyline: Optional[str] = Field(None, max_length=CORRIDOR_MAX_POLYLINE_CHARS)
     available_seats: int = Field(..., ge=1, le=10)
     price_per_seat: float = Field(..., gt=0)
     comment: Optional[str] = None
@@ -64,53 +101,307 @@ class SearchQuery(BaseModel):
     date: str
     passengers: int = 1
     max_price: Optional[float] = None
+    limit: int = Field(20, ge=1, le=100)
+    cursor: Optional[str] = None
+
+class CorridorSearchQuery(BaseModel):
+    from_lat: Latitude
+    from_lng: Longitude
+    to_lat: Latitude
+    to_lng: Longitude
+    date: str
+    radius_km: float = Field(CORRIDOR_RADIUS_KM, gt=0, le=CORRIDOR_MAX_RADIUS_KM)
+    passengers: int = 1
+    max_price: Optional[float] = None
+    limit: int = Field(20, ge=1, le=100)
+
+# Схемы ответов горячих эндпоинтов: сериализуются pydantic-core, а не jsonable_encoder
+class RouteOut(BaseModel):
+    from_: str = Field(..., alias="from")
+    to: str
+
+class CityRouteOut(RouteOut):
+    from_city: Optional[str] = None
+    to_city: Optional[str] = None
+
+class DepartureOut(BaseModel):
+    date: str
+    time: Optional[str] = None
+    datetime: str
+
+class SearchDriverOut(BaseModel):
+    id: int
+    name: str
+    rating: Optional[float] = None
+    avatar_initials: str
+
+class SearchSeatsOut(BaseModel):
+    available: int
+    price_per_seat: Optional[float] = None
+    total_price: Optional[float] = None
+
+class SearchDetailsOut(BaseModel):
+    distance: Optional[float] = None
+    duration: Optional[int] = None
+    comment: Optional[str] = None
+    allow_smoking: Optional[bool] = None
+    allow_animals: Optional[bool] = None
+
+class SearchCarOut(BaseModel):
+    model: Optional[str] = None
+    color: Optional[str] = None
+    type: Optional[database.CarType] = None
+
+class SearchTripOut(BaseModel):
+    id: int
+    driver: SearchDriverOut
+    route: CityRouteOut
+    departure: DepartureOut
+    seats: SearchSeatsOut
+    details: SearchDetailsOut
+    car_info: Optional[SearchCarOut] = None
+
+class SearchResponse(BaseModel):
+    success: bool
+    count: int
+    trips: List[SearchTripOut]
+    next_cursor: Optional[str] = None
+
+class CorridorOut(BaseModel):
+    pickup_km: float
+    dropoff_km: float
+
+class CorridorTripOut(SearchTripOut):
+    corridor: CorridorOut
+
+class CorridorSearchResponse(BaseModel):
+    success: bool
+    count: int
+    trips: List[CorridorTripOut]
 
-# Функция для проверки Telegram Web App данных (опционально)
-def verify_telegram_data(init_data: str, bot_token: str) -> bool:
-    """Проверка подписи данных от Telegram"""
+class TripDriverOut(BaseModel):
+    id: int
+    name: str
+    rating: Optional[float] = None
+    total_trips: Optional[int] = None
+    phone: Optional[str] = None
+
+class TripDetailsOut(SearchDetailsOut):
+    allow_luggage: Optional[bool] = None
+    allow_music: Optional[bool] = None
+
+class TripCarOut(SearchCarOut):
+    plate: Optional[str] = None
+    seats: Optional[int] = None
+
+class TripOut(BaseModel):
+    id: int
+    driver: TripDriverOut
+    route: CityRouteOut
+    departure: DepartureOut
+    seats: SearchSeatsOut
+    details: TripDetailsOut
+    car_info: Optional[TripCarOut] = None
+    status: database.TripStatus
+    created_at: Optional[str] = None
+
+class TripResponse(BaseModel):
+    success: bool
+    trip: TripOut
+
+class MyDriverTripOut(BaseModel):
+    id: int
+    route: RouteOut
+    date: str
+    available_seats: int
+    price_per_seat: Optional[float] = None
+    status: database.TripStatus
+    bookings_count: int
+
+class MyBookingOut(BaseModel):
+    id: int
+    trip_id: int
+    driver_name: str
+    route: RouteOut
+    date: str
+    seats: Optional[int] = None
+    price: Optional[float] = None
+    status: database.TripStatus
+
+class MyTripsOut(BaseModel):
+    as_driver: List[MyDriverTripOut]
+    as_passenger: List[MyBookingOut]
+
+class MyTripsResponse(BaseModel):
+    success: bool
+    user_id: int
+    trips: MyTripsOut
+
+class UserCarOut(BaseModel):
+    model: Optional[str] = None
+    color: Optional[str] = None
+    plate: Optional[str] = None
+    type: Optional[database.CarType] = None
+    seats: Optional[int] = None
+
+class RatingsOut(BaseModel):
+    driver: Optional[float] = None
+    passenger: Optional[float] = None
+
+class UserStatsOut(BaseModel):
+    driver_trips: Optional[int] = None
+    passenger_trips: Optional[int] = None
+
+class UserOut(BaseModel):
+    id: int
+    telegram_id: int
+    first_name: str
+    last_name: Optional[str] = None
+    username: Optional[str] = None
+    has_car: Optional[bool] = None
+    car_info: Optional[UserCarOut] = None
+    ratings: RatingsOut
+    stats: UserStatsOut
+    role: Optional[database.UserRole] = None
+    phone: Optional[str] = None
+
+class CurrentUserOut(UserOut):
+    registration_date: Optional[str] = None
+    last_active: Optional[str] = None
+
+class AuthResponse(BaseModel):
+    success: bool
+    message: str
+    token: str
+    user: UserOut
+
+class CurrentUserResponse(BaseModel):
+    success: bool
+    user: CurrentUserOut
+
+def format_departure(value: datetime):
+    """Дата поездки в двух видах (YYYY-MM-DD и DD.MM.YYYY HH:MM) за один вызов strftime"""
+    stamp = value.strftime("%Y-%m-%d %d.%m.%Y %H:%M")
+    return stamp[:10], stamp[11:]
+
+# Фильтр по городу для поиска поездок
+def address_match(address_column, value: str):
+    """Совпадение подстроки в адресе: FTS5 (trigram) на SQLite, ILIKE + pg_trgm на Postgres"""
+    value = value.strip()
+    if database.has_address_fts() and len(value) >= 3:
+        param = f"fts_{address_column.key}"
+        phrase = value.replace('"', '""')
+        match = text(
+            f"SELECT rowid FROM driver_trips_fts WHERE driver_trips_fts MATCH :{param}"
+        ).bindparams(**{param: f'{address_column.key} : "{phrase}"'})
+        return database.DriverTrip.id.in_(match)
+    return address_column.ilike(f"%{value}%")
+
+def city_filter(key_column, address_column, value: str):
+    """Условие поиска по городу через индекс ключей городов"""
+    key = city_key(value)
+    condition = key_column == key
+    if is_known_city(key):
+        return condition
+    # Города нет в справочнике — дополнительно ищем по тексту адреса
+    return or_(condition, address_match(address_column, value))
+
+# Курсор пагинации поиска: (departure_date, price_per_seat, id) последней поездки страницы
+def encode_search_cursor(trip) -> str:
+    raw = json.dumps([trip.departure_date.isoformat(), trip.price_per_seat, trip.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_search_cursor(cursor: str):
     try:
-        # Разбираем данные
-        pairs = init_data.split('&')
-        data_dict = {}
-        hash_value = None
-        
-        for pair in pairs:
-            key, value = pair.split('=')
-            if key == 'hash':
-                hash_value = value
-            else:
-                data_dict[key] = value
-        
-        if not hash_value:
-            return False
-        
-        # Создаем строку для проверки
-        check_string = '\n'.join([f"{k}={data_dict[k]}" for k in sorted(data_dict.keys())])
-        
-        # Вычисляем секретный ключ
-        secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
-        
-        # Вычисляем хеш
-        calculated_hash = hmac.new(secret_key, check_string.encode(), hashlib.sha256).hexdigest()
-        
-        return calculated_hash == hash_value
-    except:
-        return False
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        departure, price, trip_id = json.loads(raw)
+        return datetime.fromisoformat(departure), float(price), int(trip_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Неверный курсор пагинации")
+
+async def get_user_by_telegram_id(db: AsyncSession, telegram_id: int):
+    """Найти пользователя по Telegram ID"""
+    result = await db.execute(
+        select(database.User).where(database.User.telegram_id == telegram_id)
+    )
+    return result.scalars().first()
+
+async def get_user_identity(db: AsyncSession, telegram_id: int):
+    """Слепок пользователя (id, роль, машина, имя, рейтинги) из кэша, без полной строки"""
+    return await identity_cache.resolve(db, telegram_id)
+
+async def get_caller(
+    telegram_id: Optional[int] = Query(None, description="Telegram ID пользователя (если нет токена сессии)"),
+    authorization: Optional[str] = Header(None, description="Bearer <токен из /api/auth/telegram>")
+) -> SessionClaims:
+    """Кто делает запрос: по токену сессии, иначе по telegram_id из запроса"""
+    if authorization:
+        scheme, _, token = authorization.partition(" ")
+        claims = verify_session_token(token) if scheme.lower() == "bearer" else None
+        if claims is None:
+            raise HTTPException(status_code=401, detail="Сессия недействительна или истекла")
+        if telegram_id is not None and telegram_id != claims.telegram_id:
+            raise HTTPException(status_code=403, detail="telegram_id не совпадает с токеном сессии")
+        return claims
+    if telegram_id is None or SESSION_TOKEN_REQUIRED:
+        raise HTTPException(status_code=401, detail="Требуется токен сессии")
+    return SessionClaims(None, telegram_id, None)
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Доступ к служебным эндпоинтам только с ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Служебные эндпоинты выключены: не задан ADMIN_TOKEN")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Неверный токен администратора")
+
+async def get_caller_user_id(db: AsyncSession, caller: SessionClaims):
+    """id пользователя: из токена сессии без запроса к базе, иначе через кэш пользователей"""
+    if caller.user_id is not None:
+        return caller.user_id
+    user = await get_user_identity(db, caller.telegram_id)
+    return user.id if user else None
+
+async def bump_counters(db: AsyncSession, **deltas):
+    """Сдвинуть счетчики /stats в текущей транзакции"""
+    statement = database.bump_counters_statement(**deltas)
+    if statement is not None:
+        await db.execute(statement)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # При запуске создаем таблицы (без тестовых данных)
     database.create_tables()
     print("✅ База данных инициализирована")
+    print(f"⚙️  Подключение: {database.describe_engine()}")
+    activity_tracker.start()
+    match_index.start()
+    corridor_index.start()
+    if telegram_bot is not None:
+        await telegram_bot.start()
+    if notification_dispatcher is not None:
+        await notification_dispatcher.start()
+    if reminder_scheduler is not None:
+        reminder_scheduler.start()
     yield
-    # При остановке
+    # При остановке: дописываем накопленные отметки активности
+    if reminder_scheduler is not None:
+        await reminder_scheduler.stop()
+    if notification_dispatcher is not None:
+        await notification_dispatcher.stop()
+    if telegram_bot is not None:
+        await telegram_bot.stop()
+    await corridor_index.stop()
+    await match_index.stop()
+    await activity_tracker.stop()
+    await database.async_engine.dispose()
     print("👋 Сервер останавливается")
 
 app = FastAPI(
     title="Travel Companion API",
     version="3.0",
     description="API для сервиса поиска попутчиков с Telegram авторизацией",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -133,22 +424,34 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
-# Middleware для обработки Telegram данных
-@app.middleware("http")
-async def add_telegram_user(request: Request, call_next):
-    """Извлекаем данные пользователя Telegram из заголовков"""
-    try:
-        # Пытаемся получить telegram_id из заголовков
-        telegram_id = request.headers.get("X-Telegram-User-Id")
-        if telegram_id:
-            request.state.telegram_id = int(telegram_id)
-        else:
-            request.state.telegram_id = None
-    except:
-        request.state.telegram_id = None
-    
-    response = await call_next(request)
-    return response
+# Middleware для обработки Telegram данных: чистый ASGI, без обертки BaseHTTPMiddleware
+class TelegramUserMiddleware:
+    """Извлекаем telegram_id из заголовка X-Telegram-User-Id в request.state"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            telegram_id = None
+            for name, value in scope["headers"]:
+                if name == b"x-telegram-user-id":
+                    try:
+                        telegram_id = int(value)
+                    except ValueError:
+                        pass
+                    break
+            scope.setdefault("state", {})["telegram_id"] = telegram_id
+        await self.app(scope, receive, send)
+
+app.add_middleware(TelegramUserMiddleware)
+
+# Метрики — самым внешним слоем, чтобы в задержку вошли все middleware
+metrics.instrument_engine(database.async_engine.sync_engine, "async")
+metrics.instrument_engine(database.engine, "sync")
+slow_query_log.attach(database.async_engine, "async")
+slow_query_log.attach(database.engine, "sync")
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Главная страница
 @app.get("/")
@@ -163,24 +466,29 @@ def home():
 
 # =============== TELEGRAM АВТОРИЗАЦИЯ ===============
 
-@app.post("/api/auth/telegram")
-async def telegram_auth(login_data: LoginRequest, db: Session = Depends(database.get_db)):
+@app.post("/api/auth/telegram", response_model=AuthResponse)
+async def telegram_auth(login_data: LoginRequest, db: AsyncSession = Depends(database.get_async_db)):
     """Авторизация через Telegram Web App"""
     try:
-        # Получаем данные пользователя
-        if login_data.user:
+        # Получаем данные пользователя: при настроенном боте — только из подписанного initData
+        if init_data_verifier is not None:
+            fields = init_data_verifier.verify(login_data.initData) if login_data.initData else None
+            if fields is None or "user" not in fields:
+                raise HTTPException(status_code=401, detail="Неверная или устаревшая подпись initData")
+            try:
+                user_data = TelegramUser(**json.loads(fields["user"]))
+            except (ValueError, TypeError, ValidationError):
+                # Подпись верна, но поле user не JSON-объект нужного вида — это ошибка клиента, а не 500
+                raise HTTPException(status_code=401, detail="Неверные данные пользователя в initData")
+        elif login_data.user:
             user_data = login_data.user
         else:
-            # Если данные пришли в initData, можно их распарсить
-            # В данном примере используем готового пользователя
             raise HTTPException(status_code=400, detail="Необходимы данные пользователя")
         
         telegram_id = user_data.id
         
         # Проверяем существование пользователя
-        user = db.query(database.User).filter(
-            database.User.telegram_id == telegram_id
-        ).first()
+        user = await get_user_by_telegram_id(db, telegram_id)
         
         if not user:
             # Создаем нового пользователя
@@ -196,8 +504,10 @@ async def telegram_auth(login_data: LoginRequest, db: Session = Depends(database
                 role=database.UserRole.PASSENGER
             )
             db.add(user)
-            db.commit()
-            db.refresh(user)
+            await bump_counters(db, users=1, passengers=1)
+            await db.commit()
+            await db.refresh(user)
+            identity_cache.refresh(user)
             message = "Новый пользователь зарегистрирован"
         else:
             # Обновляем данные существующего пользователя
@@ -205,12 +515,13 @@ async def telegram_auth(login_data: LoginRequest, db: Session = Depends(database
             user.first_name = user_data.first_name
             user.last_name = user_data.last_name or user.last_name
             user.language_code = user_data.language_code or user.language_code
-            user.last_active = datetime.utcnow()
-            db.commit()
+            await db.commit()
+            identity_cache.refresh(user)
+            activity_tracker.touch(user.id)
             message = "Пользователь авторизован"
         
-        # Создаем токен сессии (можно использовать JWT, но для простоты вернем telegram_id)
-        session_token = f"telegram_{telegram_id}_{datetime.utcnow().timestamp()}"
+        # Подписанный токен: дальше запросы проверяются по нему без обращения к базе
+        session_token = issue_session_token(user.id, user.telegram_id)
         
         return {
             "success": True,
@@ -243,26 +554,25 @@ async def telegram_auth(login_data: LoginRequest, db: Session = Depends(database
             }
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка авторизации: {str(e)}")
 
-@app.get("/api/auth/me")
-def get_current_user(
-    telegram_id: int = Query(..., description="Telegram ID пользователя"),
-    db: Session = Depends(database.get_db)
+@app.get("/api/auth/me", response_model=CurrentUserResponse)
+async def get_current_user(
+    caller: SessionClaims = Depends(get_caller),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Получить данные текущего пользователя"""
-    user = db.query(database.User).filter(
-        database.User.telegram_id == telegram_id
-    ).first()
+    user = await get_user_by_telegram_id(db, caller.telegram_id)
     
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
-    # Обновляем время последней активности
-    user.last_active = datetime.utcnow()
-    db.commit()
+    # Время последней активности пишется в базу пачкой, без транзакции на чтение
+    last_active = activity_tracker.touch(user.id)
     
     return {
         "success": True,
@@ -291,26 +601,26 @@ def get_current_user(
             "role": user.role,
             "phone": user.phone,
             "registration_date": user.registration_date.isoformat() if user.registration_date else None,
-            "last_active": user.last_active.isoformat() if user.last_active else None
+            "last_active": last_active.isoformat()
         }
     }
 
 # =============== ПОЛЬЗОВАТЕЛИ ===============
 
 @app.put("/api/users/update")
-def update_user_profile(
-    telegram_id: int = Query(..., description="Telegram ID пользователя"),
+async def update_user_profile(
+    caller: SessionClaims = Depends(get_caller),
     update_data: UserUpdate = None,
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Обновить профиль пользователя"""
-    user = db.query(database.User).filter(
-        database.User.telegram_id == telegram_id
-    ).first()
+    user = await get_user_by_telegram_id(db, caller.telegram_id)
     
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
+    had_car = user.has_car
+    
     if update_data:
         # Обновляем только переданные поля
         update_dict = update_data.dict(exclude_unset=True)
@@ -331,8 +641,14 @@ def update_user_profile(
             elif user.role == database.UserRole.BOTH:
                 user.role = database.UserRole.PASSENGER
     
-    user.last_active = datetime.utcnow()
-    db.commit()
+    activity_tracker.touch(user.id)
+    await bump_counters(
+        db,
+        drivers=(user.has_car is True) - (had_car is True),
+        passengers=(user.has_car is False) - (had_car is False)
+    )
+    await db.commit()
+    identity_cache.refresh(user)
     
     return {
         "success": True,
@@ -349,10 +665,54 @@ def update_user_profile(
 
 # =============== ПОЕЗДКИ ===============
 
-@app.post("/api/trips/search")
-def search_trips(
+def search_trip_item(trip, passengers: int):
+    """Поездка в ответе поиска (SearchTripOut)"""
+    driver = trip.driver
+    departure_day, departure_display = format_departure(trip.departure_date)
+    
+    return {
+        "id": trip.id,
+        "driver": {
+            "id": driver.id,
+            "name": f"{driver.first_name} {driver.last_name or ''}".strip(),
+            "rating": driver.driver_rating,
+            "avatar_initials": f"{driver.first_name[0]}{driver.last_name[0] if driver.last_name else ''}"
+        },
+        "route": {
+            "from": trip.start_address,
+            "to": trip.finish_address,
+            "from_city": trip.start_city,
+            "to_city": trip.finish_city
+        },
+        "departure": {
+            "date": departure_day,
+            "time": trip.departure_time,
+            "datetime": departure_display
+        },
+        "seats": {
+            "available": trip.available_seats,
+            "price_per_seat": trip.price_per_seat,
+            "total_price": trip.price_per_seat * passengers
+        },
+        "details": {
+            "distance": trip.route_distance,
+            "duration": trip.route_duration,
+            "comment": trip.comment,
+            "allow_smoking": trip.allow_smoking,
+            "allow_animals": trip.allow_animals
+        },
+        "car_info": {
+            "model": driver.car_model,
+            "color": driver.car_color,
+            "type": driver.car_type
+        } if driver.has_car else None
+    }
+
+@app.post("/api/trips/search", response_model=SearchResponse)
+async def search_trips(
     search_query: SearchQuery,
-    db: Session = Depends(database.get_db)
+    response: Response,
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Поиск доступных поездок"""
     try:
@@ -360,81 +720,126 @@ def search_trips(
     except ValueError:
         raise HTTPException(status_code=400, detail="Неверный формат даты. Используйте YYYY-MM-DD")
     
-    # Ищем подходящие поездки
-    query = db.query(database.DriverTrip).filter(
+    # Повторные одинаковые запросы отдаем из кэша
+    cache_key = search_cache.make_key(
+        search_query.from_city,
+        search_query.to_city,
+        date_obj.date().isoformat(),
+        search_query.passengers,
+        search_query.max_price,
+        search_query.limit,
+        search_query.cursor
+    )
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        response.headers["X-Cache"] = "HIT"
+        return cached
+    response.headers["X-Cache"] = "MISS"
+    cache_generation = search_cache.generation
+    
+    # Ищем подходящие поездки (водитель подгружается тем же запросом)
+    query = select(database.DriverTrip).options(
+        joinedload(database.DriverTrip.driver)
+    ).where(
         database.DriverTrip.status == database.TripStatus.ACTIVE,
         database.DriverTrip.available_seats >= search_query.passengers,
         database.DriverTrip.departure_date >= date_obj,
         database.DriverTrip.departure_date < date_obj + timedelta(days=1)
     )
     
-    # Фильтр по городам
+    # Фильтр по городам (индекс ix_driver_trips_search)
     if search_query.from_city:
-        query = query.filter(or_(
-            database.DriverTrip.start_city.ilike(f"%{search_query.from_city}%"),
-            database.DriverTrip.start_address.ilike(f"%{search_query.from_city}%")
+        query = query.where(city_filter(
+            database.DriverTrip.start_city_key,
+            database.DriverTrip.start_address,
+            search_query.from_city
         ))
     
     if search_query.to_city:
-        query = query.filter(or_(
-            database.DriverTrip.finish_city.ilike(f"%{search_query.to_city}%"),
-            database.DriverTrip.finish_address.ilike(f"%{search_query.to_city}%")
+        query = query.where(city_filter(
+            database.DriverTrip.finish_city_key,
+            database.DriverTrip.finish_address,
+            search_query.to_city
         ))
     
-    # Сортировка по дате и цене
+    # Фильтр по цене
+    if search_query.max_price:
+        query = query.where(database.DriverTrip.price_per_seat <= search_query.max_price)
+    
+    # Продолжение с места, где закончилась предыдущая страница
+    if search_query.cursor:
+        query = query.where(
+            tuple_(
+                database.DriverTrip.departure_date,
+                database.DriverTrip.price_per_seat,
+                database.DriverTrip.id
+            ) > tuple_(*decode_search_cursor(search_query.cursor))
+        )
+    
+    # Сортировка по дате и цене (id — для однозначного порядка страниц)
     query = query.order_by(
         database.DriverTrip.departure_date,
-        database.DriverTrip.price_per_seat
+        database.DriverTrip.price_per_seat,
+        database.DriverTrip.id
     )
     
-    trips = query.all()
+    # Берем на одну запись больше, чтобы понять, есть ли следующая страница
+    trips = (await db.execute(query.limit(search_query.limit + 1))).scalars().all()
+    has_more = len(trips) > search_query.limit
+    trips = trips[:search_query.limit]
     
-    # Фильтр по цене
-    if search_query.max_price:
-        trips = [t for t in trips if t.price_per_seat <= search_query.max_price]
+    result = [search_trip_item(trip, search_query.passengers) for trip in trips]
+    
+    payload = {
+        "success": True,
+        "count": len(result),
+        "trips": result,
+        "next_cursor": encode_search_cursor(trips[-1]) if has_more else None
+    }
+    search_cache.put(cache_key, payload, cache_generation)
+    return payload
+
+@app.post("/api/trips/corridor-search", response_model=CorridorSearchResponse)
+async def corridor_search_trips(
+    search_query: CorridorSearchQuery,
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """Поездки, маршрут которых проходит рядом с началом и концом пути пассажира (в этом порядке)"""
+    try:
+        date_obj = datetime.strptime(search_query.date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный формат даты. Используйте YYYY-MM-DD")
+    
+    # Кандидаты — из сетки маршрутов в памяти; база нужна только для карточек найденных поездок
+    hits = corridor_index.search(
+        (search_query.from_lat, search_query.from_lng),
+        (search_query.to_lat, search_query.to_lng),
+        date_obj.date(),
+        radius_km=search_query.radius_km,
+        passengers=search_query.passengers,
+        max_price=search_query.max_price
+    )[:search_query.limit]
+    
+    trips = {}
+    if hits:
+        trips = {trip.id: trip for trip in (await db.execute(
+            select(database.DriverTrip)
+            .options(joinedload(database.DriverTrip.driver))
+            .where(
+                database.DriverTrip.id.in_([hit.trip_id for hit in hits]),
+                database.DriverTrip.status == database.TripStatus.ACTIVE,
+                database.DriverTrip.available_seats >= search_query.passengers
+            )
+        )).scalars()}
     
     result = []
-    for trip in trips:
-        # Получаем данные водителя
-        driver = trip.driver
-        
-        result.append({
-            "id": trip.id,
-            "driver": {
-                "id": driver.id,
-                "name": f"{driver.first_name} {driver.last_name or ''}".strip(),
-                "rating": driver.driver_rating,
-                "avatar_initials": f"{driver.first_name[0]}{driver.last_name[0] if driver.last_name else ''}"
-            },
-            "route": {
-                "from": trip.start_address,
-                "to": trip.finish_address,
-                "from_city": trip.start_city,
-                "to_city": trip.finish_city
-            },
-            "departure": {
-                "date": trip.departure_date.strftime("%Y-%m-%d"),
-                "time": trip.departure_time,
-                "datetime": trip.departure_date.strftime("%d.%m.%Y %H:%M")
-            },
-            "seats": {
-                "available": trip.available_seats,
-                "price_per_seat": trip.price_per_seat,
-                "total_price": trip.price_per_seat * search_query.passengers
-            },
-            "details": {
-                "distance": trip.route_distance,
-                "duration": trip.route_duration,
-                "comment": trip.comment,
-                "allow_smoking": trip.allow_smoking,
-                "allow_animals": trip.allow_animals
-            },
-            "car_info": {
-                "model": driver.car_model,
-                "color": driver.car_color,
-                "type": driver.car_type.value if driver.car_type else None
-            } if driver.has_car else None
-        })
+    for hit in hits:
+        trip = trips.get(hit.trip_id)
+        if trip is None:
+            continue  # индекс отстал: поездку уже заполнили или отменили
+        item = search_trip_item(trip, search_query.passengers)
+        item["corridor"] = {"pickup_km": hit.pickup_km, "dropoff_km": hit.dropoff_km}
+        result.append(item)
     
     return {
         "success": True,
@@ -442,28 +847,39 @@ def search_trips(
         "trips": result
     }
 
-@app.get("/api/trips/my")
-def get_my_trips(
-    telegram_id: int = Query(..., description="Telegram ID пользователя"),
-    db: Session = Depends(database.get_db)
+@app.get("/api/trips/my", response_model=MyTripsResponse)
+async def get_my_trips(
+    caller: SessionClaims = Depends(get_caller),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Получить мои поездки"""
-    user = db.query(database.User).filter(
-        database.User.telegram_id == telegram_id
-    ).first()
+    user_id = await get_caller_user_id(db, caller)
     
-    if not user:
+    if user_id is None:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
     # Поездки как водителя
-    driver_trips = db.query(database.DriverTrip).filter(
-        database.DriverTrip.driver_id == user.id
-    ).order_by(desc(database.DriverTrip.departure_date)).all()
+    driver_trips = (await db.execute(
+        select(database.DriverTrip)
+        .where(database.DriverTrip.driver_id == user_id)
+        .order_by(desc(database.DriverTrip.departure_date))
+    )).scalars().all()
+    
+    # Количество бронирований по всем поездкам водителя одним GROUP BY
+    bookings_count = dict((await db.execute(
+        select(database.Booking.driver_trip_id, func.count(database.Booking.id))
+        .join(database.DriverTrip, database.Booking.driver_trip_id == database.DriverTrip.id)
+        .where(database.DriverTrip.driver_id == user_id)
+        .group_by(database.Booking.driver_trip_id)
+    )).all()) if driver_trips else {}
     
-    # Бронирования как пассажира
-    passenger_bookings = db.query(database.Booking).filter(
-        database.Booking.passenger_id == user.id
-    ).order_by(desc(database.Booking.booked_at)).all()
+    # Бронирования как пассажира вместе с поездкой и водителем
+    passenger_bookings = (await db.execute(
+        select(database.Booking)
+        .options(joinedload(database.Booking.driver_trip).joinedload(database.DriverTrip.driver))
+        .where(database.Booking.passenger_id == user_id)
+        .order_by(desc(database.Booking.booked_at))
+    )).scalars().all()
     
     result = {
         "as_driver": [],
@@ -477,11 +893,11 @@ def get_my_trips(
                 "from": trip.start_address,
                 "to": trip.finish_address
             },
-            "date": trip.departure_date.strftime("%d.%m.%Y %H:%M"),
+            "date": format_departure(trip.departure_date)[1],
             "available_seats": trip.available_seats,
             "price_per_seat": trip.price_per_seat,
-            "status": trip.status.value,
-            "bookings_count": len(trip.bookings)
+            "status": trip.status,
+            "bookings_count": bookings_count.get(trip.id, 0)
         })
     
     for booking in passenger_bookings:
@@ -494,28 +910,30 @@ def get_my_trips(
                 "from": trip.start_address,
                 "to": trip.finish_address
             },
-            "date": trip.departure_date.strftime("%d.%m.%Y %H:%M"),
+            "date": format_departure(trip.departure_date)[1],
             "seats": booking.booked_seats,
             "price": booking.price_agreed or trip.price_per_seat,
-            "status": booking.status.value
+            "status": booking.status
         })
     
     return {
         "success": True,
-        "user_id": user.id,
+        "user_id": user_id,
         "trips": result
     }
 
 @app.post("/api/trips/create")
-def create_trip(
-    telegram_id: int = Query(..., description="Telegram ID пользователя"),
+async def create_trip(
+    caller: SessionClaims = Depends(get_caller),
     trip_data: DriverTripCreate = None,
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Создать новую поездку"""
-    user = db.query(database.User).filter(
-        database.User.telegram_id == telegram_id
-    ).first()
+    # Право создавать поездки — по строке из базы, а не по слепку кэша: он живет до
+    # IDENTITY_CACHE_TTL и сбрасывается при смене профиля только в своем процессе
+    user = (await db.execute(
+        select(database.User.id, database.User.has_car).where(database.User.telegram_id == caller.telegram_id)
+    )).first()
     
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
@@ -528,7 +946,6 @@ def create_trip(
     trip_dict["driver_id"] = user.id
     
     # Автоматически определяем города
-    from extract_city import extract_city
     trip_dict["start_city"] = extract_city(trip_data.start_address)
     trip_dict["finish_city"] = extract_city(trip_data.finish_address)
     
@@ -538,12 +955,21 @@ def create_trip(
     trip = database.DriverTrip(**trip_dict)
     
     db.add(trip)
-    db.commit()
-    db.refresh(trip)
     
-    # Обновляем счетчик поездок пользователя
-    user.total_driver_trips += 1
-    db.commit()
+    # Обновляем счетчик поездок пользователя (в той же транзакции)
+    await db.execute(
+        update(database.User)
+        .where(database.User.id == user.id)
+        .values(total_driver_trips=func.coalesce(database.User.total_driver_trips, 0) + 1)
+        .execution_options(synchronize_session=False)
+    )
+    await bump_counters(db, driver_trips=1, active_trips=1)
+    await db.commit()
+    search_cache.invalidate_trip(trip)
+    if reminder_scheduler is not None:
+        reminder_scheduler.trip_scheduled(trip.id, trip.departure_date, trip.departure_time)
+    match_index.upsert_trip(trip_slot(trip))
+    await corridor_index.add_trip(trip)
     
     return {
         "success": True,
@@ -557,20 +983,23 @@ def create_trip(
         }
     }
 
-@app.get("/api/trips/{trip_id}")
-def get_trip_details(
+@app.get("/api/trips/{trip_id}", response_model=TripResponse)
+async def get_trip_details(
     trip_id: int,
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Получить детали поездки"""
-    trip = db.query(database.DriverTrip).filter(
-        database.DriverTrip.id == trip_id
-    ).first()
+    trip = (await db.execute(
+        select(database.DriverTrip)
+        .options(joinedload(database.DriverTrip.driver))
+        .where(database.DriverTrip.id == trip_id)
+    )).scalars().first()
     
     if not trip:
         raise HTTPException(status_code=404, detail="Поездка не найдена")
     
     driver = trip.driver
+    departure_day, departure_display = format_departure(trip.departure_date)
     
     return {
         "success": True,
@@ -590,9 +1019,9 @@ def get_trip_details(
                 "to_city": trip.finish_city
             },
             "departure": {
-                "date": trip.departure_date.strftime("%Y-%m-%d"),
+                "date": departure_day,
                 "time": trip.departure_time,
-                "datetime": trip.departure_date.strftime("%d.%m.%Y %H:%M")
+                "datetime": departure_display
             },
             "seats": {
                 "available": trip.available_seats,
@@ -612,35 +1041,69 @@ def get_trip_details(
                 "model": driver.car_model,
                 "color": driver.car_color,
                 "plate": driver.car_plate,
-                "type": driver.car_type.value if driver.car_type else None,
+                "type": driver.car_type,
                 "seats": driver.car_seats
             } if driver.has_car else None,
-            "status": trip.status.value,
+            "status": trip.status,
             "created_at": trip.created_at.isoformat() if trip.created_at else None
         }
     }
 
+# =============== ПОДБОР ПОЕЗДОК ===============
+
+@app.get("/api/passenger-trips/{request_id}/matches")
+async def get_request_matches(
+    request_id: int,
+    caller: SessionClaims = Depends(get_caller),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """Подходящие поездки для запроса пассажира — из индекса подбора, без запросов к поездкам"""
+    request = match_index.request(request_id)
+    if request is None:
+        raise HTTPException(status_code=404, detail="Запрос не найден или уже неактуален")
+    
+    user_id = await get_caller_user_id(db, caller)
+    if user_id is None or user_id != request.passenger_id:
+        raise HTTPException(status_code=403, detail="Нет доступа к этому запросу")
+    
+    return {
+        "success": True,
+        "request_id": request_id,
+        "matches": [
+            {
+                "trip_id": match.trip_id,
+                "departure": minute_to_datetime(slot.minute).strftime("%d.%m.%Y %H:%M"),
+                "minutes_off": match.minutes_off,
+                "price_per_seat": match.price,
+                "available_seats": slot.seats
+            }
+            for match, slot in match_index.ranked(request_id)
+        ]
+    }
+
 # =============== БРОНИРОВАНИЯ ===============
 
 @app.post("/api/bookings/create")
-def create_booking(
-    telegram_id: int = Query(..., description="Telegram ID пользователя"),
+async def create_booking(
+    caller: SessionClaims = Depends(get_caller),
     booking_data: BookingCreate = None,
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Создать бронирование"""
-    user = db.query(database.User).filter(
-        database.User.telegram_id == telegram_id
-    ).first()
+    user_id = await get_caller_user_id(db, caller)
     
-    if not user:
+    if user_id is None:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
-    # Находим поездку
-    trip = db.query(database.DriverTrip).filter(
-        database.DriverTrip.id == booking_data.driver_trip_id,
-        database.DriverTrip.status == database.TripStatus.ACTIVE
-    ).first()
+    # Находим поездку вместе с водителем (данные для ответа)
+    trip = (await db.execute(
+        select(database.DriverTrip)
+        .options(joinedload(database.DriverTrip.driver))
+        .where(
+            database.DriverTrip.id == booking_data.driver_trip_id,
+            database.DriverTrip.status == database.TripStatus.ACTIVE
+        )
+    )).scalars().first()
     
     if not trip:
         raise HTTPException(status_code=404, detail="Поездка не найдена или недоступна")
@@ -649,105 +1112,216 @@ def create_booking(
         raise HTTPException(status_code=400, detail="Недостаточно свободных мест")
     
     # Проверяем, не забронировал ли уже пользователь эту поездку
-    existing_booking = db.query(database.Booking).filter(
-        database.Booking.driver_trip_id == booking_data.driver_trip_id,
-        database.Booking.passenger_id == user.id,
-        database.Booking.status == database.TripStatus.ACTIVE
-    ).first()
+    existing_booking = (await db.execute(
+        select(database.Booking.id).where(
+            database.Booking.driver_trip_id == booking_data.driver_trip_id,
+            database.Booking.passenger_id == user_id,
+            database.Booking.status == database.TripStatus.ACTIVE
+        ).limit(1)
+    )).first()
     
     if existing_booking:
         raise HTTPException(status_code=400, detail="Вы уже забронировали эту поездку")
     
-    # Создаем бронирование
+    booking_info = {
+        "trip_id": trip.id,
+        "driver_name": f"{trip.driver.first_name} {trip.driver.last_name or ''}".strip(),
+        "route": f"{trip.start_address} → {trip.finish_address}",
+        "date": trip.departure_date.strftime("%d.%m.%Y %H:%M"),
+        "seats": booking_data.booked_seats,
+        "price": trip.price_per_seat
+    }
+    
+    # Резервируем места одним условным UPDATE: проверка мест и смена статуса
+    # выполняются базой атомарно, поэтому параллельные брони не продадут лишнее
+    seats_left = database.DriverTrip.available_seats - booking_data.booked_seats
+    reserved = (await db.execute(
+        update(database.DriverTrip)
+        .where(
+            database.DriverTrip.id == trip.id,
+            database.DriverTrip.status == database.TripStatus.ACTIVE,
+            database.DriverTrip.available_seats >= booking_data.booked_seats
+        )
+        .values(
+            available_seats=seats_left,
+            status=case(
+                (seats_left <= 0, literal(database.TripStatus.COMPLETED, database.DriverTrip.status.type)),
+                else_=database.DriverTrip.status
+            )
+        )
+        .returning(database.DriverTrip.available_seats)
+        .execution_options(synchronize_session=False)
+    )).first()
+    
+    if reserved is None:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Недостаточно свободных мест")
+    
+    # Бронирование и счетчик пассажира — в той же транзакции
     booking = database.Booking(
-        driver_trip_id=booking_data.driver_trip_id,
-        passenger_id=user.id,
+        driver_trip_id=trip.id,
+        passenger_id=user_id,
         booked_seats=booking_data.booked_seats,
         price_agreed=trip.price_per_seat,
         notes=booking_data.notes,
         status=database.TripStatus.ACTIVE
     )
-    
-    # Обновляем количество свободных мест
-    trip.available_seats -= booking_data.booked_seats
-    if trip.available_seats <= 0:
-        trip.status = database.TripStatus.COMPLETED
-    
     db.add(booking)
-    db.commit()
-    db.refresh(booking)
-    
-    # Обновляем счетчик поездок пользователя
-    user.total_passenger_trips += 1
-    db.commit()
+    await db.execute(
+        update(database.User)
+        .where(database.User.id == user_id)
+        .values(total_passenger_trips=func.coalesce(database.User.total_passenger_trips, 0) + 1)
+        .execution_options(synchronize_session=False)
+    )
+    await bump_counters(
+        db,
+        bookings=1,
+        active_bookings=1,
+        active_trips=-1 if reserved.available_seats <= 0 else 0
+    )
+    await db.flush()
+    booking_id = booking.id
+    if notification_dispatcher is not None:
+        passenger = await get_user_identity(db, caller.telegram_id)
+        await notifications.enqueue(db, notifications.booking_created_messages(
+            booking_id, trip.driver.telegram_id, caller.telegram_id,
+            f"{passenger.first_name} {passenger.last_name or ''}".strip(),
+            booking_info["route"], booking_info["date"], booking_data.booked_seats
+        ))
+    await db.commit()
+    search_cache.invalidate_trip(trip)
+    # Мест стало меньше (или не осталось) — запросы, где была поездка, пересчитываются
+    match_index.upsert_trip(trip_slot(trip, seats=reserved.available_seats))
+    corridor_index.seats_changed(trip, reserved.available_seats)
+    if notification_dispatcher is not None:
+        notification_dispatcher.wake()
     
     return {
         "success": True,
         "message": "Место успешно забронировано",
-        "booking_id": booking.id,
-        "booking": {
-            "trip_id": trip.id,
-            "driver_name": f"{trip.driver.first_name} {trip.driver.last_name or ''}".strip(),
-            "route": f"{trip.start_address} → {trip.finish_address}",
-            "date": trip.departure_date.strftime("%d.%m.%Y %H:%M"),
-            "seats": booking.booked_seats,
-            "price": booking.price_agreed
-        }
+        "booking_id": booking_id,
+        "booking": booking_info
     }
 
 @app.post("/api/bookings/{booking_id}/cancel")
-def cancel_booking(
+async def cancel_booking(
     booking_id: int,
-    telegram_id: int = Query(..., description="Telegram ID пользователя"),
-    db: Session = Depends(database.get_db)
+    caller: SessionClaims = Depends(get_caller),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Отменить бронирование"""
-    booking = db.query(database.Booking).filter(
-        database.Booking.id == booking_id
-    ).first()
+    trip_loader = joinedload(database.Booking.driver_trip)
+    options = [trip_loader]
+    if notification_dispatcher is not None:
+        # Получатель уведомления — вторая сторона брони: берем обоих тем же запросом
+        options = [trip_loader.joinedload(database.DriverTrip.driver), joinedload(database.Booking.passenger)]
+    booking = (await db.execute(
+        select(database.Booking)
+        .options(*options)
+        .where(database.Booking.id == booking_id)
+    )).scalars().first()
     
     if not booking:
         raise HTTPException(status_code=404, detail="Бронирование не найдено")
     
     # Находим пользователя
-    user = db.query(database.User).filter(
-        database.User.telegram_id == telegram_id
-    ).first()
+    user_id = await get_caller_user_id(db, caller)
     
-    if not user:
+    if user_id is None:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
     # Проверяем права: пользователь должен быть либо пассажиром, либо водителем поездки
-    is_passenger = booking.passenger_id == user.id
-    is_driver = booking.driver_trip.driver_id == user.id
+    is_passenger = booking.passenger_id == user_id
+    is_driver = booking.driver_trip.driver_id == user_id
     
     if not (is_passenger or is_driver):
         raise HTTPException(status_code=403, detail="Нет прав для отмены этого бронирования")
     
-    # Обновляем статус
-    booking.status = database.TripStatus.CANCELLED
-    booking.cancelled_at = datetime.utcnow()
+    # Повторная отмена вернула бы места второй раз
+    if booking.status == database.TripStatus.CANCELLED:
+        raise HTTPException(status_code=400, detail="Бронирование уже отменено")
     
-    # Возвращаем места, если отменяет пассажир
+    was_active = booking.status == database.TripStatus.ACTIVE
+    reopened = False
+
+    # Обновляем статус только если его никто не поменял после чтения:
+    # две параллельные отмены одной брони вернули бы места дважды
+    cancelled = (await db.execute(
+        update(database.Booking)
+        .where(database.Booking.id == booking.id, database.Booking.status == booking.status)
+        .values(status=database.TripStatus.CANCELLED, cancelled_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )).rowcount
+
+    if not cancelled:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Бронирование уже отменено")
+
+    # Возвращаем места, если отменяет пассажир: прибавление и повторное открытие
+    # заполненной поездки — одним UPDATE, как резервирование в create_booking
+    trip = booking.driver_trip
     if is_passenger:
-        trip = booking.driver_trip
-        if trip.status == database.TripStatus.COMPLETED:
-            trip.status = database.TripStatus.ACTIVE
-        trip.available_seats += booking.booked_seats
-    
-    db.commit()
+        returned = (await db.execute(
+            update(database.DriverTrip)
+            .where(database.DriverTrip.id == trip.id)
+            .values(
+                available_seats=database.DriverTrip.available_seats + booking.booked_seats,
+                status=case(
+                    (database.DriverTrip.status == database.TripStatus.COMPLETED,
+                     literal(database.TripStatus.ACTIVE, database.DriverTrip.status.type)),
+                    else_=database.DriverTrip.status
+                )
+            )
+            .returning(database.DriverTrip.available_seats, database.DriverTrip.status)
+            .execution_options(synchronize_session=False)
+        )).one()
+        # COMPLETED ставит только бронь последнего места, так что поездку открыла эта отмена,
+        # если до нее мест не оставалось
+        reopened = returned.available_seats <= booking.booked_seats and returned.status == database.TripStatus.ACTIVE
+
+    await bump_counters(db, active_bookings=-1 if was_active else 0, active_trips=1 if reopened else 0)
+    if notification_dispatcher is not None:
+        actor, recipient = (booking.passenger, trip.driver) if is_passenger else (trip.driver, booking.passenger)
+        await notifications.enqueue(db, notifications.booking_cancelled_messages(
+            booking.id, recipient.telegram_id,
+            f"{actor.first_name} {actor.last_name or ''}".strip(),
+            f"{trip.start_address} → {trip.finish_address}",
+            trip.departure_date.strftime("%d.%m.%Y %H:%M")
+        ))
+    await db.commit()
+    if is_passenger:
+        search_cache.invalidate_trip(trip)
+        if returned.status == database.TripStatus.ACTIVE:
+            match_index.upsert_trip(trip_slot(trip, seats=returned.available_seats))
+            corridor_index.seats_changed(trip, returned.available_seats)
+    if notification_dispatcher is not None:
+        notification_dispatcher.wake()
     
     return {
         "success": True,
         "message": "Бронирование отменено"
     }
 
+# =============== TELEGRAM WEBHOOK ===============
+
+@app.post(WEBHOOK_PATH, include_in_schema=False)
+async def telegram_webhook(request: Request):
+    """Обновления бота от Telegram (режим webhook)"""
+    if telegram_bot is None:
+        raise HTTPException(status_code=404, detail="Webhook бота не настроен")
+    if not telegram_bot.check_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token")):
+        raise HTTPException(status_code=403, detail="Неверный секрет webhook")
+    if not await telegram_bot.enqueue(await request.json()):
+        # Ответ не 2xx — Telegram сохранит обновление и повторит доставку
+        raise HTTPException(status_code=503, detail="Бот не запущен")
+    return {"ok": True}
+
 # =============== СТАТИСТИКА И СИСТЕМА ===============
 
 @app.get("/health")
-def health(db: Session = Depends(database.get_db)):
+async def health(db: AsyncSession = Depends(database.get_async_db)):
     try:
-        db.execute("SELECT 1")
+        await db.execute(text("SELECT 1"))
         return {
             "status": "healthy",
             "database": "connected",
@@ -761,34 +1335,83 @@ def health(db: Session = Depends(database.get_db)):
         }
 
 @app.get("/stats")
-def stats(db: Session = Depends(database.get_db)):
+async def stats(
+    exact: bool = Query(False, description="Пересчитать счетчики по таблицам и исправить расхождения (только с ADMIN_TOKEN)"),
+    x_admin_token: Optional[str] = Header(None),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    # Пересчет сканирует все таблицы и пишет в счетчики — не для анонимных запросов
+    if exact:
+        await require_admin(x_admin_token)
+    stored = dict((await db.execute(
+        select(database.SystemCounter.name, database.SystemCounter.value)
+    )).all())
+    
+    drift = None
+    if exact or set(stored) != set(database.COUNTER_NAMES):
+        # Точные и сохраненные значения — одним запросом, затем сдвиг счетчиков на расхождение
+        row = (await db.execute(database.counters_drift_query())).mappings().one()
+        drift = database.counters_drift(row)
+        for statement in database.correct_counters_statements(row):
+            await db.execute(statement)
+        await db.commit()
+        stored = {name: row[name] for name in database.COUNTER_NAMES}
+    
     stats_data = {
         "database": "SQLite (travel_companion.db)",
         "timestamp": datetime.now().isoformat(),
-        "tables": {
-            "users": db.query(database.User).count(),
-            "drivers": db.query(database.User).filter(database.User.has_car == True).count(),
-            "passengers": db.query(database.User).filter(database.User.has_car == False).count(),
-            "driver_trips": db.query(database.DriverTrip).count(),
-            "active_trips": db.query(database.DriverTrip).filter(
-                database.DriverTrip.status == database.TripStatus.ACTIVE
-            ).count(),
-            "bookings": db.query(database.Booking).count(),
-            "active_bookings": db.query(database.Booking).filter(
-                database.Booking.status == database.TripStatus.ACTIVE
-            ).count()
-        }
+        "tables": {name: stored[name] for name in database.COUNTER_NAMES},
+        "search_cache": search_cache.stats(),
+        "identity_cache": identity_cache.stats(),
+        "notifications": notification_dispatcher.stats() if notification_dispatcher is not None else None,
+        "reminders": reminder_scheduler.stats() if reminder_scheduler is not None else None,
+        "matching": match_index.stats(),
+        "corridor": corridor_index.stats()
     }
+    if drift is not None:
+        stats_data["drift"] = drift
     return stats_data
 
-# =============== УТИЛИТЫ ===============
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
-# Создаем отдельный файл для функции извлечения города
-import sys
-import os
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+@app.get("/admin/slow-queries", dependencies=[Depends(require_admin)])
+async def slow_queries():
+    """Последние медленные SQL-запросы (включается переменной SLOW_QUERY_MS)"""
+    return {
+        "enabled": slow_query_log.enabled,
+        "threshold_ms": slow_query_log.threshold * 1000 if slow_query_log.enabled else None,
+        "entries": slow_query_log.entries()
+    }
+
+@app.get("/admin/slow-queries/{entry_id}/explain", dependencies=[Depends(require_admin)])
+async def explain_slow_query(
+    entry_id: int,
+    analyze: bool = Query(False, description="EXPLAIN ANALYZE (только Postgres и только SELECT)")
+):
+    """План медленного запроса с теми же параметрами"""
+    try:
+        plan = await slow_query_log.explain(entry_id, analyze=analyze)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Запрос не найден в журнале")
+    return plan
 
-from extract_city import extract_city
+@app.get("/debug/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def debug_profile(
+    seconds: float = Query(10, gt=0, le=sampling_profiler.PROFILE_MAX_SECONDS, description="Длительность сэмплирования"),
+    idle: bool = Query(False, description="Учитывать простаивающие потоки и ожидание event loop")
+):
+    """Свернутые стеки всех потоков процесса для flamegraph"""
+    try:
+        # Сэмплер в отдельном потоке: event loop продолжает обслуживать запросы и попадает в выборку
+        samples = await asyncio.to_thread(sampling_profiler.profile, seconds, include_idle=idle)
+    except sampling_profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(sampling_profiler.format_collapsed(samples))
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,317 @@
+# matching.py - ПОДБОР ПОЕЗДОК ВОДИТЕЛЕЙ К ЗАПРОСАМ ПАССАЖИРОВ: ПАКЕТНО И ТОЧЕЧНО
+import asyncio
+import heapq
+import os
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+from sqlalchemy import select
+import database
+from reminders import departure_moment, local_now
+
+MATCH_TOP_K = int(os.getenv("MATCH_TOP_K", "10"))
+# Как часто пересобирать индекс из базы: уехавшие поездки и изменения из других процессов
+MATCH_REBUILD_INTERVAL = float(os.getenv("MATCH_REBUILD_INTERVAL", "900"))
+DEFAULT_FLEXIBILITY = 30
+DAY_MINUTES = 1440
+_AFTER = float("inf")
+
+def epoch_minute(moment: datetime) -> int:
+    """Минута от начала летоисчисления: сравнивается и через полночь, и через месяц"""
+    return moment.toordinal() * DAY_MINUTES + moment.hour * 60 + moment.minute
+
+def minute_to_datetime(minute: int) -> datetime:
+    day, rest = divmod(minute, DAY_MINUTES)
+    return datetime.fromordinal(day) + timedelta(minutes=rest)
+
+class TripSlot(NamedTuple):
+    id: int
+    driver_id: int
+    route: tuple  # (start_city_key, finish_city_key)
+    minute: int   # epoch_minute отправления
+    seats: int
+    price: float
+
+class RideRequest(NamedTuple):
+    id: int
+    passenger_id: int
+    route: tuple
+    start: int    # окно отправления, epoch_minute включительно
+    end: int
+    desired: int  # желаемое время — от него считается отклонение
+    seats: int
+    max_price: Optional[float]
+
+class Match(NamedTuple):
+    trip_id: int
+    minutes_off: int
+    price: float
+
+def trip_slot(trip, seats: int = None) -> Optional[TripSlot]:
+    """Поездка (строка или объект DriverTrip) в виде для индекса; None — если ее нельзя сопоставить"""
+    if not trip.start_city_key or not trip.finish_city_key:
+        return None
+    return TripSlot(
+        trip.id, trip.driver_id, (trip.start_city_key, trip.finish_city_key),
+        epoch_minute(departure_moment(trip.departure_date, trip.departure_time)),
+        trip.available_seats if seats is None else seats,
+        trip.price_per_seat or 0.0
+    )
+
+def ride_request(request) -> Optional[RideRequest]:
+    """Запрос пассажира (строка или объект PassengerTrip): окно — желаемое время ± time_flexibility,
+    без времени — весь день"""
+    if not request.start_city_key or not request.finish_city_key:
+        return None
+    day = request.desired_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if request.desired_time or request.desired_date != day:
+        desired = epoch_minute(departure_moment(request.desired_date, request.desired_time))
+        flexibility = request.time_flexibility if request.time_flexibility is not None else DEFAULT_FLEXIBILITY
+        start, end = desired - flexibility, desired + flexibility
+    else:
+        start = epoch_minute(day)
+        end = start + DAY_MINUTES - 1
+        desired = start + DAY_MINUTES // 2
+    return RideRequest(
+        request.id, request.passenger_id, (request.start_city_key, request.finish_city_key),
+        start, end, desired, request.required_seats or 1, request.max_price
+    )
+
+def rank(match: Match):
+    """Ближе к желаемому времени, затем дешевле"""
+    return (match.minutes_off, match.price, match.trip_id)
+
+class MatchIndex:
+    """Поездки и запросы, разложенные по (маршрут, день); у каждого запроса — top-K поездок"""
+
+    def __init__(self, top_k: int = MATCH_TOP_K, session_factory=None):
+        self.top_k = top_k
+        self.session_factory = session_factory or database.AsyncSessionLocal
+        self._trips: Dict[int, TripSlot] = {}
+        self._trip_buckets: Dict[tuple, list] = {}      # (route, day) -> отсортированные (minute, trip_id)
+        self._requests: Dict[int, RideRequest] = {}
+        self._request_buckets: Dict[tuple, set] = {}    # (route, day) -> id запросов, чье окно задевает день
+        self.matches: Dict[int, List[Match]] = {}
+        self._matched_by: Dict[int, set] = {}           # trip_id -> запросы, в списках которых поездка есть
+        self._replay = None  # изменения, пришедшие пока rebuild читает базу
+        self._task = None
+        self.last_rebuild = None
+
+    # --- Сопоставление ---
+
+    def _qualifies(self, request: RideRequest, trip: TripSlot) -> bool:
+        return (
+            trip.seats >= request.seats
+            and (request.max_price is None or trip.price <= request.max_price)
+            and trip.driver_id != request.passenger_id
+        )
+
+    def _match(self, request: RideRequest) -> List[Match]:
+        """Поездки маршрута в окне запроса: бинарный поиск по отсортированным корзинам дней"""
+        candidates = []
+        for day in range(request.start // DAY_MINUTES, request.end // DAY_MINUTES + 1):
+            bucket = self._trip_buckets.get((request.route, day))
+            if not bucket:
+                continue
+            lo = bisect_left(bucket, (request.start,))
+            hi = bisect_right(bucket, (request.end, _AFTER))
+            for minute, trip_id in bucket[lo:hi]:
+                trip = self._trips[trip_id]
+                if self._qualifies(request, trip):
+                    candidates.append(Match(trip_id, abs(minute - request.desired), trip.price))
+        return heapq.nsmallest(self.top_k, candidates, key=rank)
+
+    def _set_matches(self, request_id, matches):
+        for match in self.matches.get(request_id, ()):
+            holders = self._matched_by.get(match.trip_id)
+            if holders is not None:
+                holders.discard(request_id)
+        self.matches[request_id] = matches
+        for match in matches:
+            self._matched_by.setdefault(match.trip_id, set()).add(request_id)
+
+    def match_all(self):
+        """Пакетный проход: списки для всех открытых запросов заново"""
+        self.matches, self._matched_by = {}, {}
+        for request in self._requests.values():
+            matches = self._match(request)
+            self.matches[request.id] = matches
+            for match in matches:
+                self._matched_by.setdefault(match.trip_id, set()).add(request.id)
+
+    # --- Точечные изменения ---
+
+    def _request_days(self, request: RideRequest):
+        return range(request.start // DAY_MINUTES, request.end // DAY_MINUTES + 1)
+
+    def add_request(self, request: RideRequest) -> List[Match]:
+        """Новый или измененный запрос: сопоставить только его"""
+        if self._replay is not None:
+            self._replay.append((self.add_request, request))
+        self._forget_request(request.id)
+        self._requests[request.id] = request
+        for day in self._request_days(request):
+            self._request_buckets.setdefault((request.route, day), set()).add(request.id)
+        self._set_matches(request.id, self._match(request))
+        return self.matches[request.id]
+
+    def remove_request(self, request_id):
+        if self._replay is not None:
+            self._replay.append((self.remove_request, request_id))
+        self._forget_request(request_id)
+
+    def _forget_request(self, request_id):
+        request = self._requests.pop(request_id, None)
+        if request is None:
+            return
+        for day in self._request_days(request):
+            bucket = self._request_buckets.get((request.route, day))
+            if bucket is not None:
+                bucket.discard(request_id)
+                if not bucket:
+                    del self._request_buckets[(request.route, day)]
+        self._set_matches(request_id, [])
+        del self.matches[request_id]
+
+    def _drop_trip(self, trip_id):
+        trip = self._trips.pop(trip_id, None)
+        if trip is None:
+            return
+        key = (trip.route, trip.minute // DAY_MINUTES)
+        bucket = self._trip_buckets[key]
+        del bucket[bisect_left(bucket, (trip.minute, trip_id))]
+        if not bucket:
+            del self._trip_buckets[key]
+
+    def upsert_trip(self, trip: Optional[TripSlot]):
+        """Новая поездка или изменились места/время/цена: обновить списки только затронутых запросов"""
+        if trip is None:
+            return
+        if self._replay is not None:
+            self._replay.append((self.upsert_trip, trip))
+        self._drop_trip(trip.id)
+        # Запросы, где поездка уже была: их список мог стать хуже — пересчитываем целиком
+        affected = self._matched_by.pop(trip.id, set())
+        if trip.seats > 0:
+            self._trips[trip.id] = trip
+            insort(self._trip_buckets.setdefault((trip.route, trip.minute // DAY_MINUTES), []), (trip.minute, trip.id))
+            for request_id in self._request_buckets.get((trip.route, trip.minute // DAY_MINUTES), ()):
+                if request_id in affected:
+                    continue
+                request = self._requests[request_id]
+                if not (request.start <= trip.minute <= request.end and self._qualifies(request, trip)):
+                    continue
+                # Поездка лучше худшей в списке (или список не полон) — вставляем, лишнюю вытесняем
+                match = Match(trip.id, abs(trip.minute - request.desired), trip.price)
+                current = self.matches[request_id]
+                if len(current) < self.top_k or rank(match) < rank(current[-1]):
+                    self._set_matches(request_id, sorted(current + [match], key=rank)[:self.top_k])
+        for request_id in affected:
+            self._set_matches(request_id, self._match(self._requests[request_id]))
+
+    def remove_trip(self, trip_id):
+        trip = self._trips.get(trip_id)
+        if trip is not None:
+            self.upsert_trip(trip._replace(seats=0))
+
+    # --- Загрузка из базы ---
+
+    def load(self, trips, requests):
+        """Заменить содержимое индекса и выполнить пакетный проход"""
+        self._trips, self._trip_buckets = {}, {}
+        self._requests, self._request_buckets = {}, {}
+        for trip in trips:
+            if trip is not None and trip.seats > 0:
+                self._trips[trip.id] = trip
+                self._trip_buckets.setdefault((trip.route, trip.minute // DAY_MINUTES), []).append((trip.minute, trip.id))
+        for bucket in self._trip_buckets.values():
+            bucket.sort()
+        for request in requests:
+            if request is not None:
+                self._requests[request.id] = request
+                for day in self._request_days(request):
+                    self._request_buckets.setdefault((request.route, day), set()).add(request.id)
+        self.match_all()
+
+    async def rebuild(self):
+        """Открытые поездки и запросы от текущего момента — двумя запросами, затем пакетный проход"""
+        started = time.perf_counter()
+        now = local_now()
+        # departure_date/desired_date может хранить только дату — берем со вчерашнего дня и отсекаем по минуте
+        since = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        T, P = database.DriverTrip, database.PassengerTrip
+        fresh = MatchIndex(top_k=self.top_k, session_factory=self.session_factory)
+        self._replay = []
+        try:
+            async with self.session_factory() as db:
+                trips = (await db.execute(
+                    select(T.id, T.driver_id, T.start_city_key, T.finish_city_key, T.departure_date,
+                           T.departure_time, T.available_seats, T.price_per_seat)
+                    .where(T.status == database.TripStatus.ACTIVE, T.available_seats > 0, T.departure_date >= since)
+                )).all()
+                requests = (await db.execute(
+                    select(P.id, P.passenger_id, P.start_city_key, P.finish_city_key, P.desired_date,
+                           P.desired_time, P.time_flexibility, P.required_seats, P.max_price)
+                    .where(P.status == database.TripStatus.ACTIVE, P.desired_date >= since)
+                )).all()
+            current = epoch_minute(now)
+            # Разбор строк и пакетный проход по десяткам тысяч запросов — секунды CPU:
+            # в потоке, пока подбор отвечает по старым спискам
+            await asyncio.to_thread(lambda: fresh.load(
+                [slot for slot in map(trip_slot, trips) if slot is not None and slot.minute >= current],
+                [window for window in map(ride_request, requests) if window is not None and window.end >= current]
+            ))
+        finally:
+            replay, self._replay = self._replay, None
+        self._trips, self._trip_buckets = fresh._trips, fresh._trip_buckets
+        self._requests, self._request_buckets = fresh._requests, fresh._request_buckets
+        self.matches, self._matched_by = fresh.matches, fresh._matched_by
+        # Снимок мог быть прочитан раньше, чем закоммичены эти изменения — применяем их поверх
+        for change, argument in replay:
+            change(argument)
+        self.last_rebuild = {
+            "at": now.isoformat(timespec="seconds"),
+            "trips": len(self._trips),
+            "requests": len(self._requests),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        return self.last_rebuild
+
+    async def _run(self):
+        while True:
+            try:
+                await self.rebuild()
+            except Exception as e:
+                print(f"⚠️  Не удалось пересобрать индекс подбора поездок: {e}")
+            await asyncio.sleep(MATCH_REBUILD_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def request(self, request_id) -> Optional[RideRequest]:
+        return self._requests.get(request_id)
+
+    def ranked(self, request_id):
+        """Список запроса вместе с текущими данными поездок"""
+        return [(match, self._trips[match.trip_id]) for match in self.matches.get(request_id, ())]
+
+    def stats(self):
+        return {
+            "trips": len(self._trips),
+            "requests": len(self._requests),
+            "requests_with_matches": sum(1 for matches in self.matches.values() if matches),
+            "last_rebuild": self.last_rebuild,
+        }
+
+match_index = MatchIndex()
@@ -0,0 +1,240 @@
+# metrics.py - МЕТРИКИ API В ФОРМАТЕ PROMETHEUS (/metrics)
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+POOL_WAIT_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Монотонный счетчик с метками"""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            yield self.name, _format_labels(self.labels, label_values), value
+
+class Gauge(Counter):
+    """Текущее значение; для пула считается в момент запроса /metrics"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), collect=None):
+        super().__init__(name, help_text, labels)
+        self.collect = collect
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def samples(self):
+        if self.collect is not None:
+            for label_values, value in self.collect():
+                yield self.name, _format_labels(self.labels, label_values), value
+            return
+        yield from super().samples()
+
+class Histogram:
+    """Гистограмма с накопительными корзинами, как в клиенте Prometheus"""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # метки -> [счетчики по корзинам (+Inf последним), сумма]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        names = self.labels + ("le",)
+        for label_values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_value(float(bound))
+                yield f"{self.name}_bucket", _format_labels(names, label_values + (le,)), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labels, label_values), total
+            yield f"{self.name}_count", _format_labels(self.labels, label_values), cumulative
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Текст в формате Prometheus exposition 0.0.4"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP-запросы по шаблону пути, методу и коду ответа",
+    ("method", "route", "status")))
+http_latency = registry.register(Histogram(
+    "http_request_duration_seconds", "Время обработки запроса",
+    ("method", "route")))
+http_in_progress = registry.register(Gauge(
+    "http_requests_in_progress", "Запросы в обработке"))
+sql_per_request = registry.register(Histogram(
+    "http_request_sql_statements", "SQL-запросов на один HTTP-запрос",
+    ("method", "route"), SQL_COUNT_BUCKETS))
+sql_time_per_request = registry.register(Histogram(
+    "http_request_sql_seconds", "Суммарное время SQL на один HTTP-запрос",
+    ("method", "route"), SQL_TIME_BUCKETS))
+sql_statements = registry.register(Counter(
+    "sql_statements_total", "Выполненные SQL-запросы", ("engine",)))
+sql_duration = registry.register(Histogram(
+    "sql_statement_duration_seconds", "Время одного SQL-запроса", ("engine",), SQL_TIME_BUCKETS))
+pool_wait = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Ожидание соединения из пула", ("engine",), POOL_WAIT_BUCKETS))
+
+_engines = {}  # метка -> движок, для db_pool_connections
+
+# Счетчики SQL текущего HTTP-запроса: [число запросов, секунды]
+_request_sql = ContextVar("request_sql", default=None)
+_request_scope = ContextVar("request_scope", default=None)
+
+def current_route():
+    """Маршрут текущего HTTP-запроса ("GET /api/trips/my") или None вне запроса"""
+    scope = _request_scope.get()
+    if scope is None:
+        return None
+    route = scope.get("route")
+    return f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+def _make_after_cursor_execute(label):
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+        sql_statements.inc(label)
+        sql_duration.observe(elapsed, label)
+        current = _request_sql.get()
+        if current is not None:
+            current[0] += 1
+            current[1] += elapsed
+    return _after_cursor_execute
+
+def _instrument_connect(engine, label):
+    """Засечь engine.connect — через него соединение берут и Session, и AsyncSession:
+    ожидание свободного соединения в пуле (или открытие нового). Публичный метод движка,
+    а не внутренности пула, и переживает dispose(), который пересоздает пул"""
+    connect = engine.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            pool_wait.observe(time.perf_counter() - started, label)
+
+    engine.connect = timed_connect
+
+def instrument_engine(engine, label):
+    """Подключить подсчет SQL и ожидания пула к синхронному движку (или AsyncEngine.sync_engine)"""
+    _engines[label] = engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _make_after_cursor_execute(label))
+    _instrument_connect(engine, label)
+
+def _collect_pool_state():
+    """Состояние пулов на момент запроса метрик"""
+    for label, engine in _engines.items():
+        pool = engine.pool
+        if not hasattr(pool, "checkedout"):
+            continue
+        yield (label, "checkedout"), pool.checkedout()
+        yield (label, "checkedin"), pool.checkedin()
+        # QueuePool считает overflow от -pool_size, пока пул не заполнен
+        yield (label, "overflow"), max(0, pool.overflow())
+
+pool_connections = registry.register(Gauge(
+    "db_pool_connections", "Соединения пула по состоянию", ("engine", "state"), collect=_collect_pool_state))
+
+class MetricsMiddleware:
+    """ASGI middleware: задержка, коды ответов, запросы в полете и SQL на запрос"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        sql = [0, 0.0]
+        token = _request_sql.set(sql)
+        scope_token = _request_scope.set(scope)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_progress.dec()
+            _request_sql.reset(token)
+            _request_scope.reset(scope_token)
+            # Шаблон пути ("/api/trips/{trip_id}"), а не сам путь — иначе меток будет без счета
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            http_requests.inc(method, route_path, str(status))
+            http_latency.observe(elapsed, method, route_path)
+            sql_per_request.observe(sql[0], method, route_path)
+            sql_time_per_request.observe(sql[1], method, route_path)
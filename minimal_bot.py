@@ -3,10 +3,20 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
 import os
+from update_processor import ChatOrderedUpdateProcessor
 
 # Настройки
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "7440722159:AAH3mLjWboLCBVmOvozdpX7MRo1_Os-fWaQ")  # ⚠️ ЗАМЕНИТЕ на реальный токен!
 MINI_APP_URL = "https://zhyvvu.github.io/travel-companion-app/"  # ⚠️ ЗАМЕНИТЕ на ваш URL
+# Адрес Bot API: для локальной проверки можно указать fake_bot_api.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
+# Бот обрабатывает только сообщения и команды — остальные типы обновлений не запрашиваем
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+# Сколько обновлений обрабатывать одновременно (1 — по одному, как раньше).
+# Медленный ответ одному пользователю тогда не задерживает остальных; порядок внутри чата сохраняется
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "1"))
 
 # Логирование
 logging.basicConfig(
@@ -193,6 +203,31 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=reply_markup
         )
 
+def build_application(token: str = BOT_TOKEN, updater: bool = True,
+                      concurrent_updates: int = BOT_CONCURRENT_UPDATES) -> Application:
+    """Приложение бота со всеми обработчиками; updater=False — для webhook без long polling"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    )
+    if not updater:
+        builder = builder.updater(None)
+    if concurrent_updates > 1:
+        builder = builder.concurrent_updates(ChatOrderedUpdateProcessor(concurrent_updates))
+        # Каждому обработчику — свое соединение к Bot API (по умолчанию пул на 256)
+        if concurrent_updates > 256:
+            builder = builder.connection_pool_size(concurrent_updates)
+    application = builder.build()
+    
+    # Регистрируем обработчики
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("about", about_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return application
+
 def main():
     """Запуск бота"""
     print("=" * 60)
@@ -210,16 +245,12 @@ def main():
     print("   • /help - Подробная справка")
     print("   • /about - Информация о проекте")
     print("   • Обработка текстовых сообщений")
+    if BOT_CONCURRENT_UPDATES > 1:
+        print(f"⚡ Параллельная обработка: до {BOT_CONCURRENT_UPDATES} обновлений, порядок внутри чата сохраняется")
     print("=" * 60)
     
-    # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
-    
-    # Регистрируем обработчики
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("about", about_command))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    # Создаем приложение с обработчиками
+    application = build_application()
     
     print("✅ Бот запущен!")
     print("🔄 Ожидание сообщений...")
@@ -227,7 +258,7 @@ def main():
     print("=" * 60)
     
     # Запускаем бота
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,294 @@
+# notifications.py - УВЕДОМЛЕНИЯ В TELEGRAM: OUTBOX В БАЗЕ И ФОНОВАЯ ОТПРАВКА С ЛИМИТАМИ
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import insert, select, update
+import database
+import metrics
+
+NOTIFICATIONS_ENABLED = os.getenv("NOTIFICATIONS_ENABLED", "1").lower() in ("1", "true", "yes")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и не чаще раза в секунду в один чат
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_CHAT_INTERVAL = float(os.getenv("NOTIFY_CHAT_INTERVAL", "1.0"))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "16"))
+NOTIFY_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", "2"))
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "200"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+NOTIFY_BACKOFF_BASE = float(os.getenv("NOTIFY_BACKOFF_BASE", "2"))
+NOTIFY_BACKOFF_MAX = float(os.getenv("NOTIFY_BACKOFF_MAX", "600"))
+# Взятые в отправку строки не выдаются повторно это время; если процесс упал — вернутся в очередь
+NOTIFY_LEASE = 60
+MESSAGE_LIMIT = 4096
+
+notifications_total = metrics.registry.register(metrics.Counter(
+    "notifications_total", "Уведомления в Telegram по результату отправки", ("result",)))
+
+# =============== ТЕКСТЫ ===============
+
+def booking_created_messages(booking_id, driver_chat_id, passenger_chat_id, passenger_name, route, date, seats):
+    """Водителю — о новой брони, пассажиру — подтверждение"""
+    return [
+        {"chat_id": driver_chat_id, "booking_id": booking_id, "event": "booking_created",
+         "text": f"🆕 Новое бронирование: {passenger_name}, мест: {seats}\n🗺 {route}\n📅 {date}"},
+        {"chat_id": passenger_chat_id, "booking_id": booking_id, "event": "booking_confirmed",
+         "text": f"✅ Место забронировано, мест: {seats}\n🗺 {route}\n📅 {date}"},
+    ]
+
+def booking_cancelled_messages(booking_id, chat_id, cancelled_by, route, date):
+    """Второй стороне брони — об отмене"""
+    return [
+        {"chat_id": chat_id, "booking_id": booking_id, "event": "booking_cancelled",
+         "text": f"❌ {cancelled_by} отменил(а) бронирование\n🗺 {route}\n📅 {date}"},
+    ]
+
+def departure_reminder_messages(trip_id, driver_chat_id, passenger_chat_ids, before, route, date):
+    """Напоминание водителю и пассажирам с активными бронями"""
+    messages = [{"chat_id": driver_chat_id, "booking_id": None, "event": "departure_reminder",
+                 "text": f"⏰ Через {before} отправление, пассажиров: {len(passenger_chat_ids)}\n🗺 {route}\n📅 {date}"}]
+    messages += [
+        {"chat_id": chat_id, "booking_id": None, "event": "departure_reminder",
+         "text": f"⏰ Через {before} ваша поездка\n🗺 {route}\n📅 {date}"}
+        for chat_id in passenger_chat_ids
+    ]
+    return messages
+
+async def enqueue(db, messages):
+    """Добавить уведомления в outbox текущей транзакции одним INSERT — без обращения к Telegram"""
+    if not messages:
+        return
+    now = datetime.utcnow()
+    await db.execute(insert(database.Notification), [
+        dict(message, status=database.NotificationStatus.PENDING, attempts=0, next_attempt_at=now, created_at=now)
+        for message in messages
+    ])
+
+# =============== ОТПРАВКА ===============
+
+class TokenBucket:
+    """Не больше rate отправок в секунду; ожидающие встают в очередь резервированием"""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+def backoff_delay(attempts: int) -> float:
+    """Экспоненциальная пауза перед повтором со случайным разбросом"""
+    delay = min(NOTIFY_BACKOFF_MAX, NOTIFY_BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+def split_batches(rows):
+    """Склеить сообщения одному получателю в тексты не длиннее лимита Telegram"""
+    batches, ids, parts, size = [], [], [], 0
+    for row in rows:
+        text = row.text[:MESSAGE_LIMIT]
+        if parts and size + 2 + len(text) > MESSAGE_LIMIT:
+            batches.append((ids, "\n\n".join(parts)))
+            ids, parts, size = [], [], 0
+        ids.append(row.id)
+        parts.append(text)
+        size += len(text) + (2 if size else 0)
+    if parts:
+        batches.append((ids, "\n\n".join(parts)))
+    return batches
+
+class NotificationDispatcher:
+    """Фоновая задача: забирает из outbox готовые к отправке уведомления и шлет их в Telegram"""
+
+    def __init__(self, token: str, api_url: str = TELEGRAM_API_URL, session_factory=None,
+                 global_rate: float = NOTIFY_GLOBAL_RATE, chat_interval: float = NOTIFY_CHAT_INTERVAL,
+                 poll_interval: float = NOTIFY_POLL_INTERVAL):
+        self.token = token
+        self.api_url = api_url
+        self.session_factory = session_factory or database.AsyncSessionLocal
+        self.chat_interval = chat_interval
+        self.poll_interval = poll_interval
+        self.bot = None
+        self._bucket = TokenBucket(global_rate)
+        self._slots = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+        self._chat_ready = {}  # chat_id -> time.monotonic(), когда в чат можно писать снова
+        self._wake = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._task = None
+        self.counts = {"sent": 0, "messages": 0, "retried": 0, "failed": 0, "deferred": 0}
+
+    @classmethod
+    def from_env(cls, token: str) -> Optional["NotificationDispatcher"]:
+        if not token or not NOTIFICATIONS_ENABLED:
+            return None
+        return cls(token)
+
+    def wake(self):
+        """В outbox появились строки: не ждать следующего опроса (только в этом процессе)"""
+        self._wake.set()
+
+    async def _claim(self, now):
+        """Взять пачку готовых строк и продлить им срок, чтобы их не взял другой процесс"""
+        N = database.Notification
+        async with self.session_factory() as db:
+            query = (
+                select(N.id, N.chat_id, N.text, N.attempts)
+                .where(N.status == database.NotificationStatus.PENDING, N.next_attempt_at <= now)
+                .order_by(N.id)
+                .limit(NOTIFY_BATCH_SIZE)
+            )
+            if db.bind.dialect.name == "postgresql":
+                query = query.with_for_update(skip_locked=True)
+            rows = (await db.execute(query)).all()
+            if rows:
+                await db.execute(
+                    update(N)
+                    .where(N.id.in_([row.id for row in rows]))
+                    .values(next_attempt_at=now + timedelta(seconds=NOTIFY_LEASE))
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        return rows
+
+    async def _send_chat(self, chat_id, rows):
+        """Отправить все пачки одному получателю по очереди; вернуть изменения строк outbox"""
+        from telegram.error import BadRequest, Forbidden, RetryAfter
+
+        attempts = {row.id: row.attempts for row in rows}
+        changes = []
+        batches = split_batches(rows)
+        for index, (ids, text) in enumerate(batches):
+            wait = self._chat_ready.get(chat_id, 0) - time.monotonic()
+            if wait > self.chat_interval:
+                # Чат на паузе после 429: не держим проход, вернемся к нему позже
+                later = datetime.utcnow() + timedelta(seconds=wait)
+                for rest, _ in batches[index:]:
+                    changes += [{"id": i, "next_attempt_at": later} for i in rest]
+                self.counts["deferred"] += sum(len(rest) for rest, _ in batches[index:])
+                break
+            if wait > 0:
+                await asyncio.sleep(wait)
+            async with self._slots:
+                if self._stopping.is_set():
+                    # Остановка: начатые отправки дописываются, остальное сразу возвращается в очередь,
+                    # а не ждет окончания аренды
+                    released = datetime.utcnow()
+                    for rest, _ in batches[index:]:
+                        changes += [{"id": i, "next_attempt_at": released} for i in rest]
+                    break
+                await self._bucket.acquire()
+                self._chat_ready[chat_id] = time.monotonic() + self.chat_interval
+                try:
+                    await self.bot.send_message(chat_id, text)
+                except RetryAfter as e:
+                    retry_after = float(e.retry_after)
+                    self._chat_ready[chat_id] = time.monotonic() + retry_after
+                    later = datetime.utcnow() + timedelta(seconds=retry_after)
+                    for rest, _ in batches[index:]:
+                        changes += [{"id": i, "next_attempt_at": later, "last_error": str(e)} for i in rest]
+                    self.counts["retried"] += 1
+                    notifications_total.inc("rate_limited")
+                    break
+                except (Forbidden, BadRequest) as e:
+                    # Бот заблокирован или чата нет — повтор не поможет
+                    changes += [{"id": i, "status": database.NotificationStatus.FAILED, "last_error": str(e)} for i in ids]
+                    self.counts["failed"] += len(ids)
+                    notifications_total.inc("failed", amount=len(ids))
+                    continue
+                except Exception as e:
+                    for i in ids:
+                        attempt = attempts[i] + 1
+                        change = {"id": i, "attempts": attempt, "last_error": f"{type(e).__name__}: {e}"}
+                        if attempt >= NOTIFY_MAX_ATTEMPTS:
+                            change["status"] = database.NotificationStatus.FAILED
+                            self.counts["failed"] += 1
+                            notifications_total.inc("failed")
+                        else:
+                            change["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=backoff_delay(attempt))
+                            notifications_total.inc("retried")
+                        changes.append(change)
+                    self.counts["retried"] += 1
+                    continue
+            sent_at = datetime.utcnow()
+            changes += [{"id": i, "status": database.NotificationStatus.SENT, "sent_at": sent_at} for i in ids]
+            self.counts["sent"] += len(ids)
+            self.counts["messages"] += 1
+            notifications_total.inc("sent", amount=len(ids))
+        return changes
+
+    async def dispatch_once(self):
+        """Один проход по outbox; возвращает число взятых строк"""
+        rows = await self._claim(datetime.utcnow())
+        if not rows:
+            return 0
+        by_chat = {}
+        for row in rows:
+            by_chat.setdefault(row.chat_id, []).append(row)
+        results = await asyncio.gather(*(self._send_chat(chat_id, chat_rows) for chat_id, chat_rows in by_chat.items()))
+
+        # Строки с одинаковым набором полей обновляются одним executemany
+        groups = {}
+        for change in (change for changes in results for change in changes):
+            groups.setdefault(tuple(sorted(change)), []).append(change)
+        async with self.session_factory() as db:
+            for changes in groups.values():
+                await db.execute(update(database.Notification), changes)
+            await db.commit()
+
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, ready in self._chat_ready.items() if ready < now]:
+            del self._chat_ready[chat_id]
+        return len(rows)
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            self._wake.clear()
+            try:
+                claimed = await self.dispatch_once()
+            except Exception as e:
+                print(f"⚠️  Не удалось отправить уведомления: {e}")
+                claimed = 0
+            if claimed >= NOTIFY_BATCH_SIZE:
+                continue  # в очереди есть еще
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        from telegram import Bot
+        from telegram.request import HTTPXRequest
+
+        if self._task is None:
+            self._stopping.clear()
+            self.bot = Bot(
+                self.token,
+                base_url=f"{self.api_url}/bot",
+                base_file_url=f"{self.api_url}/file/bot",
+                request=HTTPXRequest(connection_pool_size=NOTIFY_CONCURRENCY)
+            )
+            self._task = asyncio.create_task(self._run())
+            print(f"📨 Уведомления: до {self._bucket.rate:g}/с, в чат раз в {self.chat_interval:g} с")
+
+    async def stop(self):
+        """Остановить отправку; неотправленное остается в outbox до следующего запуска"""
+        if self._task is not None:
+            # Не отменяем задачу посреди прохода: принятые Telegram сообщения иначе не отметятся SENT
+            # и уйдут второй раз после NOTIFY_LEASE. Проход дописывает outbox, цикл завершается сам
+            self._stopping.set()
+            self._wake.set()
+            await self._task
+            self._task = None
+            await self.bot.shutdown()
+
+    def stats(self):
+        return dict(self.counts, chats_waiting=len(self._chat_ready))
@@ -0,0 +1,121 @@
+# query_counter.py - ПОДСЧЕТ SQL-ЗАПРОСОВ (ЗАЩИТА ОТ N+1)
+from contextlib import contextmanager
+from sqlalchemy import event
+
+# Верхняя граница SQL-запросов на один вызов эндпоинта.
+# Не зависит от количества строк в ответе — иначе это N+1.
+# Бронирования считаются с прогретым кэшем пользователей (его заполняет /api/trips/my)
+# и с запасом на INSERT в outbox уведомлений (если задан TELEGRAM_BOT_TOKEN).
+QUERY_BUDGETS = {
+    "POST /api/trips/search": 1,
+    "GET /api/trips/my": 4,
+    "GET /api/trips/{trip_id}": 1,
+    "POST /api/bookings/create": 7,
+    "POST /api/bookings/{booking_id}/cancel": 5,
+}
+
+class QueryCounter:
+    """Счетчик выполненных SQL-запросов"""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+@contextmanager
+def count_queries(engine):
+    """Считать все SQL-запросы движка (синхронного или AsyncEngine) внутри блока with"""
+    engine = getattr(engine, "sync_engine", engine)
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter._before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter._before_cursor_execute)
+
+@contextmanager
+def assert_max_queries(engine, limit, label=""):
+    """Упасть с AssertionError, если в блоке выполнено больше limit запросов"""
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > limit:
+        statements = "\n".join(f"  {i + 1}. {s}" for i, s in enumerate(counter.statements))
+        raise AssertionError(
+            f"{label or 'Блок'}: {counter.count} SQL-запросов, лимит {limit}\n{statements}"
+        )
+
+def check_budgets(client, engine, telegram_id, trip_id, search_payload):
+    """Прогнать эндпоинты через тестовый клиент и проверить QUERY_BUDGETS"""
+    calls = [
+        ("POST /api/trips/search", lambda: client.post("/api/trips/search", json=search_payload)),
+        ("GET /api/trips/my", lambda: client.get("/api/trips/my", params={"telegram_id": telegram_id})),
+        ("GET /api/trips/{trip_id}", lambda: client.get(f"/api/trips/{trip_id}")),
+        ("POST /api/bookings/create", lambda: client.post(
+            "/api/bookings/create",
+            params={"telegram_id": telegram_id},
+            json={"driver_trip_id": trip_id, "booked_seats": 1}
+        )),
+    ]
+    for name, call in calls:
+        with assert_max_queries(engine, QUERY_BUDGETS[name], name) as counter:
+            response = call()
+        print(f"✅ {name}: {counter.count}/{QUERY_BUDGETS[name]} запросов (HTTP {response.status_code})")
+
+    booking_id = response.json()["booking_id"]
+    name = "POST /api/bookings/{booking_id}/cancel"
+    with assert_max_queries(engine, QUERY_BUDGETS[name], name) as counter:
+        response = client.post(f"/api/bookings/{booking_id}/cancel", params={"telegram_id": telegram_id})
+    print(f"✅ {name}: {counter.count}/{QUERY_BUDGETS[name]} запросов (HTTP {response.status_code})")
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    from datetime import datetime, timedelta
+
+    db_path = os.path.join(tempfile.mkdtemp(), "query_budget.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    # Фоновая отправка уведомлений выполняла бы свои запросы в том же движке
+    os.environ["NOTIFICATIONS_ENABLED"] = "0"
+
+    from fastapi.testclient import TestClient
+    import database
+    import main
+
+    with TestClient(main.app) as client:
+        db = database.SessionLocal()
+        departure = datetime.utcnow().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        drivers = [
+            database.User(telegram_id=1000 + i, first_name=f"Водитель{i}", has_car=True,
+                          role=database.UserRole.DRIVER)
+            for i in range(20)
+        ]
+        passenger = database.User(telegram_id=1, first_name="Пассажир")
+        db.add_all(drivers + [passenger])
+        db.flush()
+        trips = [
+            database.DriverTrip(
+                driver_id=driver.id, departure_date=departure, departure_time="09:00",
+                start_address="Москва", finish_address="Тула",
+                available_seats=4, price_per_seat=500 + i
+            )
+            for i, driver in enumerate(drivers)
+        ]
+        db.add_all(trips)
+        db.flush()
+        db.add_all([
+            database.Booking(driver_trip_id=trip.id, passenger_id=passenger.id,
+                             status=database.TripStatus.CANCELLED)
+            for trip in trips
+        ])
+        db.commit()
+        trip_id = trips[0].id
+        db.close()
+
+        check_budgets(client, database.async_engine, 1, trip_id, {
+            "from_city": "Москва", "to_city": "Тула", "date": departure.strftime("%Y-%m-%d")
+        })
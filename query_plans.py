@@ -0,0 +1,179 @@
+# query_plans.py - ПРОВЕРКА ПЛАНОВ ГОРЯЧИХ ЗАПРОСОВ (ЗАЩИТА ИНДЕКСОВ ОТ РЕГРЕССИЙ)
+import argparse
+import asyncio
+import json
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from sqlalchemy import event
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_plans.json")
+
+# Эндпоинты, SELECT-запросы которых проверяются: поиск, мои поездки,
+# бронирование (поиск пользователя, поездки, проверка дубля) и вход
+HOT_ENDPOINTS = (
+    "POST /api/trips/search",
+    "GET /api/trips/my",
+    "POST /api/bookings/create",
+    "POST /api/auth/telegram",
+)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="EXPLAIN горячих запросов: без полных сканов и без изменений относительно эталона")
+    parser.add_argument("--update", action="store_true", help="Перезаписать эталон текущими планами")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Файл эталонных планов")
+    parser.add_argument("--database-url", default=None, help="Пустая база для проверки (по умолчанию временная SQLite)")
+    return parser.parse_args()
+
+@contextmanager
+def capture_selects(engine, endpoint, captured):
+    """Запомнить SELECT-запросы эндпоинта вместе с параметрами: "GET /api/trips/my #2" -> (sql, params)"""
+    engine = getattr(engine, "sync_engine", engine)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            label = f"{endpoint} #{sum(1 for key in captured if key.startswith(endpoint + ' #')) + 1}"
+            captured[label] = (statement, parameters)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+def normalize_plan(dialect, rows):
+    """Строки плана без стоимостей и номеров узлов — то, что сравнивается с эталоном"""
+    if dialect == "sqlite":
+        return [row[-1] for row in rows]
+    return [re.sub(r"\s*\(cost=[^)]*\)", "", row[0]).rstrip() for row in rows]
+
+def full_scans(dialect, plan):
+    """Строки плана с полным проходом по таблице"""
+    if dialect == "sqlite":
+        return [line for line in plan if line.startswith("SCAN ") and " USING " not in line]
+    return [line for line in plan if "Seq Scan on" in line]
+
+async def explain_all(database, captured):
+    engine = database.async_engine
+    dialect = engine.dialect.name
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    plans = {}
+    async with engine.connect() as conn:
+        if dialect == "postgresql":
+            # На маленьких таблицах Postgres выберет Seq Scan и так; проверяем, что индекс применим
+            await conn.exec_driver_sql("SET enable_seqscan = off")
+        for label, (statement, parameters) in captured.items():
+            rows = (await conn.exec_driver_sql(prefix + statement, parameters)).all()
+            plans[label] = {"statement": " ".join(statement.split()), "plan": normalize_plan(dialect, rows)}
+        await conn.rollback()
+    await engine.dispose()
+    return dialect, plans
+
+def collect_plans(database, app):
+    """Схема, синтетические данные, вызовы горячих эндпоинтов и EXPLAIN их SELECT-запросов"""
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func, select
+    from benchmark.synthetic import generate, city_title
+    from identity_cache import identity_cache
+
+    captured = {}
+    with TestClient(app) as client:
+        db = database.SessionLocal()
+        try:
+            dataset = generate(db, users=300, trips=2000, bookings=3000, seed=7)
+            # Водитель с поездками и бронями — чтобы в "моих поездках" выполнились все запросы
+            driver_telegram_id = db.execute(
+                select(database.User.telegram_id)
+                .join(database.DriverTrip, database.DriverTrip.driver_id == database.User.id)
+                .group_by(database.User.telegram_id)
+                .order_by(func.count().desc(), database.User.telegram_id)
+                .limit(1)
+            ).scalar_one()
+            trip = db.execute(
+                select(database.DriverTrip)
+                .where(database.DriverTrip.status == database.TripStatus.ACTIVE)
+                .order_by(database.DriverTrip.id)
+                .limit(1)
+            ).scalar_one()
+        finally:
+            db.close()
+        passenger_telegram_id = dataset.passenger_telegram_ids[0]
+
+        calls = {
+            "POST /api/trips/search": lambda: client.post("/api/trips/search", json={
+                "from_city": city_title(trip.start_city), "to_city": city_title(trip.finish_city),
+                "date": trip.departure_date.strftime("%Y-%m-%d")
+            }),
+            "GET /api/trips/my": lambda: client.get("/api/trips/my", params={"telegram_id": driver_telegram_id}),
+            "POST /api/bookings/create": lambda: client.post(
+                "/api/bookings/create", params={"telegram_id": passenger_telegram_id},
+                json={"driver_trip_id": trip.id, "booked_seats": 1}
+            ),
+            "POST /api/auth/telegram": lambda: client.post("/api/auth/telegram", json={
+                "user": {"id": passenger_telegram_id, "first_name": "План"}
+            }),
+        }
+        for endpoint in HOT_ENDPOINTS:
+            # Кэши пропустили бы запросы, план которых нужно проверить
+            identity_cache.clear()
+            with capture_selects(database.async_engine, endpoint, captured):
+                response = calls[endpoint]()
+            if response.status_code >= 400:
+                raise SystemExit(f"❌ {endpoint}: HTTP {response.status_code} {response.text}")
+
+    return asyncio.run(explain_all(database, captured))
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'query_plans.db')}"
+    os.environ["SEARCH_CACHE_TTL"] = "0"
+    os.environ.pop("TELEGRAM_BOT_TOKEN", None)
+
+    import database
+    import main as api
+
+    dialect, plans = collect_plans(database, api.app)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.update:
+        baseline[dialect] = plans
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"✅ Эталон планов ({dialect}) обновлен: {len(plans)} запросов → {args.baseline}")
+
+    failures = []
+    expected = baseline.get(dialect)
+    if expected is None:
+        failures.append(f"нет эталона для {dialect}: запустите с --update")
+        expected = {}
+    for label, current in plans.items():
+        scans = full_scans(dialect, current["plan"])
+        if scans:
+            failures.append(f"{label}: полный проход таблицы: {'; '.join(scans)}\n    {current['statement']}")
+        previous = expected.get(label)
+        if previous is None:
+            if expected:
+                failures.append(f"{label}: новый запрос, в эталоне его нет")
+        elif previous["plan"] != current["plan"]:
+            failures.append(
+                f"{label}: план изменился\n    было:  {' | '.join(previous['plan'])}\n    стало: {' | '.join(current['plan'])}"
+            )
+        print(f"{'❌' if scans else '✅'} {label}: {' | '.join(current['plan'])}")
+    for label in expected.keys() - plans.keys():
+        failures.append(f"{label}: запрос из эталона больше не выполняется")
+
+    if failures:
+        print("\n❌ Регрессии планов:")
+        for failure in failures:
+            print(f"  - {failure}")
+        raise SystemExit(1)
+    print(f"✅ Планы {len(plans)} запросов совпадают с эталоном, полных сканов нет")
+
+if __name__ == "__main__":
+    main()
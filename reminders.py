@@ -0,0 +1,254 @@
+# reminders.py - НАПОМИНАНИЯ ОБ ОТПРАВЛЕНИИ: КУЧА БЛИЖАЙШИХ СРАБАТЫВАНИЙ В ПАМЯТИ
+import asyncio
+import heapq
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+from sqlalchemy import or_, select, update
+import database
+import notifications
+
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "1").lower() in ("1", "true", "yes")
+# За сколько минут до отправления напоминать (через запятую)
+REMINDER_OFFSETS_MIN = os.getenv("REMINDER_OFFSETS_MIN", "1440,60")
+# На сколько часов вперед держать срабатывания в памяти; дальше — догружаются по мере приближения
+REMINDER_HORIZON_HOURS = float(os.getenv("REMINDER_HORIZON_HOURS", "6"))
+# Дата и время поездки вводятся по местному времени пользователей
+DEPARTURE_TIMEZONE = ZoneInfo(os.getenv("DEPARTURE_TIMEZONE", "Europe/Moscow"))
+
+def local_now() -> datetime:
+    return datetime.now(DEPARTURE_TIMEZONE).replace(tzinfo=None)
+
+def departure_moment(departure_date: datetime, departure_time: Optional[str]) -> datetime:
+    """Момент отправления: departure_date, а если в нем только дата — плюс departure_time "HH:MM\""""
+    if departure_time and departure_date.time() == datetime.min.time():
+        hours, _, minutes = departure_time.partition(":")
+        return departure_date + timedelta(hours=int(hours), minutes=int(minutes or 0))
+    return departure_date
+
+def format_offset(seconds: int) -> str:
+    minutes = round(seconds / 60)
+    if minutes >= 60 and minutes % 60 == 0:
+        return f"{minutes // 60} ч"
+    return f"{minutes} мин" if minutes else f"{seconds} с"
+
+class ReminderScheduler:
+    """Куча (время срабатывания, поездка, за сколько секунд) на горизонт вперед.
+    Пересобирается одним запросом по индексу departure_date, дальше меняется точечно"""
+
+    def __init__(self, dispatcher, offsets=None, horizon: timedelta = None, session_factory=None):
+        offsets = offsets or [float(value) for value in REMINDER_OFFSETS_MIN.split(",") if value.strip()]
+        self.offsets = sorted({int(minutes * 60) for minutes in offsets}, reverse=True)  # секунды
+        self.horizon = horizon or timedelta(hours=REMINDER_HORIZON_HOURS)
+        self.dispatcher = dispatcher
+        self.session_factory = session_factory or database.AsyncSessionLocal
+        self._heap = []      # (fire_at, trip_id, offset)
+        self._entries = {}   # (trip_id, offset) -> fire_at; записи кучи без пары здесь устарели
+        self.loaded_until = None
+        self._changed = asyncio.Event()
+        self._task = None
+        self.counts = {"loaded": 0, "fired": 0, "reminders": 0, "rebuilds": 0}
+
+    @classmethod
+    def from_env(cls, dispatcher) -> Optional["ReminderScheduler"]:
+        # Напоминания уходят через очередь уведомлений — без нее отправлять некуда
+        if dispatcher is None or not REMINDERS_ENABLED:
+            return None
+        return cls(dispatcher)
+
+    # --- Содержимое кучи ---
+
+    def _schedule(self, trip_id, offset, fire_at):
+        key = (trip_id, offset)
+        if self._entries.get(key) == fire_at:
+            return
+        self._entries[key] = fire_at
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            # Много устаревших записей (переносы, отмены) — пересобираем кучу из актуальных
+            self._heap = [(at, trip, off) for (trip, off), at in self._entries.items()]
+            heapq.heapify(self._heap)
+        else:
+            heapq.heappush(self._heap, (fire_at, trip_id, offset))
+        if self._heap[0][0] == fire_at:
+            self._changed.set()
+
+    def _unschedule(self, trip_id):
+        for offset in self.offsets:
+            self._entries.pop((trip_id, offset), None)
+
+    def trip_scheduled(self, trip_id, departure_date, departure_time=None):
+        """Поездка создана или перенесена: напоминания, которые еще впереди и попадают в горизонт"""
+        self._unschedule(trip_id)
+        if self.loaded_until is None:
+            return  # еще не загружено: rebuild сам прочитает поездку из базы
+        departure = departure_moment(departure_date, departure_time)
+        now = local_now()
+        for offset in self.offsets:
+            fire_at = departure - timedelta(seconds=offset)
+            if now < fire_at <= self.loaded_until:
+                self._schedule(trip_id, offset, fire_at)
+
+    def trip_cancelled(self, trip_id):
+        self._unschedule(trip_id)
+
+    def _range_query(self, since, until):
+        """Поездки с отправлением в (since, until] — диапазон по индексу ix_driver_trips_departure.
+        departure_date может хранить только дату, поэтому нижняя граница сдвинута на сутки"""
+        T = database.DriverTrip
+        return (
+            select(T.id, T.departure_date, T.departure_time, T.reminded_before)
+            .where(
+                T.departure_date > since - timedelta(days=1),
+                T.departure_date <= until,
+                T.status != database.TripStatus.CANCELLED
+            )
+        )
+
+    async def _load(self, until):
+        """Добавить срабатывания до until; при первой загрузке — и пропущенные, пока процесс не работал"""
+        now = local_now()
+        since = self.loaded_until
+        max_offset = timedelta(seconds=self.offsets[0])
+        min_offset = timedelta(seconds=self.offsets[-1])
+        async with self.session_factory() as db:
+            rows = (await db.execute(self._range_query(
+                since + min_offset if since is not None else now, until + max_offset
+            ))).all()
+        for row in rows:
+            departure = departure_moment(row.departure_date, row.departure_time)
+            if departure <= now:
+                continue
+            for offset in self.offsets:
+                if row.reminded_before is not None and row.reminded_before <= offset:
+                    continue  # это или более близкое напоминание уже отправлено
+                fire_at = departure - timedelta(seconds=offset)
+                if fire_at > until or (since is not None and fire_at <= since):
+                    continue
+                self._schedule(row.id, offset, fire_at)
+        self.counts["loaded"] += len(rows)
+        self.loaded_until = until
+
+    async def rebuild(self):
+        """Собрать кучу заново из базы — при старте"""
+        self._heap, self._entries, self.loaded_until = [], {}, None
+        await self._load(local_now() + self.horizon)
+        self.counts["rebuilds"] += 1
+
+    # --- Срабатывание ---
+
+    def _pop_due(self, now):
+        """Наступившие срабатывания: для каждой поездки — самое близкое к отправлению"""
+        due = {}
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, trip_id, offset = heapq.heappop(self._heap)
+            if self._entries.get((trip_id, offset)) != fire_at:
+                continue
+            del self._entries[(trip_id, offset)]
+            due[trip_id] = min(offset, due.get(trip_id, offset))
+        return due
+
+    async def _fire(self, due):
+        """Отметить напоминание в поездке (один процесс из нескольких) и положить сообщения в outbox"""
+        T = database.DriverTrip
+        by_offset = {}
+        for trip_id, offset in due.items():
+            by_offset.setdefault(offset, []).append(trip_id)
+
+        async with self.session_factory() as db:
+            claimed = {}
+            for offset, trip_ids in by_offset.items():
+                result = await db.execute(
+                    update(T)
+                    .where(
+                        T.id.in_(trip_ids),
+                        T.status != database.TripStatus.CANCELLED,
+                        or_(T.reminded_before.is_(None), T.reminded_before > offset)
+                    )
+                    .values(reminded_before=offset)
+                    .returning(T.id)
+                    .execution_options(synchronize_session=False)
+                )
+                claimed.update((trip_id, offset) for (trip_id,) in result)
+            if not claimed:
+                await db.rollback()
+                return 0
+
+            trips = (await db.execute(
+                select(T.id, T.start_address, T.finish_address, T.departure_date, T.departure_time,
+                       database.User.telegram_id)
+                .join(database.User, database.User.id == T.driver_id)
+                .where(T.id.in_(list(claimed)))
+            )).all()
+            passengers = {}
+            for trip_id, telegram_id in (await db.execute(
+                select(database.Booking.driver_trip_id, database.User.telegram_id)
+                .join(database.User, database.User.id == database.Booking.passenger_id)
+                .where(
+                    database.Booking.driver_trip_id.in_(list(claimed)),
+                    database.Booking.status == database.TripStatus.ACTIVE
+                )
+            )).all():
+                passengers.setdefault(trip_id, []).append(telegram_id)
+
+            messages = []
+            for trip in trips:
+                departure = departure_moment(trip.departure_date, trip.departure_time)
+                messages += notifications.departure_reminder_messages(
+                    trip.id, trip.telegram_id, passengers.get(trip.id, []),
+                    format_offset(claimed[trip.id]),
+                    f"{trip.start_address} → {trip.finish_address}",
+                    departure.strftime("%d.%m.%Y %H:%M")
+                )
+            await notifications.enqueue(db, messages)
+            await db.commit()
+
+        self.dispatcher.wake()
+        self.counts["fired"] += len(claimed)
+        self.counts["reminders"] += len(messages)
+        return len(claimed)
+
+    async def _run(self):
+        while True:
+            self._changed.clear()
+            now = local_now()
+            try:
+                if self.loaded_until is None:
+                    await self.rebuild()
+                elif now + self.horizon / 2 >= self.loaded_until:
+                    await self._load(now + self.horizon)
+                due = self._pop_due(now)
+                if due:
+                    await self._fire(due)
+            except Exception as e:
+                print(f"⚠️  Ошибка напоминаний об отправлении: {e}")
+                # Снятые с кучи срабатывания могли потеряться — соберем заново из базы
+                self.loaded_until = None
+                await asyncio.sleep(5)
+                continue
+            # Спим до ближайшего срабатывания или догрузки; новая поездка раньше головы кучи будит
+            wake_at = self.loaded_until - self.horizon / 2 if self.loaded_until else now
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0][0])
+            try:
+                await asyncio.wait_for(self._changed.wait(), max(0.0, (wake_at - local_now()).total_seconds()))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            print(f"⏰ Напоминания об отправлении: за {', '.join(format_offset(o) for o in self.offsets)}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return dict(self.counts, scheduled=len(self._entries), heap=len(self._heap),
+                    loaded_until=self.loaded_until.isoformat() if self.loaded_until else None)
@@ -0,0 +1,59 @@
+# sampling_profiler.py - СЭМПЛИРУЮЩИЙ ПРОФИЛИРОВЩИК ДЛЯ РАБОТАЮЩЕГО ПРОЦЕССА
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_MAX_SECONDS = 60
+
+# Верхушки стека простаивающего потока: ожидание событий, а не работа
+IDLE_FUNCTIONS = {"select", "poll", "wait", "_worker"}
+
+_active = threading.Lock()
+
+class ProfilerBusy(Exception):
+    pass
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}"
+
+def _collapse(frame, thread_name):
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.append(thread_name)
+    stack.reverse()
+    return ";".join(stack)
+
+def profile(seconds, interval=PROFILE_INTERVAL, include_idle=False):
+    """Снимать стеки всех потоков seconds секунд; результат — Counter свернутых стеков.
+
+    Работает в отдельном потоке, пока профилирование не запрошено — не стоит ничего.
+    """
+    if not _active.acquire(blocking=False):
+        raise ProfilerBusy("Профилирование уже идет")
+    try:
+        own_id = threading.get_ident()
+        samples = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if not include_idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                samples[_collapse(frame, names.get(thread_id, f"thread-{thread_id}"))] += 1
+            time.sleep(interval)
+        return samples
+    finally:
+        _active.release()
+
+def format_collapsed(samples):
+    """Формат flamegraph.pl / speedscope: "поток;модуль:функция;... число" """
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
@@ -0,0 +1,124 @@
+# search_cache.py - КЭШ РЕЗУЛЬТАТОВ ПОИСКА ПОЕЗДОК
+import os
+import time
+from collections import OrderedDict
+from extract_city import city_key, is_known_city
+
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "15"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+
+def city_part(value: str):
+    """Нормализованная часть ключа кэша для города из запроса.
+
+    Для городов вне справочника поиск идет еще и по тексту адреса,
+    поэтому к ключу добавляется сам текст.
+    """
+    key = city_key(value)
+    if key is None or is_known_city(key):
+        return key, None
+    return key, value.strip().lower()
+
+class SearchCache:
+    """LRU-кэш с TTL и инвалидацией по паре городов и дате"""
+
+    def __init__(self, ttl=SEARCH_CACHE_TTL, max_size=SEARCH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # ключ -> (истекает, значение, группа)
+        self._groups = {}              # (from_key, to_key, дата) -> ключи
+        self._fallback = {}            # дата -> ключи запросов без точной пары городов
+        # Растет при каждой инвалидации: результат, посчитанный до нее, в кэш не кладем
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_size > 0
+
+    def make_key(self, from_city, to_city, date, passengers, max_price, limit, cursor):
+        return (city_part(from_city), city_part(to_city), date, passengers, max_price, limit, cursor)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value, _ = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, generation=None):
+        if not self.enabled:
+            return
+        if generation is not None and generation != self.generation:
+            return
+        (from_key, from_text), (to_key, to_text), date = key[0], key[1], key[2]
+        group = (from_key, to_key, date)
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, value, group)
+        self._groups.setdefault(group, set()).add(key)
+        if from_text is not None or to_text is not None or from_key is None or to_key is None:
+            self._fallback.setdefault(date, set()).add(key)
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def invalidate(self, start_city_key, finish_city_key, date):
+        """Сбросить результаты, в которые могла попасть поездка с этой парой городов и датой"""
+        keys = set(self._groups.get((start_city_key, finish_city_key, date), ()))
+        # Запросы с поиском по адресу или без города могли найти поездку и с другими ключами
+        keys |= self._fallback.get(date, set())
+        for key in keys:
+            self._drop(key)
+        self.invalidations += len(keys)
+        self.generation += 1
+
+    def invalidate_trip(self, trip):
+        self.invalidate(trip.start_city_key, trip.finish_city_key, trip.departure_date.date().isoformat())
+
+    def clear(self):
+        self._entries.clear()
+        self._groups.clear()
+        self._fallback.clear()
+        self.generation += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_sec": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        group = entry[2]
+        keys = self._groups.get(group)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._groups[group]
+        keys = self._fallback.get(group[2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._fallback[group[2]]
+
+search_cache = SearchCache()
@@ -0,0 +1,128 @@
+# slow_queries.py - ЖУРНАЛ МЕДЛЕННЫХ SQL-ЗАПРОСОВ С ПРИВЯЗКОЙ К ЭНДПОИНТУ
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from sqlalchemy import event
+from metrics import current_route
+
+# Порог в миллисекундах; не задан — журнал выключен и к движку ничего не подключается
+SLOW_QUERY_MS = os.getenv("SLOW_QUERY_MS")
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+
+def parameter_shape(parameters):
+    """Типы параметров без значений: в журнал не попадают персональные данные"""
+    if isinstance(parameters, list):
+        return {"executemany": len(parameters), "row": parameter_shape(parameters[0]) if parameters else None}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, tuple):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+class SlowQueryLog:
+    """Кольцевой буфер запросов дольше порога"""
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, size=SLOW_QUERY_LOG_SIZE):
+        self.threshold = float(threshold_ms) / 1000 if threshold_ms not in (None, "") else None
+        self._entries = deque(maxlen=size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._engines = {}  # метка -> Engine или AsyncEngine, на нем же выполняется EXPLAIN
+
+    @property
+    def enabled(self):
+        return self.threshold is not None
+
+    def attach(self, engine, label):
+        """Подписаться на события движка (для AsyncEngine — через sync_engine)"""
+        if not self.enabled:
+            return
+        self._engines[label] = engine
+        sync_engine = getattr(engine, "sync_engine", engine)
+
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+        def after(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info["slow_query_started"].pop()
+            if elapsed >= self.threshold:
+                self.record(label, statement, parameters, elapsed)
+
+        event.listen(sync_engine, "before_cursor_execute", before)
+        event.listen(sync_engine, "after_cursor_execute", after)
+
+    def record(self, label, statement, parameters, elapsed):
+        route = current_route()
+        entry = {
+            "id": next(self._ids),
+            "at": datetime.utcnow().isoformat(),
+            "engine": label,
+            "route": route,
+            "elapsed_ms": round(elapsed * 1000, 2),
+            "statement": statement,
+            "parameters": parameter_shape(parameters),
+        }
+        with self._lock:
+            # Сами значения нужны только для EXPLAIN и наружу не отдаются
+            self._entries.append((entry, parameters))
+        print(f"🐢 Медленный запрос {entry['elapsed_ms']} мс [{route or label}]: {' '.join(statement.split())[:200]}")
+
+    def entries(self):
+        with self._lock:
+            return [entry for entry, _ in reversed(self._entries)]
+
+    def find(self, entry_id):
+        with self._lock:
+            for entry, parameters in self._entries:
+                if entry["id"] == entry_id:
+                    return entry, parameters
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    async def explain(self, entry_id, analyze=False):
+        """План запроса из журнала: EXPLAIN QUERY PLAN (SQLite) или EXPLAIN [ANALYZE] (Postgres)"""
+        found = self.find(entry_id)
+        if found is None:
+            return None
+        entry, parameters = found
+        engine = self._engines[entry["engine"]]
+        dialect = engine.dialect.name
+        if dialect == "sqlite":
+            prefix = "EXPLAIN QUERY PLAN "
+        elif analyze:
+            # ANALYZE выполняет запрос: только чтение и только внутри отката
+            if not entry["statement"].lstrip().upper().startswith(("SELECT", "WITH")):
+                raise ValueError("EXPLAIN ANALYZE разрешен только для SELECT")
+            prefix = "EXPLAIN (ANALYZE, BUFFERS) "
+        else:
+            prefix = "EXPLAIN "
+        statement = prefix + entry["statement"]
+        if isinstance(parameters, list):
+            parameters = parameters[0] if parameters else ()
+
+        if hasattr(engine, "sync_engine"):
+            async with engine.connect() as conn:
+                rows = (await conn.exec_driver_sql(statement, parameters)).all()
+                await conn.rollback()
+        else:
+            def run():
+                with engine.connect() as conn:
+                    result = conn.exec_driver_sql(statement, parameters).all()
+                    conn.rollback()
+                    return result
+            rows = await asyncio.to_thread(run)
+        return {
+            "id": entry["id"],
+            "dialect": dialect,
+            "analyze": analyze and dialect != "sqlite",
+            "plan": [list(row) for row in rows],
+        }
+
+slow_query_log = SlowQueryLog()
@@ -13,6 +13,9 @@ def run_server():
 
 def run_bot():
     """Запуск Telegram бота"""
+    if os.getenv("TELEGRAM_WEBHOOK_URL"):
+        print("🤖 Telegram бот работает внутри API через webhook — отдельный процесс не нужен")
+        return
     print("🤖 Запуск Telegram бота...")
     time.sleep(2)  # Даем серверу запуститься
     os.system("python minimal_bot.py")
@@ -0,0 +1,143 @@
+# stress_booking.py - НАГРУЗОЧНАЯ ПРОВЕРКА ПАРАЛЛЕЛЬНЫХ БРОНИРОВАНИЙ И ОТМЕН ОДНОЙ ПОЕЗДКИ
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Параллельные брони и отмены одной поездки: пропускная способность и перепродажа мест")
+    parser.add_argument("--requests", type=int, default=300, help="Сколько пассажиров бронируют одновременно")
+    parser.add_argument("--seats", type=int, default=50, help="Свободных мест в поездке")
+    parser.add_argument("--cancel-share", type=float, default=0.5, help="Доля успешных броней, отменяемых во второй волне")
+    parser.add_argument("--concurrency", type=int, default=100, help="Одновременных запросов в полете")
+    parser.add_argument("--database-url", default=None, help="База для проверки (по умолчанию временная SQLite)")
+    return parser.parse_args()
+
+def seed(database, passengers, seats):
+    """Водитель с одной поездкой и passengers пассажиров"""
+    db = database.SessionLocal()
+    try:
+        driver = database.User(telegram_id=1, first_name="Водитель", has_car=True, role=database.UserRole.DRIVER)
+        db.add(driver)
+        db.add_all([
+            database.User(telegram_id=100000 + i, first_name=f"Пассажир{i}")
+            for i in range(passengers)
+        ])
+        db.flush()
+        trip = database.DriverTrip(
+            driver_id=driver.id,
+            departure_date=datetime.utcnow() + timedelta(days=1),
+            departure_time="09:00",
+            start_address="Москва",
+            finish_address="Тула",
+            available_seats=seats,
+            price_per_seat=500
+        )
+        db.add(trip)
+        db.commit()
+        return trip.id
+    finally:
+        db.close()
+
+async def fire(app, trip_id, passengers, concurrency, cancel_share):
+    """Первая волна — все брони параллельно; вторая — отмены части броней (каждая дважды)
+    вперемешку с повторными бронями тех, кому мест не хватило. Вернуть коды ответов и время"""
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://stress") as client:
+        async def book(i):
+            async with semaphore:
+                response = await client.post(
+                    "/api/bookings/create",
+                    params={"telegram_id": 100000 + i},
+                    json={"driver_trip_id": trip_id, "booked_seats": 1}
+                )
+                return i, response.status_code, response.json().get("booking_id")
+
+        async def cancel(i, booking_id):
+            async with semaphore:
+                response = await client.post(f"/api/bookings/{booking_id}/cancel", params={"telegram_id": 100000 + i})
+                return response.status_code
+
+        started = time.perf_counter()
+        booked = await asyncio.gather(*(book(i) for i in range(passengers)))
+        booking_elapsed = time.perf_counter() - started
+
+        succeeded = [(i, booking_id) for i, status, booking_id in booked if status == 200]
+        cancelled = succeeded[:int(len(succeeded) * cancel_share)]
+        retried = [i for i, status, _ in booked if status != 200]
+        started = time.perf_counter()
+        mixed = await asyncio.gather(
+            *(cancel(i, booking_id) for i, booking_id in cancelled for _ in range(2)),
+            *(book(i) for i in retried)
+        )
+        mixed_elapsed = time.perf_counter() - started
+
+        cancel_statuses = mixed[:2 * len(cancelled)]
+        rebook_statuses = [status for _, status, _ in mixed[2 * len(cancelled):]]
+        return {
+            "booking": [status for _, status, _ in booked],
+            "cancel": cancel_statuses,
+            "rebooking": rebook_statuses,
+        }, booking_elapsed, mixed_elapsed
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'stress.db')}"
+
+    from sqlalchemy import func
+    import database
+    import main as api
+
+    database.create_tables()
+    trip_id = seed(database, args.requests, args.seats)
+
+    statuses, elapsed, mixed_elapsed = asyncio.run(
+        fire(api.app, trip_id, args.requests, args.concurrency, args.cancel_share)
+    )
+
+    db = database.SessionLocal()
+    try:
+        trip = db.query(database.DriverTrip).filter(database.DriverTrip.id == trip_id).one()
+        booked = db.query(func.coalesce(func.sum(database.Booking.booked_seats), 0)).filter(
+            database.Booking.driver_trip_id == trip_id,
+            database.Booking.status == database.TripStatus.ACTIVE
+        ).scalar()
+        report = {
+            "requests": args.requests,
+            "seats": args.seats,
+            "concurrency": args.concurrency,
+            "elapsed_sec": round(elapsed, 3),
+            "throughput_rps": round(args.requests / elapsed, 1),
+            "mixed_elapsed_sec": round(mixed_elapsed, 3),
+            "status_codes": {wave: dict(Counter(codes)) for wave, codes in statuses.items()},
+            "booked_seats": booked,
+            "available_seats_left": trip.available_seats,
+            "trip_status": trip.status.value,
+            "oversell": max(0, booked - args.seats) + max(0, -trip.available_seats),
+        }
+    finally:
+        db.close()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if report["oversell"] or booked + trip.available_seats != args.seats:
+        print("❌ Места перепроданы или счетчик мест разошелся с бронированиями")
+        raise SystemExit(1)
+    # Из двух одновременных отмен одной брони проходит ровно одна
+    if statuses["cancel"].count(200) * 2 != len(statuses["cancel"]):
+        print("❌ Повторная отмена брони прошла второй раз")
+        raise SystemExit(1)
+    if (trip.available_seats == 0) != (trip.status == database.TripStatus.COMPLETED):
+        print("❌ Статус поездки не соответствует оставшимся местам")
+        raise SystemExit(1)
+    print("✅ Перепродажи нет, места отмен вернулись ровно один раз")
+
+if __name__ == "__main__":
+    main()
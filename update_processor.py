@@ -0,0 +1,54 @@
+# update_processor.py - ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА ОБНОВЛЕНИЙ БОТА С ПОРЯДКОМ ВНУТРИ ЧАТА
+import asyncio
+import sys
+from typing import Any, Awaitable, Dict
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Не больше workers обработчиков одновременно; обновления одного чата — строго по очереди"""
+
+    __slots__ = ("workers", "_workers", "_chats")
+
+    def __init__(self, workers: int):
+        if workers < 1:
+            raise ValueError("workers должно быть положительным")
+        # Предел базового класса (process_update, final) берется до do_process_update: ждущие своей
+        # очереди обновления одного чата занимали бы места пула. Поэтому базовому классу — без предела
+        # через публичный max_concurrent_updates, а workers ограничиваем сами, уже после блокировки чата
+        super().__init__(max_concurrent_updates=sys.maxsize)
+        self.workers = workers
+        self._workers = asyncio.Semaphore(workers)
+        # chat_id -> [блокировка, сколько обновлений чата в работе или ждут]
+        self._chats: Dict[int, list] = {}
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._workers:
+                await coroutine
+            return
+
+        # До первого await: задачи Application создаются в порядке очереди,
+        # а asyncio.Lock отдает блокировку ждущим в порядке прихода
+        entry = self._chats.get(chat.id)
+        if entry is None:
+            entry = self._chats[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._workers:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat.id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self):
+        return {"workers": self.workers, "active_chats": len(self._chats)}